@@ -1,5 +1,7 @@
+from arxiv_bot.callbacks import FinalAnswerStreamHandler
 from arxiv_bot.functions import (
-    clear_pdf,
+    clear_session,
+    collect_garbage,
     init_file_upload,
     process_pdf_upload,
     load_bot,
@@ -20,11 +22,18 @@ try:
 except:
     pass
 
+COLLECTION_NAME = "arxiv"
+PERSIST_DIR = "arxiv_vdb"
+
 
 @cl.on_settings_update
 async def on_settings_update(settings: dict):
-    vectordb = cl.user_session.get("vectordb")
     cl.user_session.set("settings", settings)
+    load_vectordb(
+        collection_name=COLLECTION_NAME,
+        persist_dir=PERSIST_DIR,
+    )
+    vectordb = cl.user_session.get("vectordb")
     cl.user_session.set(
         "pdf_processor",
         ProcessPDF(
@@ -32,6 +41,9 @@ async def on_settings_update(settings: dict):
             settings["pdf_parser"],
             int(settings["chunk_size"]),
             int(settings["chunk_overlap"]),
+            settings["segmenter"],
+            scope=cl.user_session.get("id"),
+            chunker=settings["chunker"],
         ),
     )
 
@@ -40,10 +52,6 @@ async def on_settings_update(settings: dict):
 
 @cl.on_chat_start
 async def start():
-    COLLECTION_NAME = "arxiv"
-    PERSIST_DIR = "arxiv_vdb"
-
-    clear_pdf()
     os.makedirs("./pdfs", exist_ok=True)
     os.makedirs("./output", exist_ok=True)
     await init_chat_settings()
@@ -52,6 +60,7 @@ async def start():
         collection_name=COLLECTION_NAME,
         persist_dir=PERSIST_DIR,
     )
+    await cl.make_async(collect_garbage)(cl.user_session.get("vectordb"))
     load_bot()
 
 
@@ -64,8 +73,12 @@ async def main(query: cl.Message):
             [file for file in query.elements if file.mime == "application/pdf"]
         )
 
-    response = await bot.acall({"input": query.content})  # type: ignore
-    answer = cl.Message(content=response["output"])
+    # The final answer is streamed as the LLM writes it, then replaced by the parsed output.
+    answer = cl.Message(content="")
+    stream_handler = FinalAnswerStreamHandler(answer.stream_token)
+    response = await bot.acall({"input": query.content}, callbacks=[stream_handler])  # type: ignore
+    cl.user_session.get("context_packer").end_turn()
+    answer.content = response["output"]
     intermediate_steps = response["intermediate_steps"]
 
     # Get sources
@@ -98,48 +111,8 @@ async def main(query: cl.Message):
     await answer.send()
 
 
-# @cl.on_message
-# async def main(query):
-#     FINAL_ANSWER_PREFIX = '{\n    "action": "Final Answer",\n    "action_input": "'
-#     bot = cl.user_session.get('bot')
-#     answer = cl.Message(content="")
-#     answer_temp = ""
-#     refs = ""
-
-#     stream = bot.astream_log({"input": query.content}, include_names=['ChatOpenAI']) #type: ignore
-#     async for chunk in stream:
-#         val = chunk.ops[0]
-#         # print(val['value'])
-#         if 'intermediate_steps' in val['value']:
-#             intermediate_steps = val['value']['intermediate_steps']
-#             if len(intermediate_steps) > 0 and isinstance(intermediate_steps, list):
-#                 for step in intermediate_steps:
-#                     action = step[0]
-#                     output = step[1]
-#                     print(action, output)
-
-#                     if action.tool == 'retriever' or action.tool == 'retriever_with_search':
-#                         refs_list = []
-#                         for doc in output:
-#                             refs_list.append(f"\n{doc.metadata['title']}, arXiv ID: {doc.metadata['paper_id']}\n")
-
-#                         refs += ''.join(set(refs_list))
-#                         if refs != '':
-#                             refs = f"\n\nReferences: {refs}"
-
-#         elif isinstance(val['value'], str):
-#             if FINAL_ANSWER_PREFIX in answer_temp:
-#                 new_val = val['value'].replace('"', '').replace('}', '')
-#                 await answer.stream_token(new_val)
-#                 print(answer.content)
-#             else:
-#                 answer_temp += val['value']
-#         else:
-#             continue
-#     answer.content += refs
-#     await answer.send()
-
-
 @cl.on_chat_end
-def on_chat_end():
-    pass
+async def on_chat_end():
+    vectordb = cl.user_session.get("vectordb")
+    if vectordb is not None:
+        await cl.make_async(clear_session)(vectordb, cl.user_session.get("id"))
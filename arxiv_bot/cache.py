@@ -0,0 +1,624 @@
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+from typing import Any, List, Tuple, Union
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+import sqlite3
+import threading
+import time
+
+logger_embedding_cache = logging.getLogger("EmbeddingCache")
+logger_embedding_cache.setLevel(logging.INFO)
+
+
+def cache_path(name: str) -> str:
+    """
+    Get the path of a cache database in the directory set by the CACHE_DIR environment variable.
+
+    The variable is read when a database is first opened, not on import, so a .env file
+    loaded later still applies.
+
+    :param name: The file name of the database.
+    :type name: str
+
+    :return: The path. CACHE_DIR defaults to ``./cache``.
+    :rtype: str
+    """
+    return os.path.join(os.environ.get("CACHE_DIR", "./cache"), name)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that stores every computed vector in a local SQLite database.
+
+    Vectors are keyed by the embedding model name and the SHA-256 of the text, so the
+    same chunk is only ever embedded once per model, across sessions and restarts.
+    The least recently used entries are evicted once the cache holds more than
+    ``max_entries`` vectors.
+
+    :param embeddings: The underlying embeddings used on a cache miss.
+    :type embeddings: Embeddings
+    :param model: The name of the embedding model, used as part of the cache key.
+    :type model: str
+    :param path: The path to the SQLite database, opened on first use. Defaults to ``embeddings.sqlite`` in CACHE_DIR.
+    :type path: str
+    :param max_entries: The maximum number of vectors kept in the cache. Defaults to 200000.
+    :type max_entries: int
+
+    :ivar hits: The number of texts served from the cache.
+    :vartype hits: int
+    :ivar misses: The number of texts sent to the underlying embeddings.
+    :vartype misses: int
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model: str,
+        path: Union[str, None] = None,
+        max_entries: int = 200_000,
+    ):
+        """
+        Constructor for the CachedEmbeddings object.
+        """
+        self.embeddings = embeddings
+        self.model = model
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection: Union[sqlite3.Connection, None] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open the database, creating it and its tables if needed.
+
+        :return: The connection.
+        :rtype: sqlite3.Connection
+        """
+        self.path = self.path or cache_path("embeddings.sqlite")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, hash)
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        conn.commit()
+        return conn
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """
+        Get the connection to the database, opening it on first use. The caller holds the lock.
+
+        :return: The connection.
+        :rtype: sqlite3.Connection
+        """
+        if self._connection is None:
+            self._connection = self._connect()
+        return self._connection
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        """
+        Hash a text into its cache key.
+
+        :param text: The text to hash.
+        :type text: str
+
+        :return: The hex digest of the SHA-256 of the text.
+        :rtype: str
+        """
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _lookup(self, hashes: List[str]) -> dict[str, List[float]]:
+        """
+        Look up cached vectors and mark them as recently used.
+
+        :param hashes: The hashes of the texts to look up.
+        :type hashes: List[str]
+
+        :return: A mapping from hash to vector for every cached text.
+        :rtype: dict[str, List[float]]
+        """
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # SQLite limits the number of bound parameters per statement.
+            for start in range(0, len(unique), 500):
+                batch = unique[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [self.model, *batch],
+                ).fetchall()
+                for hash, vector in rows:
+                    found[hash] = np.frombuffer(vector, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(now, self.model, hash) for hash in found],
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, vectors: dict[str, List[float]]):
+        """
+        Store new vectors and evict the least recently used ones if the cache is full.
+
+        :param vectors: A mapping from hash to vector.
+        :type vectors: dict[str, List[float]]
+        """
+        if not vectors:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [
+                    (self.model, hash, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                    for hash, vector in vectors.items()
+                ],
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    """
+                    DELETE FROM embeddings WHERE rowid IN (
+                        SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?
+                    )
+                    """,
+                    (count - self.max_entries,),
+                )
+                logger_embedding_cache.info(
+                    f"Evicted {count - self.max_entries} embeddings from the cache."
+                )
+            self._conn.commit()
+
+    def _split(self, texts: List[str]):
+        """
+        Split texts into cached vectors and texts that still have to be embedded.
+
+        :param texts: The texts to embed.
+        :type texts: List[str]
+
+        :return: The hashes of all texts, the cached vectors and the texts to embed (de-duplicated).
+        :rtype: Tuple[List[str], dict[str, List[float]], dict[str, str]]
+        """
+        hashes = [self._hash(text) for text in texts]
+        cached = self._lookup(hashes)
+        missing = {}
+        for hash, text in zip(hashes, texts):
+            if hash not in cached:
+                missing.setdefault(hash, text)
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return hashes, cached, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of documents, only sending uncached texts to the underlying embeddings.
+
+        :param texts: The texts to embed.
+        :type texts: List[str]
+
+        :return: The embeddings, in the same order as the texts.
+        :rtype: List[List[float]]
+        """
+        hashes, cached, missing = self._split(texts)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new = dict(zip(missing.keys(), vectors))
+            self._store(new)
+            cached.update(new)
+        return [cached[hash] for hash in hashes]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Asynchronously embed a list of documents, only sending uncached texts to the underlying embeddings.
+
+        :param texts: The texts to embed.
+        :type texts: List[str]
+
+        :return: The embeddings, in the same order as the texts.
+        :rtype: List[List[float]]
+        """
+        hashes, cached, missing = self._split(texts)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            new = dict(zip(missing.keys(), vectors))
+            self._store(new)
+            cached.update(new)
+        return [cached[hash] for hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query.
+
+        :param text: The query to embed.
+        :type text: str
+
+        :return: The embedding of the query.
+        :rtype: List[float]
+        """
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Asynchronously embed a query.
+
+        :param text: The query to embed.
+        :type text: str
+
+        :return: The embedding of the query.
+        :rtype: List[float]
+        """
+        return (await self.aembed_documents([text]))[0]
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """
+        Get the hit/miss counters of the cache.
+
+        :return: The number of hits and misses since the cache was created.
+        :rtype: dict[str, int]
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class SemanticQueryCache:
+    """
+    Cache of retrieval results keyed by query embedding.
+
+    A query hits the cache when the cosine similarity between its embedding and the embedding
+    of a cached query of the same namespace reaches the threshold. The least recently used
+    entries are evicted once the cache is full, and the whole cache is invalidated whenever
+    the indexed collection changes. Every invalidation starts a new generation, and results
+    computed during an older generation are not cached, since they may refer to deleted
+    chunks or miss new ones.
+
+    :param threshold: The minimum cosine similarity of a hit. Defaults to 0.95.
+    :type threshold: float
+    :param max_entries: The maximum number of cached queries. Defaults to 1024.
+    :type max_entries: int
+
+    :ivar hits: The number of hits since the process started.
+    :vartype hits: int
+    :ivar misses: The number of misses since the process started.
+    :vartype misses: int
+    :ivar generation: The number of invalidations since the process started.
+    :vartype generation: int
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1024):
+        """
+        Constructor for the SemanticQueryCache object.
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, Tuple[str, List[str]]] = OrderedDict()
+        self._vectors: Union[np.ndarray, None] = None
+        self._free: List[int] = list(range(max_entries))
+        self._namespace_stats: dict[str, dict[str, int]] = {}
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        """
+        Normalize an embedding to unit length.
+
+        :param embedding: The embedding.
+        :type embedding: List[float]
+
+        :return: The normalized embedding.
+        :rtype: np.ndarray
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _record(self, namespace: str, hit: bool):
+        """
+        Update the hit/miss counters of the process and of a namespace.
+
+        :param namespace: The namespace of the lookup.
+        :type namespace: str
+        :param hit: Whether the lookup was a hit.
+        :type hit: bool
+        """
+        stats = self._namespace_stats.setdefault(namespace, {"hits": 0, "misses": 0})
+        if hit:
+            self.hits += 1
+            stats["hits"] += 1
+        else:
+            self.misses += 1
+            stats["misses"] += 1
+
+    def get(self, embedding: List[float], namespace: str) -> Union[List[str], None]:
+        """
+        Look up the results of the most similar cached query.
+
+        :param embedding: The embedding of the query.
+        :type embedding: List[float]
+        :param namespace: The namespace of the query, e.g. the retriever configuration and session.
+        :type namespace: str
+
+        :return: The cached chunk IDs, or None on a miss.
+        :rtype: Union[List[str], None]
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            slots = [
+                slot for slot, (ns, _) in self._entries.items() if ns == namespace
+            ]
+            if (
+                not slots
+                or self._vectors is None
+                or self._vectors.shape[1] != query.shape[0]
+            ):
+                self._record(namespace, False)
+                return None
+
+            similarities = self._vectors[slots] @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self._record(namespace, False)
+                return None
+
+            slot = slots[best]
+            self._entries.move_to_end(slot)
+            self._record(namespace, True)
+            return list(self._entries[slot][1])
+
+    def put(
+        self,
+        embedding: List[float],
+        namespace: str,
+        chunk_ids: List[str],
+        generation: Union[int, None] = None,
+    ):
+        """
+        Cache the results of a query.
+
+        :param embedding: The embedding of the query.
+        :type embedding: List[float]
+        :param namespace: The namespace of the query.
+        :type namespace: str
+        :param chunk_ids: The IDs of the retrieved chunks, in order.
+        :type chunk_ids: List[str]
+        :param generation: The generation read before the results were retrieved. The results are dropped if the cache was invalidated since. Defaults to None (always cache).
+        :type generation: Union[int, None]
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if self._vectors is None or self._vectors.shape[1] != query.shape[0]:
+                self._vectors = np.zeros(
+                    (self.max_entries, query.shape[0]), dtype=np.float32
+                )
+                self._entries.clear()
+                self._free = list(range(self.max_entries))
+
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot, _ = self._entries.popitem(last=False)
+            self._vectors[slot] = query
+            self._entries[slot] = (namespace, list(chunk_ids))
+
+    def invalidate(self):
+        """
+        Drop every cached result, e.g. after documents were added to or deleted from the collection.
+        """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._free = list(range(self.max_entries))
+
+    def stats(self, namespace: Union[str, None] = None) -> dict[str, float]:
+        """
+        Get the hit/miss counters of the process or of a namespace.
+
+        :param namespace: The namespace, or None for the whole process.
+        :type namespace: Union[str, None]
+
+        :return: The number of hits and misses and the hit rate.
+        :rtype: dict[str, float]
+        """
+        if namespace is None:
+            stats = {"hits": self.hits, "misses": self.misses}
+        else:
+            stats = dict(
+                self._namespace_stats.get(namespace, {"hits": 0, "misses": 0})
+            )
+        total = stats["hits"] + stats["misses"]
+        return {**stats, "hit_rate": stats["hits"] / total if total else 0.0}
+
+
+class TTLCache:
+    """
+    Persistent key-value cache with per-namespace expiry, stored in a local SQLite database.
+
+    Values are serialized as JSON. Expired entries are ignored on lookup and purged on write.
+
+    :param path: The path to the SQLite database, opened on first use. Defaults to ``lookups.sqlite`` in CACHE_DIR.
+    :type path: str
+    :param ttls: The time to live in seconds of each namespace. Namespaces that are not listed never expire.
+    :type ttls: dict[str, float]
+
+    :ivar hits: The number of keys served from the cache.
+    :vartype hits: int
+    :ivar misses: The number of keys that were not cached or expired.
+    :vartype misses: int
+    """
+
+    def __init__(
+        self, path: Union[str, None] = None, ttls: Union[dict[str, float], None] = None
+    ):
+        """
+        Constructor for the TTLCache object.
+        """
+        self.path = path
+        self.ttls = ttls or {}
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection: Union[sqlite3.Connection, None] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open the database, creating it and its tables if needed.
+
+        :return: The connection.
+        :rtype: sqlite3.Connection
+        """
+        self.path = self.path or cache_path("lookups.sqlite")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS lookups (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+        conn.commit()
+        return conn
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """
+        Get the connection to the database, opening it on first use. The caller holds the lock.
+
+        :return: The connection.
+        :rtype: sqlite3.Connection
+        """
+        if self._connection is None:
+            self._connection = self._connect()
+        return self._connection
+
+    def get_many(self, namespace: str, keys: List[str]) -> dict[str, Any]:
+        """
+        Look up unexpired values.
+
+        :param namespace: The namespace of the keys.
+        :type namespace: str
+        :param keys: The keys to look up.
+        :type keys: List[str]
+
+        :return: A mapping from key to value for every cached key.
+        :rtype: dict[str, Any]
+        """
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        now = time.time()
+        with self._lock:
+            # SQLite limits the number of bound parameters per statement.
+            for start in range(0, len(unique), 500):
+                batch = unique[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM lookups WHERE namespace = ? AND expires_at > ? AND key IN ({placeholders})",
+                    [namespace, now, *batch],
+                ).fetchall()
+                for key, value in rows:
+                    found[key] = json.loads(value)
+
+        self.hits += len(found)
+        self.misses += len(unique) - len(found)
+        return found
+
+    def get(self, namespace: str, key: str) -> Any:
+        """
+        Look up an unexpired value.
+
+        :param namespace: The namespace of the key.
+        :type namespace: str
+        :param key: The key to look up.
+        :type key: str
+
+        :return: The cached value, or None on a miss.
+        :rtype: Any
+        """
+        return self.get_many(namespace, [key]).get(key)
+
+    def put_many(self, namespace: str, values: dict[str, Any]):
+        """
+        Store values and purge the expired entries.
+
+        :param namespace: The namespace of the keys.
+        :type namespace: str
+        :param values: A mapping from key to JSON-serializable value.
+        :type values: dict[str, Any]
+        """
+        if not values:
+            return
+        now = time.time()
+        expires_at = now + self.ttls.get(namespace, float("inf"))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO lookups (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                [
+                    (namespace, key, json.dumps(value), expires_at)
+                    for key, value in values.items()
+                ],
+            )
+            self._conn.execute("DELETE FROM lookups WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+
+    def put(self, namespace: str, key: str, value: Any):
+        """
+        Store a value.
+
+        :param namespace: The namespace of the key.
+        :type namespace: str
+        :param key: The key.
+        :type key: str
+        :param value: The JSON-serializable value.
+        :type value: Any
+        """
+        self.put_many(namespace, {key: value})
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """
+        Get the hit/miss counters of the cache.
+
+        :return: The number of hits and misses since the cache was created.
+        :rtype: dict[str, int]
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+
+query_cache = SemanticQueryCache(
+    threshold=float(os.environ.get("QUERY_CACHE_THRESHOLD", 0.95)),
+    max_entries=int(os.environ.get("QUERY_CACHE_SIZE", 1024)),
+)
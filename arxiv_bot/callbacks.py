@@ -0,0 +1,170 @@
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.messages import BaseMessage
+from typing import Any, Awaitable, Callable, List, Optional
+from uuid import UUID
+import json
+import logging
+import re
+import time
+
+logger_stream = logging.getLogger("FinalAnswerStreamHandler")
+logger_stream.setLevel(logging.INFO)
+
+
+class FinalAnswerParser:
+    """
+    Incremental parser of the JSON blob written by the conversational ReAct agent.
+
+    Tokens are fed as they are generated. Once the blob turns out to be a "Final Answer"
+    action, the "action_input" string is decoded as it arrives, so the answer can be shown
+    before the LLM finishes. Tool calls yield nothing. Escape sequences split across tokens
+    are held back until they are complete.
+    """
+
+    _ACTION = re.compile(r'"action"\s*:\s*"((?:[^"\\]|\\.)*)"')
+    _ACTION_INPUT = re.compile(r'"action_input"\s*:\s*"')
+    # Characters an escape sequence starting with each letter needs, backslash included.
+    _ESCAPE_LENGTHS = {"u": 6}
+
+    def __init__(self):
+        """
+        Constructor for the FinalAnswerParser object.
+        """
+        self.buffer = ""
+        self.state = "action"
+        self._position = 0
+
+    def _decode(self) -> str:
+        """
+        Decode the complete part of the answer string that was not decoded yet.
+
+        :return: The decoded text.
+        :rtype: str
+        """
+        decoded = []
+        buffer, i = self.buffer, self._position
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.state = "done"
+                i += 1
+                break
+            if char != "\\":
+                end = i + 1
+                while end < len(buffer) and buffer[end] not in '"\\':
+                    end += 1
+                decoded.append(buffer[i:end])
+                i = end
+                continue
+
+            if i + 1 >= len(buffer):
+                break
+            length = self._ESCAPE_LENGTHS.get(buffer[i + 1], 2)
+            sequence = buffer[i : i + length]
+            if len(sequence) < length:
+                break
+            if length == 6 and 0xD800 <= int(sequence[2:], 16) <= 0xDBFF:
+                # A high surrogate is only decodable together with the low surrogate after it.
+                sequence = buffer[i : i + 12]
+                if len(sequence) < 12:
+                    break
+                length = 12
+            decoded.append(json.loads(f'"{sequence}"'))
+            i += length
+        self._position = i
+        return "".join(decoded)
+
+    def feed(self, token: str) -> str:
+        """
+        Parse the next token of the LLM.
+
+        :param token: The token.
+        :type token: str
+
+        :return: The text of the final answer completed by this token, "" if there is none.
+        :rtype: str
+        """
+        if self.state == "done":
+            return ""
+        self.buffer += token
+
+        if self.state == "action":
+            match = self._ACTION.search(self.buffer)
+            if match is None:
+                return ""
+            if json.loads(f'"{match.group(1)}"') != "Final Answer":
+                self.state = "done"
+                return ""
+            self.state = "action_input"
+            self._position = match.end()
+
+        if self.state == "action_input":
+            match = self._ACTION_INPUT.search(self.buffer, self._position)
+            if match is None:
+                return ""
+            self.state = "answer"
+            self._position = match.end()
+
+        return self._decode()
+
+
+class FinalAnswerStreamHandler(AsyncCallbackHandler):
+    """
+    Streams the final answer of the agent while the LLM is still writing it.
+
+    Every LLM call of the agent gets its own FinalAnswerParser, and only the decoded
+    "action_input" of a "Final Answer" blob is passed on, so tool calls and the JSON around
+    the answer are never shown. Requires an LLM created with streaming=True.
+
+    :param stream: The coroutine each piece of the answer is passed to, e.g. cl.Message.stream_token.
+    :type stream: Callable[[str], Awaitable[Any]]
+
+    :ivar streamed: Whether any part of a final answer was streamed.
+    :vartype streamed: bool
+    :ivar time_to_first_token: The seconds from the creation of the handler to the first streamed piece of the answer, None if nothing was streamed.
+    :vartype time_to_first_token: Optional[float]
+    """
+
+    def __init__(self, stream: Callable[[str], Awaitable[Any]]):
+        """
+        Constructor for the FinalAnswerStreamHandler object.
+        """
+        self.stream = stream
+        self.streamed = False
+        self.time_to_first_token: Optional[float] = None
+        self._start = time.perf_counter()
+        self._parsers: dict[UUID, FinalAnswerParser] = {}
+
+    async def on_llm_start(
+        self, serialized: dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._parsers[run_id] = FinalAnswerParser()
+
+    async def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: List[List[BaseMessage]],
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        self._parsers[run_id] = FinalAnswerParser()
+
+    async def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        parser = self._parsers.get(run_id)
+        if parser is None:
+            return
+        text = parser.feed(token)
+        if not text:
+            return
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self._start
+            logger_stream.info(f"First token of the final answer after {self.time_to_first_token:.2f}s")
+        self.streamed = True
+        await self.stream(text)
+
+    async def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._parsers.pop(run_id, None)
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._parsers.pop(run_id, None)
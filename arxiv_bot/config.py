@@ -16,6 +16,8 @@ class RetrieverWithSearchConfig:
     KEYS: list = [
         "chunk_size",
         "chunk_overlap",
+        "segmenter",
+        "chunker",
         "search_k",
         "fetch_k",
         "k",
@@ -0,0 +1,345 @@
+from arxiv_bot.ingest import count_tokens
+from arxiv_bot.parents import join_chunks, overlap_length
+from langchain.schema.document import Document
+from typing import List, Tuple, Union
+import logging
+import os
+import re
+
+logger_context_packer = logging.getLogger("ContextPacker")
+logger_context_packer.setLevel(logging.INFO)
+
+# Context windows in tokens of the models offered in the chat settings.
+CONTEXT_WINDOWS = {
+    "gpt-4-0125-preview": 128_000,
+    "gpt-4-turbo-preview": 128_000,
+    "gpt-4-1106-preview": 128_000,
+    "gpt-4": 8_192,
+    "gpt-4-0613": 8_192,
+    "gpt-4-32k": 32_768,
+    "gpt-4-32k-0613": 32_768,
+    "gpt-3.5-turbo-0125": 16_385,
+    "gpt-3.5-turbo": 16_385,
+    "gpt-3.5-turbo-1106": 16_385,
+    "gpt-3.5-turbo-instruct": 4_096,
+    "gpt-3.5-turbo-16k": 16_385,
+    "gpt-3.5-turbo-0613": 4_096,
+    "gpt-3.5-turbo-16k-0613": 16_385,
+}
+
+# The metadata the LLM needs to cite a document. The rest (abstract, chunk IDs, timestamps)
+# is repeated for every chunk of a paper and only costs tokens.
+CONTEXT_METADATA = ("title", "paper_id", "authors", "date", "section")
+
+_CHUNK_INDEX = re.compile(r"-(\d+)-[0-9a-f]{16}$")
+
+
+def context_budget(model: str) -> int:
+    """
+    Get the number of tokens of retrieved context a single tool call may return.
+
+    The budget is a fraction of the context window of the model, which also holds the
+    prompt, the chat history and the other tool calls of the turn, capped so that large
+    windows are not filled just because they can be.
+
+    :param model: The name of the chat model.
+    :type model: str
+
+    :return: The budget in tokens. CONTEXT_BUDGET_FRACTION (default 0.25) of the window, at most CONTEXT_MAX_TOKENS (default 4000). Unknown models are assumed to have a 4096 token window.
+    :rtype: int
+    """
+    window = CONTEXT_WINDOWS.get(model, 4_096)
+    fraction = float(os.environ.get("CONTEXT_BUDGET_FRACTION", 0.25))
+    return min(int(window * fraction), int(os.environ.get("CONTEXT_MAX_TOKENS", 4000)))
+
+
+class ContextPacker:
+    """
+    Packs retrieved documents into a token budget before they are handed to the LLM.
+
+    Documents are expected in order of relevance. Duplicates and documents contained in a
+    more relevant one are dropped, then chunks of the same paper that follow each other
+    (consecutive chunk IDs, or the end of one repeating the start of the other) are merged,
+    keeping their overlap once. Finally documents are added by relevance as long as they fit
+    the budget, measured with the cl100k_base tokenizer on the text the agent shows the LLM.
+
+    :param max_tokens: The token budget of a call to pack.
+    :type max_tokens: int
+    :param max_overlap: The longest overlap between consecutive chunks, in characters. Defaults to 200.
+    :type max_overlap: int
+    :param metadata_keys: The metadata kept on packed documents. Defaults to CONTEXT_METADATA.
+    :type metadata_keys: Tuple[str, ...]
+
+    :ivar totals: The documents and tokens before and after packing, summed over every call. The tokens saved are split into "tokens_deduped" (duplicates and merges), "tokens_trimmed" (metadata) and "tokens_over_budget" (documents left out or truncated).
+    :vartype totals: dict[str, int]
+    :ivar turn: The same counts for the calls since the last end_turn.
+    :vartype turn: dict[str, int]
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        max_overlap: int = 200,
+        metadata_keys: Tuple[str, ...] = CONTEXT_METADATA,
+    ):
+        """
+        Constructor for the ContextPacker object.
+        """
+        self.max_tokens = max_tokens
+        self.max_overlap = max_overlap
+        self.metadata_keys = metadata_keys
+        self.totals = self._zero_stats()
+        self.turn = self._zero_stats()
+
+    @classmethod
+    def for_model(cls, model: str, chunk_overlap: int) -> "ContextPacker":
+        """
+        Build the packer of a chat model, see context_budget.
+
+        :param model: The name of the chat model.
+        :type model: str
+        :param chunk_overlap: The overlap between consecutive chunks the documents were indexed with.
+        :type chunk_overlap: int
+
+        :return: The packer.
+        :rtype: ContextPacker
+        """
+        return cls(context_budget(model), max_overlap=2 * chunk_overlap)
+
+    @staticmethod
+    def _zero_stats() -> dict[str, int]:
+        """
+        Get empty packing statistics.
+
+        :return: The statistics, all zero.
+        :rtype: dict[str, int]
+        """
+        return dict.fromkeys(
+            [
+                "calls",
+                "documents_in",
+                "documents_out",
+                "tokens_in",
+                "tokens_out",
+                "tokens_deduped",
+                "tokens_trimmed",
+                "tokens_over_budget",
+                "duplicates",
+                "merged",
+                "over_budget",
+            ],
+            0,
+        )
+
+    @staticmethod
+    def _chunk_index(doc: Document) -> Union[int, None]:
+        """
+        Get the position of a chunk in its paper from its chunk ID.
+
+        :param doc: The document.
+        :type doc: Document
+
+        :return: The position, or None for parent spans and documents without a chunk ID.
+        :rtype: Union[int, None]
+        """
+        if "parent_id" in doc.metadata:
+            return None
+        match = _CHUNK_INDEX.search(doc.metadata.get("chunk_id", ""))
+        return int(match.group(1)) if match else None
+
+    def _dedupe(self, docs: List[Document]) -> Tuple[List[Document], int]:
+        """
+        Drop the documents whose text is already in a more relevant document of the same paper.
+
+        A more relevant document contained in a less relevant one takes over its text.
+
+        :param docs: The documents, by relevance.
+        :type docs: List[Document]
+
+        :return: The remaining documents, by relevance, and the number of documents dropped.
+        :rtype: Tuple[List[Document], int]
+        """
+        kept: List[Document] = []
+        for doc in docs:
+            paper_id = doc.metadata.get("paper_id")
+            text = doc.page_content.strip()
+            for i, other in enumerate(kept):
+                if other.metadata.get("paper_id") != paper_id:
+                    continue
+                if text in other.page_content:
+                    break
+                if other.page_content.strip() in text:
+                    kept[i] = Document(page_content=doc.page_content, metadata=other.metadata)
+                    break
+            else:
+                kept.append(doc)
+        return kept, len(docs) - len(kept)
+
+    def _join(self, first: Document, second: Document) -> Union[str, None]:
+        """
+        Join two documents if the second one follows the first in their paper.
+
+        :param first: The earlier document.
+        :type first: Document
+        :param second: The later document.
+        :type second: Document
+
+        :return: The joined text, or None if the documents are not adjacent.
+        :rtype: Union[str, None]
+        """
+        if first.metadata.get("paper_id") != second.metadata.get("paper_id"):
+            return None
+        index, next_index = self._chunk_index(first), self._chunk_index(second)
+        if index is not None and next_index == index + 1:
+            return join_chunks([first.page_content, second.page_content], self.max_overlap)
+        length = overlap_length(first.page_content, second.page_content, self.max_overlap)
+        if length:
+            return first.page_content + second.page_content[length:]
+        return None
+
+    def _merge(self, docs: List[Document]) -> Tuple[List[Document], int]:
+        """
+        Merge adjacent documents of the same paper until none are left.
+
+        A merged document takes the rank and metadata of its most relevant part, but no chunk
+        ID, and the sections of both parts.
+
+        :param docs: The documents, by relevance.
+        :type docs: List[Document]
+
+        :return: The merged documents, by relevance, and the number of merges.
+        :rtype: Tuple[List[Document], int]
+        """
+        docs = list(docs)
+        merges = 0
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(docs)):
+                for j in range(i + 1, len(docs)):
+                    text = self._join(docs[i], docs[j])
+                    if text is None:
+                        text = self._join(docs[j], docs[i])
+                    if text is None:
+                        continue
+                    sections = [docs[i].metadata.get("section", ""), docs[j].metadata.get("section", "")]
+                    # A merged document is no longer a single chunk, so it is only merged again by overlap.
+                    metadata = {key: value for key, value in docs[i].metadata.items() if key != "chunk_id"}
+                    metadata["section"] = "; ".join(dict.fromkeys(s for s in sections if s))
+                    docs[i] = Document(page_content=text, metadata=metadata)
+                    del docs[j]
+                    merges += 1
+                    merged = True
+                    break
+                if merged:
+                    break
+        return docs, merges
+
+    def _render(self, doc: Document) -> Document:
+        """
+        Keep only the metadata the LLM needs.
+
+        :param doc: The document.
+        :type doc: Document
+
+        :return: The document with trimmed metadata.
+        :rtype: Document
+        """
+        return Document(
+            page_content=doc.page_content,
+            metadata={key: doc.metadata[key] for key in self.metadata_keys if key in doc.metadata},
+        )
+
+    def _fill(self, docs: List[Document], tokens: List[int]) -> Tuple[List[Document], int, int]:
+        """
+        Add documents by relevance as long as they fit the budget.
+
+        A document that does not fit is skipped, so a less relevant but shorter one can still
+        take its place. If not even the most relevant document fits, its text is truncated
+        until it does, metadata included.
+
+        :param docs: The rendered documents, by relevance.
+        :type docs: List[Document]
+        :param tokens: The number of tokens of each document.
+        :type tokens: List[int]
+
+        :return: The packed documents, their number of tokens and the number of documents left out.
+        :rtype: Tuple[List[Document], int, int]
+        """
+        packed: List[Document] = []
+        used = 0
+        for doc, doc_tokens in zip(docs, tokens):
+            if used + doc_tokens <= self.max_tokens:
+                packed.append(doc)
+                used += doc_tokens
+        if not packed and docs:
+            doc = docs[0]
+            keep, used = len(doc.page_content), tokens[0]
+            while used > self.max_tokens and keep > 0:
+                keep = min(keep - 1, int(keep * self.max_tokens / used))
+                doc = Document(page_content=doc.page_content[:keep], metadata=doc.metadata)
+                used = count_tokens([str(doc)])[0]
+            packed.append(doc)
+        return packed, used, len(docs) - len(packed)
+
+    def pack(self, docs: List[Document]) -> List[Document]:
+        """
+        Pack retrieved documents into the token budget.
+
+        :param docs: The documents, by relevance.
+        :type docs: List[Document]
+
+        :return: The packed documents, by relevance.
+        :rtype: List[Document]
+        """
+        if not docs:
+            return docs
+        tokens_in = sum(count_tokens([str(doc) for doc in docs]))
+        unique, duplicates = self._dedupe(docs)
+        merged, merges = self._merge(unique)
+        tokens_merged = sum(count_tokens([str(doc) for doc in merged]))
+        rendered = [self._render(doc) for doc in merged]
+        rendered_tokens = count_tokens([str(doc) for doc in rendered])
+        packed, tokens_out, over_budget = self._fill(rendered, rendered_tokens)
+
+        stats = {
+            "calls": 1,
+            "documents_in": len(docs),
+            "documents_out": len(packed),
+            "tokens_in": tokens_in,
+            "tokens_out": tokens_out,
+            "tokens_deduped": tokens_in - tokens_merged,
+            "tokens_trimmed": tokens_merged - sum(rendered_tokens),
+            "tokens_over_budget": sum(rendered_tokens) - tokens_out,
+            "duplicates": duplicates,
+            "merged": merges,
+            "over_budget": over_budget,
+        }
+        for key, value in stats.items():
+            self.totals[key] += value
+            self.turn[key] += value
+        logger_context_packer.info(
+            f"Packed {len(docs)} documents ({tokens_in} tokens) into {len(packed)} ({tokens_out}/{self.max_tokens} tokens): "
+            f"{duplicates} duplicates, {merges} merges, {over_budget} over budget; {tokens_in - tokens_out} tokens saved, "
+            f"{stats['tokens_deduped']} by deduplication, {stats['tokens_trimmed']} by trimming metadata, "
+            f"{stats['tokens_over_budget']} by the budget"
+        )
+        return packed
+
+    def end_turn(self) -> dict[str, int]:
+        """
+        Log and reset the statistics of the current turn.
+
+        :return: The statistics of the turn, with the tokens saved in total.
+        :rtype: dict[str, int]
+        """
+        turn = {**self.turn, "tokens_saved": self.turn["tokens_in"] - self.turn["tokens_out"]}
+        self.turn = self._zero_stats()
+        if turn["calls"]:
+            logger_context_packer.info(
+                f"Turn: {turn['calls']} retrievals, {turn['tokens_out']} of {turn['tokens_in']} tokens sent, "
+                f"{turn['tokens_saved']} saved ({turn['tokens_deduped']} deduplication, {turn['tokens_trimmed']} metadata, "
+                f"{turn['tokens_over_budget']} budget). "
+                f"Session: {self.totals['tokens_in'] - self.totals['tokens_out']} tokens saved"
+            )
+        return turn
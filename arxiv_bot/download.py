@@ -0,0 +1,181 @@
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from typing import List, Tuple, Union
+from urllib.parse import urlparse
+import logging
+import os
+import requests
+import tempfile
+import threading
+import time
+
+logger_pdf_downloader = logging.getLogger("PDFDownloader")
+logger_pdf_downloader.setLevel(logging.INFO)
+
+
+class PDFDownloader:
+    """
+    Bounded concurrent PDF downloader backed by a pooled HTTP session.
+
+    Each file is streamed into a temporary file in the destination directory and
+    atomically renamed once complete, so a path that exists is always a full PDF.
+
+    :param max_workers: The maximum number of downloads running at the same time. Defaults to 8.
+    :type max_workers: int
+    :param per_host: The maximum number of concurrent downloads per host. Defaults to 4.
+    :type per_host: int
+    :param retries: The number of retries per file before giving up. Defaults to 3.
+    :type retries: int
+    :param backoff: The base delay in seconds of the exponential backoff between retries. Defaults to 0.5.
+    :type backoff: float
+    :param timeout: The connect/read timeout in seconds of each request. Defaults to 30.
+    :type timeout: float
+
+    :ivar session: The HTTP session shared by all downloads.
+    :vartype session: requests.Session
+    """
+
+    _CHUNK_SIZE = 1 << 16
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        per_host: int = 4,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 30,
+    ):
+        """
+        Constructor for the PDFDownloader object.
+        """
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="pdf-download"
+        )
+        self._host_semaphores: dict[str, threading.Semaphore] = {}
+        self._lock = threading.Lock()
+
+    def _host_semaphore(self, url: str) -> threading.Semaphore:
+        """
+        Get the semaphore limiting concurrent downloads from the host of a URL.
+
+        :param url: The URL to download.
+        :type url: str
+
+        :return: The semaphore of the host.
+        :rtype: threading.Semaphore
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.Semaphore(self.per_host)
+            return self._host_semaphores[host]
+
+    def _fetch(self, url: str, path: str):
+        """
+        Stream a URL into a temporary file and atomically move it to its destination.
+
+        :param url: The URL to download.
+        :type url: str
+        :param path: The destination path.
+        :type path: str
+        """
+        dirpath = os.path.dirname(path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=dirpath, suffix=".part")
+        try:
+            # The descriptor is owned by the file object from here on, so it is closed on any error.
+            with os.fdopen(fd, "wb") as file:
+                with self._host_semaphore(url):
+                    with self.session.get(url, stream=True, timeout=self.timeout) as response:
+                        response.raise_for_status()
+                        for chunk in response.iter_content(self._CHUNK_SIZE):
+                            file.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _retry_delay(error: Exception, default: float) -> Union[float, None]:
+        """
+        Decide whether a failed download is worth retrying.
+
+        Connection errors, timeouts, 5xx and 429 responses are transient. Other HTTP errors
+        (e.g. 404 or 410) and local file errors will fail again.
+
+        :param error: The error of the failed attempt.
+        :type error: Exception
+        :param default: The backoff delay in seconds of the attempt.
+        :type default: float
+
+        :return: The seconds to wait before the next attempt, honouring the Retry-After header of a 429 or 503 response, or None if the download should not be retried.
+        :rtype: Union[float, None]
+        """
+        if isinstance(error, requests.HTTPError):
+            response = error.response
+            status = response.status_code if response is not None else 0
+            if status != 429 and status < 500:
+                return None
+            retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+            return float(retry_after) if retry_after.isdigit() else default
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return default
+        return None
+
+    def download(self, url: str, path: str) -> Union[str, None]:
+        """
+        Download a single file, retrying transient failures with exponential backoff.
+
+        :param url: The URL to download.
+        :type url: str
+        :param path: The destination path.
+        :type path: str
+
+        :return: The destination path, or None if every attempt failed.
+        :rtype: Union[str, None]
+        """
+        if os.path.exists(path):
+            return path
+
+        for attempt in range(self.retries + 1):
+            try:
+                self._fetch(url, path)
+                return path
+            except (requests.RequestException, OSError) as e:
+                delay = self._retry_delay(e, self.backoff * 2**attempt)
+                if delay is None or attempt == self.retries:
+                    logger_pdf_downloader.warning(f"Failed to download {url}: {e}")
+                    return None
+                logger_pdf_downloader.info(
+                    f"Retrying {url} in {delay:.1f}s ({attempt + 1}/{self.retries}): {e}"
+                )
+                time.sleep(delay)
+
+    def download_many(self, jobs: List[Tuple[str, str]]) -> List[Union[str, None]]:
+        """
+        Download many files concurrently.
+
+        :param jobs: A list of (url, destination path) pairs.
+        :type jobs: List[Tuple[str, str]]
+
+        :return: The destination paths in the order of the jobs, None for failed downloads.
+        :rtype: List[Union[str, None]]
+        """
+        start = time.perf_counter()
+        futures = [self._executor.submit(self.download, url, path) for url, path in jobs]
+        paths = [future.result() for future in futures]
+        logger_pdf_downloader.info(
+            f"Downloaded {sum(path is not None for path in paths)}/{len(jobs)} PDFs in {time.perf_counter() - start:.2f}s"
+        )
+        return paths
@@ -1,33 +1,191 @@
+from arxiv_bot.cache import CachedEmbeddings, query_cache
+from arxiv_bot.context import ContextPacker
+from arxiv_bot.lexical import get_bm25_index
+from arxiv_bot.parents import get_parent_store
 from arxiv_bot.prompts import PREFIX, SUFFIX, FORMAT_INSTRUCTIONS
 from arxiv_bot.retrievers import Retriever, RetrieverWithSearch
-from arxiv_bot.search import ProcessPDF
+from arxiv_bot.search import IndexNewArxivPapers, ProcessPDF, PUBLIC_SCOPE
+from arxiv_bot.vectorstores import ArxivChroma, LocalVectorStore, index_namespace
 from chainlit.input_widget import Slider, Select, TextInput
 from chainlit.message import AskFileMessage
 from chainlit.types import AskFileResponse
 from chainlit.element import ElementBased
 from langchain.agents import initialize_agent
 from langchain.memory import ConversationBufferWindowMemory
-from langchain.vectorstores import chroma, VectorStore
+from langchain.vectorstores import VectorStore
 from langchain_core.tools import BaseTool
 from langchain_openai.chat_models import ChatOpenAI
 from langchain_openai.embeddings import OpenAIEmbeddings
 from typing import List, Any
 import chainlit as cl
-import chromadb
+import logging
 import os
 import shutil
+import threading
+import time
 
+logger_functions = logging.getLogger("functions")
+logger_functions.setLevel(logging.INFO)
 
-def clear_pdf():
+
+_last_garbage_collection = 0.0
+_garbage_collection_lock = threading.Lock()
+
+
+def _evict_public(vectordb: VectorStore) -> int:
     """
-    Remove all pdf files from pdfs directory and output directory. Also, remove all documents from arxiv collection in the database.
+    Delete the least recently indexed arXiv papers until the public corpus fits in MAX_PUBLIC_CHUNKS.
+
+    :param vectordb: The vector store.
+    :type vectordb: VectorStore
+
+    :return: The number of chunks deleted.
+    :rtype: int
     """
+    max_chunks = int(os.environ.get("MAX_PUBLIC_CHUNKS", 200_000))
+    results = vectordb.get(where={"scope": PUBLIC_SCOPE}, include=["metadatas"])
+    excess = len(results["ids"]) - max_chunks
+    if excess <= 0:
+        return 0
+
+    papers: dict[str, dict[str, Any]] = {}
+    for id, metadata in zip(results["ids"], results["metadatas"]):
+        paper = papers.setdefault(
+            metadata.get("paper_id", ""),
+            {"indexed_at": 0.0, "ids": [], "keys": set()},
+        )
+        paper["indexed_at"] = max(paper["indexed_at"], metadata.get("indexed_at", 0.0))
+        paper["ids"].append(id)
+        paper["keys"].update(
+            metadata[key] for key in ("paper_id", "arxiv_id") if metadata.get(key)
+        )
+
+    namespace = index_namespace(vectordb)
+    indexed_ids = IndexNewArxivPapers.indexed_ids.get(namespace, set())
+    evicted: List[str] = []
+    for paper in sorted(papers.values(), key=lambda paper: paper["indexed_at"]):
+        if len(evicted) >= excess:
+            break
+        evicted.extend(paper["ids"])
+        indexed_ids.difference_update(paper["keys"])
+
+    vectordb.delete(ids=evicted)
+    get_bm25_index(namespace).delete(evicted)
+    get_parent_store(namespace).delete(evicted)
+    return len(evicted)
+
+
+def collect_garbage(vectordb: VectorStore, force: bool = False):
+    """
+    Remove expired files and vectors while keeping the shared arXiv corpus warm.
+
+    PDFs and TEI outputs older than FILE_TTL_HOURS are deleted, then the oldest files are
+    deleted until both directories fit in MAX_FILES_MB. Vectors of session uploads older
+    than SESSION_TTL_HOURS are deleted. The public corpus is shared by every session, so it
+    has no TTL, but once it holds more than MAX_PUBLIC_CHUNKS chunks the least recently
+    indexed papers are deleted. Runs at most once every GC_INTERVAL_MINUTES per process
+    unless forced, and never concurrently.
+
+    :param vectordb: The vector store.
+    :type vectordb: VectorStore
+    :param force: Whether to run even if the last collection was recent.
+    :type force: bool
+    """
+    global _last_garbage_collection
+
+    now = time.time()
+    interval = float(os.environ.get("GC_INTERVAL_MINUTES", 30)) * 60
+    # Sessions start concurrently, so the check and the update must be atomic. A session that
+    # finds a collection running skips it instead of waiting.
+    if not _garbage_collection_lock.acquire(blocking=False):
+        return
     try:
-        shutil.rmtree("./pdfs")
-        shutil.rmtree("./output")
-        chromadb.PersistentClient(path="arxiv_vdb").delete_collection("arxiv")
-    except:
-        pass
+        if not force and now - _last_garbage_collection < interval:
+            return
+        _last_garbage_collection = now
+        _collect_garbage(vectordb, now)
+    finally:
+        _garbage_collection_lock.release()
+
+
+def _collect_garbage(vectordb: VectorStore, now: float):
+    """
+    Run a garbage collection, see collect_garbage. The caller holds the lock.
+
+    :param vectordb: The vector store.
+    :type vectordb: VectorStore
+    :param now: The time of the collection.
+    :type now: float
+    """
+
+    file_ttl = float(os.environ.get("FILE_TTL_HOURS", 24)) * 3600
+    session_ttl = float(os.environ.get("SESSION_TTL_HOURS", 24)) * 3600
+    max_bytes = float(os.environ.get("MAX_FILES_MB", 2048)) * 1024 * 1024
+
+    files = []
+    for directory in ["./pdfs", "./output"]:
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for mtime, size, path in files:
+        if now - mtime < file_ttl and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+
+    expired = vectordb.get(
+        where={
+            "$and": [
+                {"scope": {"$ne": PUBLIC_SCOPE}},
+                {"indexed_at": {"$lt": now - session_ttl}},
+            ]
+        },
+        include=[],
+    )["ids"]
+    if expired:
+        vectordb.delete(ids=expired)
+        get_bm25_index(index_namespace(vectordb)).delete(expired)
+        get_parent_store(index_namespace(vectordb)).delete(expired)
+
+    evicted = _evict_public(vectordb)
+    if expired or evicted:
+        query_cache.invalidate()
+
+    logger_functions.info(
+        f"Garbage collection removed {removed} files, {len(expired)} session vectors "
+        f"and {evicted} public vectors."
+    )
+
+
+def clear_session(vectordb: VectorStore, session_id: str):
+    """
+    Remove the uploads of a session: its PDFs and the vectors only it can retrieve.
+
+    :param vectordb: The vector store.
+    :type vectordb: VectorStore
+    :param session_id: The ID of the session.
+    :type session_id: str
+    """
+    shutil.rmtree(f"./pdfs/{session_id}", ignore_errors=True)
+    ids = vectordb.get(where={"scope": session_id}, include=[])["ids"]
+    if ids:
+        vectordb.delete(ids=ids)
+        get_bm25_index(index_namespace(vectordb)).delete(ids)
+        get_parent_store(index_namespace(vectordb)).delete(ids)
+        query_cache.invalidate()
 
 
 def load_llm() -> ChatOpenAI:
@@ -45,10 +203,17 @@ def load_tools() -> List[BaseTool]:
     settings = cl.user_session.get("settings")
     vectordb = cl.user_session.get("vectordb")
 
+    context_packer = ContextPacker.for_model(
+        settings["llm_model"], int(settings["chunk_overlap"])
+    )
+    cl.user_session.set("context_packer", context_packer)
+
     retriever = Retriever(
         vectordb=vectordb,
         fetch_k=int(settings["fetch_k"]),
         k=int(settings["k"]),
+        scope=cl.user_session.get("id"),
+        context_packer=context_packer,
     )
 
     retriever_with_search = RetrieverWithSearch(
@@ -59,6 +224,10 @@ def load_tools() -> List[BaseTool]:
         k=int(settings["k"]),
         chunk_size=int(settings["chunk_size"]),
         chunk_overlap=int(settings["chunk_overlap"]),
+        segmenter=settings["segmenter"],
+        chunker=settings["chunker"],
+        scope=cl.user_session.get("id"),
+        context_packer=context_packer,
     )
 
     return [retriever, retriever_with_search]
@@ -129,6 +298,29 @@ async def init_chat_settings():
             TextInput(id="k", label="# of papers for context", initial="3"),
             TextInput(id="chunk_size", label="Chunk size", initial="1024"),
             TextInput(id="chunk_overlap", label="Chunk overlap", initial="100"),
+            Select(
+                id="segmenter",
+                label="Sentence segmentation",
+                values=["spaCy", "Sentencizer", "Regex"],
+                initial_index=0,
+                tooltip="How text is split into sentences before chunking. spaCy: Most accurate, but slowest. Sentencizer: spaCy's rule-based sentencizer only. Regex: Fastest, no spaCy.",
+            ),
+            Select(
+                id="chunker",
+                label="Chunking",
+                values=["Text", "Section"],
+                initial_value=os.environ.get("CHUNKER", "Text"),
+                tooltip="How papers are split into chunks. Text: Split the flattened text. Section: Chunks never straddle two sections and keep captions and equations whole.",
+            ),
+            Select(
+                id="vector_index",
+                label="Vector index",
+                values=["Chroma", "HNSW", "Flat"],
+                initial_value=os.environ.get("INIT_VECTOR_INDEX", "Chroma"),
+                tooltip="The vector index engine. Chroma: Default store. HNSW: Local hnswlib graph with tunable ef/M, fast on large corpora. Flat: Exact search over memory-mapped float16 vectors.",
+            ),
+            TextInput(id="hnsw_ef", label="HNSW ef (search)", initial="64"),
+            TextInput(id="hnsw_m", label="HNSW M (new indexes only)", initial="16"),
         ]
     ).send()
     cl.user_session.set("settings", settings)
@@ -145,22 +337,66 @@ def load_memory():
     cl.user_session.set("memory", memory)
 
 
+_embeddings: dict[str, CachedEmbeddings] = {}
+
+
+def load_embeddings(embedding_model: str) -> CachedEmbeddings:
+    """
+    Get the process-wide cached embeddings for an embedding model.
+
+    :param embedding_model: The name of the OpenAI embedding model.
+    :type embedding_model: str
+
+    :return: The embeddings, backed by the local embedding cache.
+    :rtype: CachedEmbeddings
+    """
+    if embedding_model not in _embeddings:
+        _embeddings[embedding_model] = CachedEmbeddings(
+            OpenAIEmbeddings(model=embedding_model),
+            model=embedding_model,
+            max_entries=int(os.environ.get("EMBEDDING_CACHE_SIZE", 200_000)),
+        )
+    return _embeddings[embedding_model]
+
+
+_vectordbs: dict[tuple[str, str, str, str], VectorStore] = {}
+
+
 def load_vectordb(
     persist_dir: str,
     collection_name: str,
 ):
     os.makedirs(persist_dir, exist_ok=True)
 
-    embedding_model = cl.user_session.get("settings")["embedding_model"]
-    base_embeddings = OpenAIEmbeddings(model=embedding_model)
-
-    # _ = chromadb.PersistentClient(persist_dir).create_collection(collection_name)
-
-    vectordb = chroma.Chroma(
-        collection_name=collection_name,
-        persist_directory=persist_dir,
-        embedding_function=base_embeddings,
-    )
+    settings = cl.user_session.get("settings")
+    embedding_model = settings["embedding_model"]
+    engine = settings.get("vector_index", "Chroma")
+
+    # One vector store per collection, embedding model and engine is shared by all
+    # sessions, so retrievers built on it can be cached across sessions.
+    key = (persist_dir, collection_name, embedding_model, engine)
+    if key not in _vectordbs:
+        if engine == "Chroma":
+            _vectordbs[key] = ArxivChroma(
+                collection_name=collection_name,
+                persist_directory=persist_dir,
+                embedding_function=load_embeddings(embedding_model),
+            )
+        else:
+            # Local indexes hold a single vector dimension, so each embedding model gets its own.
+            _vectordbs[key] = LocalVectorStore(
+                collection_name=collection_name,
+                persist_directory=os.path.join(
+                    persist_dir, engine.lower(), embedding_model
+                ),
+                embedding_function=load_embeddings(embedding_model),
+                engine=engine,
+                M=int(settings.get("hnsw_m", 16)),
+                ef=int(settings.get("hnsw_ef", 64)),
+            )
+    vectordb = _vectordbs[key]
+    if isinstance(vectordb, LocalVectorStore):
+        vectordb.set_ef(int(settings.get("hnsw_ef", 64)))
     cl.user_session.set("vectordb", vectordb)
 
 
@@ -225,16 +461,20 @@ async def init_file_upload(
                 settings["pdf_parser"],
                 int(settings["chunk_size"]),
                 int(settings["chunk_overlap"]),
+                settings["segmenter"],
+                scope=cl.user_session.get("id"),
+                chunker=settings["chunker"],
             ),
         )
 
-        os.makedirs("./pdfs", exist_ok=True)
+        upload_dir = f"./pdfs/{cl.user_session.get('id')}"
+        os.makedirs(upload_dir, exist_ok=True)
         for file in files:
-            os.rename(file.path, f"./pdfs/{file.name}")
-            file.path = f"./pdfs/{file.name}"
+            os.rename(file.path, f"{upload_dir}/{file.name}")
+            file.path = f"{upload_dir}/{file.name}"
 
         process_pdf = cl.user_session.get("pdf_processor")
-        await cl.make_async(process_pdf.process)([file.path for file in files])
+        await process_pdf.aprocess([file.path for file in files])
 
         ask_file_message.content = "Finished processing PDFs. Ask me anything!"
         await ask_file_message.update()
@@ -265,16 +505,20 @@ async def process_pdf_upload(files: List[ElementBased]):
                 settings["pdf_parser"],
                 int(settings["chunk_size"]),
                 int(settings["chunk_overlap"]),
+                settings["segmenter"],
+                scope=cl.user_session.get("id"),
+                chunker=settings["chunker"],
             ),
         )
-        print(settings["pdf_parser"])
 
+        upload_dir = f"./pdfs/{cl.user_session.get('id')}"
+        os.makedirs(upload_dir, exist_ok=True)
         for file in files:
-            os.rename(str(file.path), f"./pdfs/{file.name}")
-            file.path = f"./pdfs/{file.name}"
+            os.rename(str(file.path), f"{upload_dir}/{file.name}")
+            file.path = f"{upload_dir}/{file.name}"
 
         process_pdf = cl.user_session.get("pdf_processor")
-        await cl.make_async(process_pdf.process)([file.path for file in files])
+        await process_pdf.aprocess([file.path for file in files])
 
 
 # def summarize(query: str, documents: List[Document]) -> str:
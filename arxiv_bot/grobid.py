@@ -0,0 +1,190 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from typing import Iterator, List, Tuple, Union
+import functools
+import logging
+import os
+import requests
+import time
+
+logger_grobid = logging.getLogger("GrobidService")
+logger_grobid.setLevel(logging.INFO)
+
+
+class GrobidService:
+    """
+    Pooled client of a GROBID server.
+
+    One instance is shared per process (see get_grobid_service). It keeps a fixed number of
+    keep-alive connections and never has more requests in flight than the server has worker
+    threads, so GROBID is kept busy without being flooded. Requests rejected with 503 (all
+    GROBID workers busy) or failed on the network are retried with exponential backoff.
+
+    :param server: The base URL of the GROBID server.
+    :type server: str
+    :param concurrency: The maximum number of requests in flight. Match it to the concurrency of the GROBID replica. Defaults to 4.
+    :type concurrency: int
+    :param timeout: The read timeout in seconds of a request. Defaults to 120.
+    :type timeout: float
+    :param connect_timeout: The connect timeout in seconds of a request. Defaults to 5.
+    :type connect_timeout: float
+    :param retries: The number of retries of a busy or failed request. Defaults to 5.
+    :type retries: int
+    :param backoff: The base delay in seconds of the exponential backoff between retries. Defaults to 0.5.
+    :type backoff: float
+
+    :ivar session: The HTTP session shared by all requests.
+    :vartype session: requests.Session
+    """
+
+    _PARAMS = {
+        "generateIDs": "0",
+        "consolidateHeader": "0",
+        "consolidateCitations": "0",
+        "includeRawCitations": "0",
+        "includeRawAffiliations": "0",
+        "segmentSentences": "0",
+    }
+
+    def __init__(
+        self,
+        server: str,
+        concurrency: int = 4,
+        timeout: float = 120,
+        connect_timeout: float = 5,
+        retries: int = 5,
+        backoff: float = 0.5,
+    ):
+        """
+        Constructor for the GrobidService object.
+        """
+        self.server = server.rstrip("/")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="grobid"
+        )
+
+    def process(self, service: str, pdf_path: str) -> Tuple[int, Union[bytes, None]]:
+        """
+        Send a single PDF to GROBID, retrying while the server is busy.
+
+        :param service: The GROBID service, e.g. "processFulltextDocument" or "processHeaderDocument".
+        :type service: str
+        :param pdf_path: The path to the PDF.
+        :type pdf_path: str
+
+        :return: The HTTP status code of the last attempt (0 on a network error) and the TEI XML, or None on failure.
+        :rtype: Tuple[int, Union[bytes, None]]
+        """
+        url = f"{self.server}/api/{service}"
+        status = 0
+        for attempt in range(self.retries + 1):
+            try:
+                with open(pdf_path, "rb") as file:
+                    response = self.session.post(
+                        url,
+                        files={"input": (os.path.basename(pdf_path), file, "application/pdf")},
+                        data=self._PARAMS,
+                        headers={"Accept": "application/xml"},
+                        timeout=(self.connect_timeout, self.timeout),
+                    )
+                status = response.status_code
+                if status == 200:
+                    return status, response.content
+                if status != 503:
+                    logger_grobid.warning(
+                        f"GROBID {service} failed for {pdf_path} with status {status}"
+                    )
+                    return status, None
+                reason = "server busy"
+            except requests.RequestException as e:
+                status, reason = 0, str(e)
+
+            if attempt < self.retries:
+                delay = self.backoff * 2**attempt
+                logger_grobid.info(
+                    f"Retrying {pdf_path} in {delay:.1f}s ({attempt + 1}/{self.retries}): {reason}"
+                )
+                time.sleep(delay)
+
+        logger_grobid.warning(f"GROBID {service} gave up on {pdf_path}: {reason}")
+        return status, None
+
+    def iter_batch(
+        self, service: str, pdf_paths: List[str]
+    ) -> Iterator[Tuple[str, int, Union[bytes, None]]]:
+        """
+        Send PDFs to GROBID concurrently and yield each result as soon as it completes.
+
+        :param service: The GROBID service.
+        :type service: str
+        :param pdf_paths: The paths to the PDFs.
+        :type pdf_paths: List[str]
+
+        :return: The path, HTTP status code and TEI XML (None on failure) of each PDF, in completion order.
+        :rtype: Iterator[Tuple[str, int, Union[bytes, None]]]
+        """
+        start = time.perf_counter()
+        futures = {
+            self._executor.submit(self.process, service, path): path
+            for path in pdf_paths
+        }
+        succeeded = 0
+        try:
+            for future in as_completed(futures):
+                status, tei = future.result()
+                succeeded += tei is not None
+                yield futures[future], status, tei
+        finally:
+            for future in futures:
+                future.cancel()
+        seconds = time.perf_counter() - start
+        logger_grobid.info(
+            f"GROBID {service}: {succeeded}/{len(pdf_paths)} PDFs "
+            f"in {seconds:.2f}s ({len(pdf_paths) / max(seconds, 1e-9):.2f} PDFs/s)"
+        )
+
+    def process_batch(
+        self, service: str, pdf_paths: List[str]
+    ) -> List[Tuple[str, int, Union[bytes, None]]]:
+        """
+        Send PDFs to GROBID concurrently and wait for all of them.
+
+        :param service: The GROBID service.
+        :type service: str
+        :param pdf_paths: The paths to the PDFs.
+        :type pdf_paths: List[str]
+
+        :return: The path, HTTP status code and TEI XML (None on failure) of each PDF, in the order of the paths.
+        :rtype: List[Tuple[str, int, Union[bytes, None]]]
+        """
+        results = {path: (path, status, tei) for path, status, tei in self.iter_batch(service, pdf_paths)}
+        return [results[path] for path in pdf_paths]
+
+
+@functools.lru_cache(maxsize=None)
+def get_grobid_service(server: Union[str, None] = None) -> GrobidService:
+    """
+    Get the GROBID client of this process, configured from the environment.
+
+    :param server: The base URL of the GROBID server. Defaults to the GROBID_FQDN environment variable.
+    :type server: Union[str, None]
+
+    :return: The shared client.
+    :rtype: GrobidService
+    """
+    return GrobidService(
+        server or os.environ.get("GROBID_FQDN", "http://localhost:8070"),
+        concurrency=int(os.environ.get("GROBID_CONCURRENCY", 4)),
+        timeout=float(os.environ.get("GROBID_TIMEOUT", 120)),
+    )
@@ -0,0 +1,297 @@
+from concurrent.futures import ThreadPoolExecutor
+from langchain.schema.document import Document
+from langchain_core.vectorstores import VectorStore
+from typing import List, Union
+import asyncio
+import functools
+import logging
+import openai
+import tiktoken
+import time
+
+logger_embedding_writer = logging.getLogger("EmbeddingWriter")
+logger_embedding_writer.setLevel(logging.INFO)
+
+# Embedding API errors worth retrying. Anything else (auth failures, bad requests, a broken
+# vector store) fails the batch at once.
+_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_encoding() -> Union[tiktoken.Encoding, None]:
+    """
+    Get the tokenizer used to size batches, loaded on first use.
+
+    :return: The cl100k_base encoding, or None if it cannot be loaded (e.g. offline).
+    :rtype: Union[tiktoken.Encoding, None]
+    """
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger_embedding_writer.warning(
+            f"Cannot load the tokenizer, estimating tokens from characters: {e}"
+        )
+        return None
+
+
+def count_tokens(texts: List[str]) -> List[int]:
+    """
+    Count the tokens of texts with the cl100k_base tokenizer.
+
+    :param texts: The texts.
+    :type texts: List[str]
+
+    :return: The number of tokens of each text. Estimated as 4 characters per token if the tokenizer is unavailable.
+    :rtype: List[int]
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return [len(text) // 4 + 1 for text in texts]
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+
+class EmbeddingWriter:
+    """
+    Writes documents to a vector store in token-budgeted batches.
+
+    Each batch is embedded and written on its own, with a bounded number of batches in
+    flight, so embedding requests stay small, the embedding of one batch overlaps the
+    write of another, and a failed batch is retried without losing the others. Only rate
+    limits (429, honouring Retry-After), connection errors and 5xx responses are retried.
+
+    :param vectordb: The vector store to write to.
+    :type vectordb: VectorStore
+    :param max_batch_tokens: The maximum number of tokens per batch. Defaults to 50000.
+    :type max_batch_tokens: int
+    :param max_concurrency: The maximum number of batches in flight. Defaults to 4.
+    :type max_concurrency: int
+    :param retries: The number of retries of a failed batch. Defaults to 3.
+    :type retries: int
+    :param backoff: The base delay in seconds of the exponential backoff between retries. Defaults to 1.
+    :type backoff: float
+
+    :ivar stats: Throughput metrics of the last write.
+    :vartype stats: dict[str, float]
+    """
+
+    def __init__(
+        self,
+        vectordb: VectorStore,
+        max_batch_tokens: int = 50_000,
+        max_concurrency: int = 4,
+        retries: int = 3,
+        backoff: float = 1,
+    ):
+        """
+        Constructor for the EmbeddingWriter object.
+        """
+        self.vectordb = vectordb
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.stats: dict[str, float] = {}
+
+    def _batches(self, docs: List[Document]) -> List[List[Document]]:
+        """
+        Group documents into batches of at most max_batch_tokens tokens.
+
+        :param docs: The documents to group.
+        :type docs: List[Document]
+
+        :return: The batches, in document order.
+        :rtype: List[List[Document]]
+        """
+        counts = count_tokens([doc.page_content for doc in docs])
+        batches: List[List[Document]] = []
+        batch: List[Document] = []
+        batch_tokens = 0
+        for doc, tokens in zip(docs, counts):
+            if batch and batch_tokens + tokens > self.max_batch_tokens:
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(doc)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+
+        self.stats["tokens"] = sum(counts)
+        return batches
+
+    @staticmethod
+    def _ids(batch: List[Document]) -> List[str]:
+        """
+        Get the vector store IDs of a batch.
+
+        :param batch: The batch.
+        :type batch: List[Document]
+
+        :return: The chunk IDs of the documents.
+        :rtype: List[str]
+        """
+        return [doc.metadata["chunk_id"] for doc in batch]
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Union[float, None]:
+        """
+        Decide whether and when a failed batch is retried.
+
+        :param error: The error of the failed attempt.
+        :type error: Exception
+        :param attempt: The number of the failed attempt, starting at 0.
+        :type attempt: int
+
+        :return: The seconds to wait before the next attempt, or None if the batch should not be retried.
+        :rtype: Union[float, None]
+        """
+        if attempt >= self.retries or not isinstance(error, _RETRYABLE_ERRORS):
+            return None
+        delay = self.backoff * 2**attempt
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                if "retry-after-ms" in response.headers:
+                    return float(response.headers["retry-after-ms"]) / 1000
+                if "retry-after" in response.headers:
+                    return float(response.headers["retry-after"])
+            except ValueError:
+                pass
+        return delay
+
+    def _write_batch(self, batch: List[Document]) -> bool:
+        """
+        Embed and write a single batch, retrying transient errors with exponential backoff.
+
+        :param batch: The batch to write.
+        :type batch: List[Document]
+
+        :return: Whether the batch was written.
+        :rtype: bool
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                self.vectordb.add_documents(batch, ids=self._ids(batch))
+                return True
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    logger_embedding_writer.warning(
+                        f"Failed to write a batch of {len(batch)} chunks: {e}"
+                    )
+                    return False
+                logger_embedding_writer.info(
+                    f"Retrying a batch of {len(batch)} chunks in {delay:.1f}s: {e}"
+                )
+                time.sleep(delay)
+        return False
+
+    async def _awrite_batch(
+        self, batch: List[Document], semaphore: asyncio.Semaphore
+    ) -> bool:
+        """
+        Asynchronously embed and write a single batch, retrying transient errors with exponential backoff.
+
+        :param batch: The batch to write.
+        :type batch: List[Document]
+        :param semaphore: The semaphore bounding the number of batches in flight.
+        :type semaphore: asyncio.Semaphore
+
+        :return: Whether the batch was written.
+        :rtype: bool
+        """
+        async with semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    await self.vectordb.aadd_documents(batch, ids=self._ids(batch))
+                    return True
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        logger_embedding_writer.warning(
+                            f"Failed to write a batch of {len(batch)} chunks: {e}"
+                        )
+                        return False
+                    logger_embedding_writer.info(
+                        f"Retrying a batch of {len(batch)} chunks in {delay:.1f}s: {e}"
+                    )
+                    await asyncio.sleep(delay)
+        return False
+
+    def _record(self, batches: List[List[Document]], written: List[bool], start: float):
+        """
+        Record and log the throughput of a write.
+
+        :param batches: The batches that were written.
+        :type batches: List[List[Document]]
+        :param written: Whether each batch was written.
+        :type written: List[bool]
+        :param start: The time the write started, from time.perf_counter.
+        :type start: float
+        """
+        seconds = max(time.perf_counter() - start, 1e-9)
+        chunks = sum(len(batch) for batch in batches)
+        failed = sum(len(batch) for batch, ok in zip(batches, written) if not ok)
+        self.stats.update(
+            {
+                "chunks": chunks,
+                "failed": failed,
+                "batches": len(batches),
+                "seconds": seconds,
+                "chunks_per_sec": chunks / seconds,
+                "tokens_per_sec": self.stats.get("tokens", 0) / seconds,
+            }
+        )
+        logger_embedding_writer.info(
+            f"Wrote {chunks - failed}/{chunks} chunks in {len(batches)} batches in {seconds:.2f}s "
+            f"({self.stats['chunks_per_sec']:.1f} chunks/s, {self.stats['tokens_per_sec']:.0f} tokens/s)"
+        )
+
+    def write(self, docs: List[Document]) -> List[Document]:
+        """
+        Embed and write documents to the vector store.
+
+        :param docs: The documents to write. Each must have a chunk_id in its metadata.
+        :type docs: List[Document]
+
+        :return: The documents that could not be written.
+        :rtype: List[Document]
+        """
+        self.stats = {}
+        if not docs:
+            return []
+
+        start = time.perf_counter()
+        batches = self._batches(docs)
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            written = list(executor.map(self._write_batch, batches))
+        self._record(batches, written, start)
+
+        return [doc for batch, ok in zip(batches, written) if not ok for doc in batch]
+
+    async def awrite(self, docs: List[Document]) -> List[Document]:
+        """
+        Asynchronously embed and write documents to the vector store.
+
+        :param docs: The documents to write. Each must have a chunk_id in its metadata.
+        :type docs: List[Document]
+
+        :return: The documents that could not be written.
+        :rtype: List[Document]
+        """
+        self.stats = {}
+        if not docs:
+            return []
+
+        start = time.perf_counter()
+        # Tokenizing, and loading the tokenizer on first use, would block the event loop.
+        batches = await asyncio.to_thread(self._batches, docs)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        written = await asyncio.gather(
+            *[self._awrite_batch(batch, semaphore) for batch in batches]
+        )
+        self._record(batches, written, start)
+
+        return [doc for batch, ok in zip(batches, written) if not ok for doc in batch]
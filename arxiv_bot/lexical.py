@@ -0,0 +1,393 @@
+from arxiv_bot.cache import cache_path
+from collections import Counter, OrderedDict
+from langchain.schema.document import Document
+from typing import List, Tuple, Union
+import logging
+import math
+import numpy as np
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger_bm25 = logging.getLogger("BM25Index")
+logger_bm25.setLevel(logging.INFO)
+
+# Keeps identifiers such as "gpt-4", "bert_base", "3.5" or "eq.12" as single terms.
+_TOKEN_REGEX = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+
+_STOPWORDS = frozenset(
+    """
+    a about above after again against all am an and any are as at be because been before
+    being below between both but by can could did do does doing down during each few for
+    from further had has have having he her here hers herself him himself his how i if in
+    into is it its itself just me more most my myself no nor not now of off on once only or
+    other our ours ourselves out over own same she should so some such than that the their
+    theirs them themselves then there these they this those through to too under until up
+    very was we were what when where which while who whom why will with would you your
+    yours yourself yourselves
+    """.split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase index terms, dropping English stopwords.
+
+    :param text: The text.
+    :type text: str
+
+    :return: The terms, in order.
+    :rtype: List[str]
+    """
+    return [
+        term
+        for term in _TOKEN_REGEX.findall(text.lower())
+        if term not in _STOPWORDS
+    ]
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index persisted in a local SQLite database.
+
+    Chunks are added and removed incrementally as they are written to and deleted from the
+    vector store, keyed by their chunk_id. Document frequencies and corpus statistics are
+    maintained on every write. Chunk lengths and scopes are kept in memory, and the posting
+    lists of queried terms are loaded once into NumPy arrays (least recently used ones are
+    dropped), so a query is scored with a few vectorized operations per term.
+
+    :param path: The path to the SQLite database, opened on first use. Defaults to ``bm25.sqlite`` in CACHE_DIR.
+    :type path: str
+    :param k1: The term frequency saturation. Defaults to 1.2.
+    :type k1: float
+    :param b: The document length normalization. Defaults to 0.75.
+    :type b: float
+    :param max_cached_terms: The maximum number of posting lists kept in memory. Defaults to 4096.
+    :type max_cached_terms: int
+    """
+
+    def __init__(
+        self,
+        path: Union[str, None] = None,
+        k1: float = 1.2,
+        b: float = 0.75,
+        max_cached_terms: int = 4096,
+    ):
+        """
+        Constructor for the BM25Index object.
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_cached_terms = max_cached_terms
+
+        self._lock = threading.Lock()
+        self._connection: Union[sqlite3.Connection, None] = None
+        self._postings: OrderedDict[str, Tuple[np.ndarray, np.ndarray]] = OrderedDict()
+        self._scope_codes: dict[str, int] = {}
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._scopes = np.zeros(0, dtype=np.int32)
+        self._alive = np.zeros(0, dtype=bool)
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open the database, creating it and its tables if needed, and load the chunk lengths and scopes.
+
+        :return: The connection.
+        :rtype: sqlite3.Connection
+        """
+        self.path = self.path or cache_path("bm25.sqlite")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # AUTOINCREMENT never reuses the row of a deleted chunk, which cached postings may still hold.
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chunk_id TEXT UNIQUE NOT NULL,
+                scope TEXT NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                chunk INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, chunk)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk);
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY,
+                df INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            """
+        )
+        conn.commit()
+
+        rows = conn.execute("SELECT id, scope, length FROM chunks").fetchall()
+        if rows:
+            ids, scopes, lengths = zip(*rows)
+            self._grow(max(ids))
+            self._lengths[list(ids)] = lengths
+            self._scopes[list(ids)] = [self._scope_code(scope) for scope in scopes]
+            self._alive[list(ids)] = True
+        return conn
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """
+        Get the connection to the database, opening it on first use. The caller holds the lock.
+
+        :return: The connection.
+        :rtype: sqlite3.Connection
+        """
+        if self._connection is None:
+            self._connection = self._connect()
+        return self._connection
+
+    def _scope_code(self, scope: str) -> int:
+        """
+        Get the integer code of a scope.
+
+        :param scope: The scope.
+        :type scope: str
+
+        :return: The code.
+        :rtype: int
+        """
+        return self._scope_codes.setdefault(scope, len(self._scope_codes))
+
+    def _grow(self, max_id: int):
+        """
+        Grow the in-memory chunk arrays to hold a chunk row.
+
+        :param max_id: The largest chunk row to hold.
+        :type max_id: int
+        """
+        if max_id < len(self._alive):
+            return
+        size = max(max_id + 1, 2 * len(self._alive), 1024)
+        for name in ("_lengths", "_scopes", "_alive"):
+            array = getattr(self, name)
+            grown = np.zeros(size, dtype=array.dtype)
+            grown[: len(array)] = array
+            setattr(self, name, grown)
+
+    def add(self, documents: List[Document]):
+        """
+        Index chunks that are not indexed yet.
+
+        :param documents: The chunks. Each must have a chunk_id in its metadata.
+        :type documents: List[Document]
+        """
+        if not documents:
+            return
+        with self._lock:
+            postings: dict[str, List[Tuple[int, int]]] = {}
+            for doc in documents:
+                terms = Counter(tokenize(doc.page_content))
+                scope = doc.metadata.get("scope", "")
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO chunks (chunk_id, scope, length) VALUES (?, ?, ?)",
+                    (doc.metadata["chunk_id"], scope, sum(terms.values())),
+                )
+                if cursor.rowcount == 0:
+                    continue
+                chunk = cursor.lastrowid
+                assert chunk is not None
+                self._grow(chunk)
+                self._lengths[chunk] = sum(terms.values())
+                self._scopes[chunk] = self._scope_code(scope)
+                self._alive[chunk] = True
+                for term, tf in terms.items():
+                    postings.setdefault(term, []).append((chunk, tf))
+
+            self._conn.executemany(
+                "INSERT INTO postings (term, chunk, tf) VALUES (?, ?, ?)",
+                [
+                    (term, chunk, tf)
+                    for term, entries in postings.items()
+                    for chunk, tf in entries
+                ],
+            )
+            self._conn.executemany(
+                "INSERT INTO terms (term, df) VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+                [(term, len(entries)) for term, entries in postings.items()],
+            )
+            self._conn.commit()
+
+            for term, entries in postings.items():
+                if term in self._postings:
+                    chunks, tfs = self._postings[term]
+                    new_chunks, new_tfs = zip(*entries)
+                    self._postings[term] = (
+                        np.concatenate([chunks, np.asarray(new_chunks, dtype=np.int64)]),
+                        np.concatenate([tfs, np.asarray(new_tfs, dtype=np.float32)]),
+                    )
+
+    def delete(self, chunk_ids: List[str]):
+        """
+        Remove chunks from the index.
+
+        :param chunk_ids: The chunk IDs to remove. Unknown IDs are ignored.
+        :type chunk_ids: List[str]
+        """
+        if not chunk_ids:
+            return
+        with self._lock:
+            for start in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[start : start + 500]
+                rows = self._conn.execute(
+                    f"SELECT id FROM chunks WHERE chunk_id IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for (chunk,) in rows:
+                    self._conn.execute(
+                        "UPDATE terms SET df = df - 1 WHERE term IN (SELECT term FROM postings WHERE chunk = ?)",
+                        (chunk,),
+                    )
+                    self._conn.execute("DELETE FROM postings WHERE chunk = ?", (chunk,))
+                    self._conn.execute("DELETE FROM chunks WHERE id = ?", (chunk,))
+                    # Cached posting lists keep the row, the alive mask hides it.
+                    self._alive[chunk] = False
+            self._conn.execute("DELETE FROM terms WHERE df <= 0")
+            self._conn.commit()
+
+    def _load_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the posting list of a term, loading it from disk on first use.
+
+        :param term: The term.
+        :type term: str
+
+        :return: The chunk rows and term frequencies of the term.
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
+        if term in self._postings:
+            self._postings.move_to_end(term)
+            return self._postings[term]
+
+        rows = self._conn.execute(
+            "SELECT chunk, tf FROM postings WHERE term = ?", (term,)
+        ).fetchall()
+        chunks = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        tfs = np.fromiter((row[1] for row in rows), dtype=np.float32, count=len(rows))
+        self._postings[term] = (chunks, tfs)
+        if len(self._postings) > self.max_cached_terms:
+            self._postings.popitem(last=False)
+        return chunks, tfs
+
+    def search(
+        self, query: str, k: int = 10, scopes: Union[List[str], None] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Rank the indexed chunks against a query with BM25.
+
+        :param query: The query.
+        :type query: str
+        :param k: The number of results. Defaults to 10.
+        :type k: int
+        :param scopes: The scopes the results are restricted to, or None for all chunks.
+        :type scopes: Union[List[str], None]
+
+        :return: The chunk IDs and BM25 scores of the best matching chunks, best first.
+        :rtype: List[Tuple[str, float]]
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        start = time.perf_counter()
+        with self._lock:
+            conn = self._conn
+            n_chunks = int(self._alive.sum())
+            if n_chunks == 0:
+                return []
+            avg_length = float(self._lengths[self._alive].mean()) or 1.0
+            dfs = conn.execute(
+                f"SELECT term, df FROM terms WHERE term IN ({','.join('?' * len(terms))})",
+                terms,
+            ).fetchall()
+
+            scores = np.zeros(len(self._alive), dtype=np.float32)
+            norms = self.k1 * (1 - self.b + self.b * self._lengths / avg_length)
+            for term, df in dfs:
+                idf = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+                chunks, tfs = self._load_postings(term)
+                # Chunk rows are unique within a posting list, so fancy-index addition is safe.
+                scores[chunks] += idf * tfs * (self.k1 + 1) / (tfs + norms[chunks])
+
+            mask = self._alive & (scores > 0)
+            if scopes is not None:
+                codes = [self._scope_codes[scope] for scope in scopes if scope in self._scope_codes]
+                mask &= np.isin(self._scopes, codes)
+            candidates = np.flatnonzero(mask)
+            k = min(k, len(candidates))
+            if k == 0:
+                return []
+            top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+            top = top[np.argsort(-scores[top])]
+
+            ids = dict(
+                self._conn.execute(
+                    f"SELECT id, chunk_id FROM chunks WHERE id IN ({','.join('?' * len(top))})",
+                    top.tolist(),
+                ).fetchall()
+            )
+
+        logger_bm25.info(
+            f"BM25 search over {n_chunks} chunks in {1000 * (time.perf_counter() - start):.1f}ms"
+        )
+        return [(ids[chunk], float(scores[chunk])) for chunk in top.tolist()]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._conn  # Opening the database loads the chunk arrays.
+            return int(self._alive.sum())
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[str]], k: int = 60
+) -> List[Tuple[str, float]]:
+    """
+    Fuse rankings with reciprocal rank fusion.
+
+    :param rankings: The rankings, each a list of keys best first.
+    :type rankings: List[List[str]]
+    :param k: The rank constant damping the weight of the top ranks. Defaults to 60.
+    :type k: int
+
+    :return: The keys and fused scores, best first. Ties keep the order of first appearance.
+    :rtype: List[Tuple[str, float]]
+    """
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+_bm25_indexes: dict[str, BM25Index] = {}
+_bm25_indexes_lock = threading.Lock()
+
+
+def get_bm25_index(namespace: str = "") -> BM25Index:
+    """
+    Get the BM25 index of this process for a vector store, see index_namespace.
+
+    :param namespace: The namespace of the vector store. Defaults to "" (``bm25.sqlite``).
+    :type namespace: str
+
+    :return: The shared index, stored in ``bm25-<namespace>.sqlite`` in CACHE_DIR.
+    :rtype: BM25Index
+    """
+    # Two instances on the same database would each keep their own in-memory statistics.
+    with _bm25_indexes_lock:
+        if namespace not in _bm25_indexes:
+            _bm25_indexes[namespace] = BM25Index(
+                cache_path(f"bm25-{namespace}.sqlite") if namespace else None
+            )
+        return _bm25_indexes[namespace]
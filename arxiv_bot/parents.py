@@ -0,0 +1,297 @@
+from arxiv_bot.cache import cache_path
+from langchain.schema.document import Document
+from typing import List, Tuple, Union
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+
+logger_parent_store = logging.getLogger("ParentStore")
+logger_parent_store.setLevel(logging.INFO)
+
+# Shorter suffix/prefix matches are too likely to be a coincidence, e.g. a shared "the ".
+_MIN_OVERLAP = 16
+
+
+def overlap_length(previous: str, following: str, max_overlap: int) -> int:
+    """
+    Get the length of the text repeated at the end of a chunk and the start of the next.
+
+    :param previous: The earlier chunk.
+    :type previous: str
+    :param following: The later chunk.
+    :type following: str
+    :param max_overlap: The longest overlap to look for, in characters.
+    :type max_overlap: int
+
+    :return: The number of leading characters of the later chunk that end the earlier chunk, 0 if they do not overlap.
+    :rtype: int
+    """
+    for length in range(min(len(previous), len(following), max_overlap), _MIN_OVERLAP - 1, -1):
+        if previous.endswith(following[:length]):
+            return length
+    return 0
+
+
+def join_chunks(texts: List[str], max_overlap: int, separator: str = "\n\n") -> str:
+    """
+    Concatenate consecutive chunks of a text, keeping their overlaps only once.
+
+    :param texts: The chunks, in document order.
+    :type texts: List[str]
+    :param max_overlap: The longest overlap to look for, in characters.
+    :type max_overlap: int
+    :param separator: The separator between chunks that do not overlap. Defaults to "\\n\\n".
+    :type separator: str
+
+    :return: The joined text.
+    :rtype: str
+    """
+    if not texts:
+        return ""
+    joined = texts[0]
+    for text in texts[1:]:
+        length = overlap_length(joined, text, max_overlap)
+        joined += text[length:] if length else separator + text
+    return joined
+
+
+def build_parents(
+    docs: List[Document], max_chars: int, max_overlap: int
+) -> List[Tuple[str, str, List[str]]]:
+    """
+    Group consecutive chunks of a paper into the larger spans returned to the LLM.
+
+    A span never crosses a section boundary and ends before it grows past max_chars. The
+    section heading the chunks are prefixed with is kept once per span.
+
+    :param docs: The chunks of a single paper, in document order.
+    :type docs: List[Document]
+    :param max_chars: The maximum length of a span. A single chunk longer than that is a span of its own.
+    :type max_chars: int
+    :param max_overlap: The longest overlap between consecutive chunks, in characters.
+    :type max_overlap: int
+
+    :return: The ID, text and chunk IDs of each span.
+    :rtype: List[Tuple[str, str, List[str]]]
+    """
+    groups: List[List[Document]] = []
+    length = 0
+    for doc in docs:
+        if (
+            groups
+            and groups[-1][-1].metadata.get("section", "") == doc.metadata.get("section", "")
+            and length + len(doc.page_content) <= max_chars
+        ):
+            groups[-1].append(doc)
+            length += len(doc.page_content)
+        else:
+            groups.append([doc])
+            length = len(doc.page_content)
+
+    parents = []
+    for group in groups:
+        prefix = f"{group[0].metadata.get('section', '')}\n"
+        texts = [group[0].page_content] + [
+            doc.page_content[len(prefix) :]
+            if prefix.strip() and doc.page_content.startswith(prefix)
+            else doc.page_content
+            for doc in group[1:]
+        ]
+        chunk_ids = [doc.metadata["chunk_id"] for doc in group]
+        parent_id = hashlib.sha256("\n".join(chunk_ids).encode("utf-8")).hexdigest()[:24]
+        parents.append((parent_id, join_chunks(texts, max_overlap), chunk_ids))
+    return parents
+
+
+class ParentStore:
+    """
+    Local document store of the parent spans of indexed chunks, persisted in SQLite.
+
+    Chunks are embedded and searched on their own, but answering from a chunk alone often
+    misses the sentences around it. Each chunk is mapped to the section span it belongs to,
+    so a retriever can swap the matched chunks for their spans with one local lookup instead
+    of a second search. Like the BM25 index, the store is keyed by chunk_id and kept in sync
+    with the vector store; a span is dropped once none of its chunks are left.
+
+    :param path: The path to the SQLite database, opened on first use. Defaults to ``parents.sqlite`` in CACHE_DIR.
+    :type path: str
+    """
+
+    def __init__(self, path: Union[str, None] = None):
+        """
+        Constructor for the ParentStore object.
+        """
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._connection: Union[sqlite3.Connection, None] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open the database, creating it and its tables if needed.
+
+        :return: The connection.
+        :rtype: sqlite3.Connection
+        """
+        self.path = self.path or cache_path("parents.sqlite")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS parents (
+                parent_id TEXT PRIMARY KEY,
+                content TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                parent_id TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS chunks_parent ON chunks (parent_id);
+            """
+        )
+        conn.commit()
+        return conn
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """
+        Get the connection to the database, opening it on first use. The caller holds the lock.
+
+        :return: The connection.
+        :rtype: sqlite3.Connection
+        """
+        if self._connection is None:
+            self._connection = self._connect()
+        return self._connection
+
+    def add(self, parents: List[Tuple[str, str, List[str]]]):
+        """
+        Store parent spans and map their chunks to them, replacing the previous span of a chunk.
+
+        :param parents: The ID, text and chunk IDs of each span, see build_parents.
+        :type parents: List[Tuple[str, str, List[str]]]
+        """
+        if not parents:
+            return
+        chunk_ids = [chunk_id for _, _, ids in parents for chunk_id in ids]
+        with self._lock:
+            previous = self._parents_of(chunk_ids)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO parents (parent_id, content) VALUES (?, ?)",
+                [(parent_id, content) for parent_id, content, _ in parents],
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, parent_id) VALUES (?, ?)",
+                [(chunk_id, parent_id) for parent_id, _, ids in parents for chunk_id in ids],
+            )
+            self._delete_orphans(previous)
+            self._conn.commit()
+
+    def get(self, chunk_ids: List[str]) -> dict[str, Tuple[str, str]]:
+        """
+        Get the parent spans of chunks.
+
+        :param chunk_ids: The chunk IDs.
+        :type chunk_ids: List[str]
+
+        :return: A mapping from chunk ID to the ID and text of its span, for every chunk that has one.
+        :rtype: dict[str, Tuple[str, str]]
+        """
+        found = {}
+        with self._lock:
+            for start in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[start : start + 500]
+                rows = self._conn.execute(
+                    "SELECT chunks.chunk_id, parents.parent_id, parents.content "
+                    "FROM chunks JOIN parents ON parents.parent_id = chunks.parent_id "
+                    f"WHERE chunks.chunk_id IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                found.update({chunk_id: (parent_id, content) for chunk_id, parent_id, content in rows})
+        return found
+
+    def delete(self, chunk_ids: List[str]):
+        """
+        Remove chunks from the store, and the spans none of whose chunks are left.
+
+        :param chunk_ids: The chunk IDs to remove. Unknown IDs are ignored.
+        :type chunk_ids: List[str]
+        """
+        if not chunk_ids:
+            return
+        with self._lock:
+            previous = self._parents_of(chunk_ids)
+            for start in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[start : start + 500]
+                self._conn.execute(
+                    f"DELETE FROM chunks WHERE chunk_id IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+            self._delete_orphans(previous)
+            self._conn.commit()
+
+    def _parents_of(self, chunk_ids: List[str]) -> List[str]:
+        """
+        Get the IDs of the spans chunks are currently mapped to. The caller holds the lock.
+
+        :param chunk_ids: The chunk IDs.
+        :type chunk_ids: List[str]
+
+        :return: The unique span IDs.
+        :rtype: List[str]
+        """
+        parent_ids = set()
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start : start + 500]
+            parent_ids.update(
+                parent_id
+                for (parent_id,) in self._conn.execute(
+                    f"SELECT parent_id FROM chunks WHERE chunk_id IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+            )
+        return list(parent_ids)
+
+    def _delete_orphans(self, parent_ids: List[str]):
+        """
+        Remove the spans among parent_ids none of whose chunks are left. The caller holds the lock.
+
+        :param parent_ids: The IDs of the spans that may have lost their last chunk.
+        :type parent_ids: List[str]
+        """
+        deleted = 0
+        for start in range(0, len(parent_ids), 500):
+            batch = parent_ids[start : start + 500]
+            deleted += self._conn.execute(
+                f"DELETE FROM parents WHERE parent_id IN ({','.join('?' * len(batch))}) "
+                "AND NOT EXISTS (SELECT 1 FROM chunks WHERE chunks.parent_id = parents.parent_id)",
+                batch,
+            ).rowcount
+        if deleted > 0:
+            logger_parent_store.info(f"Deleted {deleted} parent spans without chunks")
+
+
+_parent_stores: dict[str, ParentStore] = {}
+_parent_stores_lock = threading.Lock()
+
+
+def get_parent_store(namespace: str = "") -> ParentStore:
+    """
+    Get the parent store of this process for a vector store, see index_namespace.
+
+    :param namespace: The namespace of the vector store. Defaults to "" (``parents.sqlite``).
+    :type namespace: str
+
+    :return: The shared store, stored in ``parents-<namespace>.sqlite`` in CACHE_DIR.
+    :rtype: ParentStore
+    """
+    with _parent_stores_lock:
+        if namespace not in _parent_stores:
+            _parent_stores[namespace] = ParentStore(
+                cache_path(f"parents-{namespace}.sqlite") if namespace else None
+            )
+        return _parent_stores[namespace]
@@ -8,17 +8,33 @@ from langchain_core.callbacks.manager import (
 from langchain_core.vectorstores import VectorStore
 from langchain_openai.llms import OpenAI
 from langchain.chains import LLMChain
-from langchain.retrievers.multi_query import MultiQueryRetriever
+from langchain.retrievers.multi_query import DEFAULT_QUERY_PROMPT, LineListOutputParser
+from langchain_core.language_models import BaseLLM
 from langchain.prompts import PromptTemplate
-from typing import List, Type, Optional
-from arxiv_bot.search import IndexNewArxivPapers
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Type, Optional
+from arxiv_bot.cache import SemanticQueryCache, query_cache
+from arxiv_bot.context import ContextPacker
+from arxiv_bot.lexical import BM25Index, get_bm25_index, reciprocal_rank_fusion
+from arxiv_bot.parents import ParentStore, get_parent_store
+from arxiv_bot.search import IndexNewArxivPapers, PUBLIC_SCOPE
+from arxiv_bot.vectorstores import index_namespace
 from langchain.pydantic_v1 import BaseModel, Field
 import chainlit as cl
 from typing import Literal, List
+import asyncio
+import functools
 import logging
+import os
 
 logging.basicConfig()
-logging.getLogger("langchain.retrievers.multi_query").setLevel(logging.INFO)
+logger_retriever = logging.getLogger("ParallelMultiQueryRetriever")
+logger_retriever.setLevel(logging.INFO)
+
+_search_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("SEARCH_WORKERS", 8)),
+    thread_name_prefix="vector-search",
+)
 
 
 class RetrievalInput(BaseModel):
@@ -223,10 +239,460 @@ def document_evaluator(documents: List[Document], query: str):
     return summary_rating
 
 
+@functools.lru_cache(maxsize=8)
+def get_query_llm(temperature: float = 0.2) -> OpenAI:
+    """
+    Get the process-wide LLM used to generate query variants.
+
+    Sharing the client keeps its HTTP connection pool alive across tool calls.
+
+    :param temperature: The sampling temperature. Defaults to 0.2.
+    :type temperature: float
+
+    :return: The LLM.
+    :rtype: OpenAI
+    """
+    return OpenAI(temperature=temperature)
+
+
+class ParallelMultiQueryRetriever(BaseRetriever):
+    """
+    Multi-query retriever that searches all query variants concurrently.
+
+    An LLM writes variants of the query, which are embedded in a single batched call. The
+    MMR searches of the variants then run concurrently and the union of their results is
+    de-duplicated by chunk ID. With a parent store, the matched chunks are finally replaced
+    by the larger spans they belong to.
+
+    :param vectordb: The vector store to retrieve from.
+    :type vectordb: VectorStore
+    :param llm_chain: The chain generating the query variants, one per line.
+    :type llm_chain: LLMChain
+    :param k: The number of documents to return per query variant. Defaults to 3.
+    :type k: int
+    :param fetch_k: The number of documents fetched before MMR reranking. Defaults to 10.
+    :type fetch_k: int
+    :param search_filter: The metadata filter of the searches. Defaults to None.
+    :type search_filter: Optional[dict]
+    :param include_original: Whether to search with the original query too. Defaults to False.
+    :type include_original: bool
+    :param query_cache: The semantic cache of retrieval results. Defaults to None (no cache).
+    :type query_cache: Optional[SemanticQueryCache]
+    :param cache_namespace: The namespace of the cached results, so that retrievers with different settings or sessions never share results.
+    :type cache_namespace: str
+    :param lexical_index: The BM25 index fused with the vector results by reciprocal rank. Defaults to None (vector search only).
+    :type lexical_index: Optional[BM25Index]
+    :param lexical_scopes: The scopes of the BM25 results, matching search_filter. Defaults to None (all scopes).
+    :type lexical_scopes: Optional[List[str]]
+    :param parent_store: The store of the parent spans returned in place of the matched chunks. Defaults to None (return the chunks).
+    :type parent_store: Optional[ParentStore]
+    """
+
+    vectordb: VectorStore
+    llm_chain: LLMChain
+    k: int = 3
+    fetch_k: int = 10
+    search_filter: Optional[dict] = None
+    include_original: bool = False
+    query_cache: Optional[SemanticQueryCache] = None
+    cache_namespace: str = ""
+    lexical_index: Optional[BM25Index] = None
+    lexical_scopes: Optional[List[str]] = None
+    parent_store: Optional[ParentStore] = None
+
+    @classmethod
+    def from_llm(
+        cls,
+        vectordb: VectorStore,
+        llm: BaseLLM,
+        prompt: PromptTemplate = DEFAULT_QUERY_PROMPT,
+        **kwargs: Any,
+    ) -> "ParallelMultiQueryRetriever":
+        """
+        Build the retriever from an LLM.
+
+        :param vectordb: The vector store to retrieve from.
+        :type vectordb: VectorStore
+        :param llm: The LLM generating the query variants.
+        :type llm: BaseLLM
+        :param prompt: The prompt asking for query variants. Defaults to langchain's multi-query prompt.
+        :type prompt: PromptTemplate
+
+        :return: The retriever.
+        :rtype: ParallelMultiQueryRetriever
+        """
+        llm_chain = LLMChain(llm=llm, prompt=prompt, output_parser=LineListOutputParser())
+        return cls(vectordb=vectordb, llm_chain=llm_chain, **kwargs)
+
+    def for_scope(self, scope: str) -> "ParallelMultiQueryRetriever":
+        """
+        Get a copy of the retriever restricted to the public corpus and the uploads of a session.
+
+        The copy is shallow, so it shares the LLM chain, the vector store and the caches. A
+        session without uploads sees only the public corpus, so it gets the public scope and
+        shares its cached results with every other such session. Only sessions with uploads
+        cache under their own namespace.
+
+        :param scope: The session whose uploads are visible besides the public corpus.
+        :type scope: str
+
+        :return: The scoped retriever.
+        :rtype: ParallelMultiQueryRetriever
+        """
+        if (
+            scope != PUBLIC_SCOPE
+            and not self.vectordb.get(where={"scope": scope}, limit=1, include=[])["ids"]
+        ):
+            scope = PUBLIC_SCOPE
+        scopes = list(dict.fromkeys([PUBLIC_SCOPE, scope]))
+        return self.copy(
+            update={
+                "search_filter": {"scope": {"$in": scopes}},
+                "lexical_scopes": scopes,
+                "cache_namespace": f"{self.cache_namespace}/{scope}",
+            }
+        )
+
+    def _queries(self, query: str, lines: List[str]) -> List[str]:
+        """
+        Clean up the generated query variants.
+
+        :param query: The original query.
+        :type query: str
+        :param lines: The lines generated by the LLM.
+        :type lines: List[str]
+
+        :return: The non-empty, unique query variants.
+        :rtype: List[str]
+        """
+        queries = [line.strip() for line in lines if line.strip()]
+        if self.include_original or not queries:
+            queries.append(query)
+        queries = list(dict.fromkeys(queries))
+        logger_retriever.info(f"Generated queries: {queries}")
+        return queries
+
+    @staticmethod
+    def unique_union(document_lists: List[List[Document]]) -> List[Document]:
+        """
+        Merge the results of the query variants, keeping the first occurrence of each chunk.
+
+        :param document_lists: The results of each query variant.
+        :type document_lists: List[List[Document]]
+
+        :return: The unique documents.
+        :rtype: List[Document]
+        """
+        seen = set()
+        documents = []
+        for docs in document_lists:
+            for doc in docs:
+                key = doc.metadata.get("chunk_id") or doc.page_content
+                if key in seen:
+                    continue
+                seen.add(key)
+                documents.append(doc)
+        return documents
+
+    def _get_documents(self, chunk_ids: List[str]) -> dict[str, Document]:
+        """
+        Get chunks from the vector store by ID.
+
+        :param chunk_ids: The chunk IDs.
+        :type chunk_ids: List[str]
+
+        :return: A mapping from chunk ID to document for every chunk found.
+        :rtype: dict[str, Document]
+        """
+        if not chunk_ids:
+            return {}
+        results = self.vectordb.get(ids=chunk_ids, include=["documents", "metadatas"])
+        return {
+            id: Document(page_content=text, metadata=metadata)
+            for id, text, metadata in zip(
+                results["ids"], results["documents"], results["metadatas"]
+            )
+        }
+
+    def _fuse(self, query: str, document_lists: List[List[Document]]) -> List[Document]:
+        """
+        Fuse the vector results of the query variants with the BM25 results of the query.
+
+        Chunks are ranked by reciprocal rank fusion over every ranking. As many chunks as the
+        vector search found are returned, so exact-term matches only displace the chunks with
+        the weakest vector support.
+
+        :param query: The original query.
+        :type query: str
+        :param document_lists: The results of each query variant.
+        :type document_lists: List[List[Document]]
+
+        :return: The fused documents.
+        :rtype: List[Document]
+        """
+        documents = self.unique_union(document_lists)
+        if self.lexical_index is None:
+            return documents
+        if not all("chunk_id" in doc.metadata for doc in documents):
+            return documents
+
+        lexical = [
+            chunk_id
+            for chunk_id, _ in self.lexical_index.search(
+                query, k=self.k, scopes=self.lexical_scopes
+            )
+        ]
+        if not lexical:
+            return documents
+
+        by_id = {doc.metadata["chunk_id"]: doc for doc in documents}
+        by_id.update(
+            self._get_documents([id for id in lexical if id not in by_id])
+        )
+        rankings = [[doc.metadata["chunk_id"] for doc in docs] for docs in document_lists]
+        rankings.append([id for id in lexical if id in by_id])
+        fused = reciprocal_rank_fusion(rankings)
+        return [by_id[id] for id, _ in fused[: max(len(documents), self.k)]]
+
+    def _expand(self, documents: List[Document]) -> List[Document]:
+        """
+        Replace chunks by their parent spans, keeping the rank of the best chunk of each span.
+
+        A span keeps the metadata of its best chunk plus its "parent_id". Chunks without a
+        span, e.g. indexed before the parent store existed, are returned as they are.
+
+        :param documents: The ranked chunks.
+        :type documents: List[Document]
+
+        :return: The ranked spans.
+        :rtype: List[Document]
+        """
+        if self.parent_store is None or not documents:
+            return documents
+        parents = self.parent_store.get(
+            [doc.metadata["chunk_id"] for doc in documents if "chunk_id" in doc.metadata]
+        )
+        if not parents:
+            return documents
+
+        expanded = []
+        seen = set()
+        for doc in documents:
+            parent = parents.get(doc.metadata.get("chunk_id", ""))
+            if parent is None:
+                expanded.append(doc)
+                continue
+            parent_id, content = parent
+            if parent_id in seen:
+                continue
+            seen.add(parent_id)
+            expanded.append(
+                Document(page_content=content, metadata={**doc.metadata, "parent_id": parent_id})
+            )
+        logger_retriever.info(
+            f"Expanded {len(documents)} chunks into {len(expanded)} parent spans"
+        )
+        return expanded
+
+    def _from_cache(self, embedding: List[float]) -> Optional[List[Document]]:
+        """
+        Get the cached results of a similar query.
+
+        :param embedding: The embedding of the query.
+        :type embedding: List[float]
+
+        :return: The cached documents, or None on a miss.
+        :rtype: Optional[List[Document]]
+        """
+        if self.query_cache is None:
+            return None
+        chunk_ids = self.query_cache.get(embedding, self.cache_namespace)
+        if chunk_ids is None:
+            return None
+
+        found = self._get_documents(chunk_ids)
+        if len(found) < len(chunk_ids):
+            return None
+        logger_retriever.info(
+            f"Query cache hit, session: {self.query_cache.stats(self.cache_namespace)}, process: {self.query_cache.stats()}"
+        )
+        return [found[id] for id in chunk_ids]
+
+    def _to_cache(
+        self, embedding: Optional[List[float]], documents: List[Document], generation: int
+    ):
+        """
+        Cache the results of a query.
+
+        :param embedding: The embedding of the query, None without a cache.
+        :type embedding: Optional[List[float]]
+        :param documents: The documents retrieved for the query.
+        :type documents: List[Document]
+        :param generation: The cache generation read before the documents were retrieved.
+        :type generation: int
+        """
+        if self.query_cache is None or embedding is None or not documents:
+            return
+        if not all("chunk_id" in doc.metadata for doc in documents):
+            return
+        self.query_cache.put(
+            embedding,
+            self.cache_namespace,
+            [doc.metadata["chunk_id"] for doc in documents],
+            generation=generation,
+        )
+
+    def _search(self, embedding: List[float]) -> List[Document]:
+        """
+        Run the MMR search of a single query variant.
+
+        :param embedding: The embedding of the query variant.
+        :type embedding: List[float]
+
+        :return: The documents found.
+        :rtype: List[Document]
+        """
+        return self.vectordb.max_marginal_relevance_search_by_vector(
+            embedding, k=self.k, fetch_k=self.fetch_k, filter=self.search_filter
+        )
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        """
+        Get the documents relevant to a query.
+
+        :param query: The query.
+        :type query: str
+        :param run_manager: The callback manager of the run.
+        :type run_manager: CallbackManagerForRetrieverRun
+
+        :return: The unique documents found by all query variants.
+        :rtype: List[Document]
+        """
+        # The query is only embedded on its own to look up the cache, and that embedding is
+        # reused if the query is searched too.
+        query_embedding, generation = None, 0
+        if self.query_cache is not None:
+            generation = self.query_cache.generation
+            query_embedding = self.vectordb.embeddings.embed_query(query)
+            cached = self._from_cache(query_embedding)
+            if cached is not None:
+                return self._expand(cached)
+
+        response = self.llm_chain(
+            {"question": query}, callbacks=run_manager.get_child()
+        )
+        queries = self._queries(query, response["text"].lines)
+        missing = [q for q in queries if q != query or query_embedding is None]
+        vectors = dict(zip(missing, self.vectordb.embeddings.embed_documents(missing))) if missing else {}
+        embeddings = [vectors.get(q, query_embedding) for q in queries]
+        documents = self._fuse(
+            query, list(_search_executor.map(self._search, embeddings))
+        )
+        self._to_cache(query_embedding, documents, generation)
+        return self._expand(documents)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        """
+        Asynchronously get the documents relevant to a query.
+
+        :param query: The query.
+        :type query: str
+        :param run_manager: The callback manager of the run.
+        :type run_manager: AsyncCallbackManagerForRetrieverRun
+
+        :return: The unique documents found by all query variants.
+        :rtype: List[Document]
+        """
+        query_embedding, generation = None, 0
+        if self.query_cache is not None:
+            generation = self.query_cache.generation
+            query_embedding = await self.vectordb.embeddings.aembed_query(query)
+            cached = await asyncio.to_thread(self._from_cache, query_embedding)
+            if cached is not None:
+                return await asyncio.to_thread(self._expand, cached)
+
+        response = await self.llm_chain.acall(
+            inputs={"question": query}, callbacks=run_manager.get_child()
+        )
+        queries = self._queries(query, response["text"].lines)
+        missing = [q for q in queries if q != query or query_embedding is None]
+        vectors = dict(zip(missing, await self.vectordb.embeddings.aembed_documents(missing))) if missing else {}
+        embeddings = [vectors.get(q, query_embedding) for q in queries]
+        loop = asyncio.get_running_loop()
+        document_lists = await asyncio.gather(
+            *[
+                loop.run_in_executor(_search_executor, self._search, embedding)
+                for embedding in embeddings
+            ]
+        )
+        documents = await asyncio.to_thread(self._fuse, query, list(document_lists))
+        self._to_cache(query_embedding, documents, generation)
+        return await asyncio.to_thread(self._expand, documents)
+
+
+@functools.lru_cache(maxsize=64)
+def _get_multi_query_retriever(
+    vectordb: VectorStore, k: int, fetch_k: int
+) -> ParallelMultiQueryRetriever:
+    """
+    Get the unscoped multi-query MMR retriever of a configuration, building it once per process.
+
+    :param vectordb: The vector store to retrieve from.
+    :type vectordb: VectorStore
+    :param k: The number of documents to return per query.
+    :type k: int
+    :param fetch_k: The number of documents fetched before MMR reranking.
+    :type fetch_k: int
+
+    :return: The retriever.
+    :rtype: ParallelMultiQueryRetriever
+    """
+    return ParallelMultiQueryRetriever.from_llm(
+        vectordb=vectordb,
+        llm=get_query_llm(),
+        k=k,
+        fetch_k=fetch_k,
+        query_cache=query_cache,
+        cache_namespace=f"{id(vectordb)}/{k}/{fetch_k}",
+        lexical_index=get_bm25_index(index_namespace(vectordb)),
+        parent_store=get_parent_store(index_namespace(vectordb)),
+    )
+
+
+def get_multi_query_retriever(
+    vectordb: VectorStore, k: int, fetch_k: int, scope: str = PUBLIC_SCOPE
+) -> ParallelMultiQueryRetriever:
+    """
+    Get the multi-query MMR retriever of a configuration and session.
+
+    The retriever is built once per configuration, not per session, so the cache is not
+    flushed by every new session; the session only selects the scope of a cheap copy.
+
+    :param vectordb: The vector store to retrieve from.
+    :type vectordb: VectorStore
+    :param k: The number of documents to return per query.
+    :type k: int
+    :param fetch_k: The number of documents fetched before MMR reranking.
+    :type fetch_k: int
+    :param scope: The session whose uploads are visible besides the public corpus.
+    :type scope: str
+
+    :return: The retriever.
+    :rtype: ParallelMultiQueryRetriever
+    """
+    return _get_multi_query_retriever(vectordb, k, fetch_k).for_scope(scope)
+
+
 class Retriever(BaseTool):
     vectordb: VectorStore
     fetch_k: int = 10
     k: int = 3
+    scope: str = PUBLIC_SCOPE
+    context_packer: Optional[ContextPacker] = None
     name: str = "Retriever"
     description: str = "Retriever that find documents from the vectorstore."
     args_schema: Type[BaseModel] = RetrievalInput
@@ -246,16 +712,13 @@ class Retriever(BaseTool):
 
         """
         with cl.Step("RAG", show_input=True) as step:
-            llm = OpenAI(temperature=0.2)
-            retriever = MultiQueryRetriever.from_llm(
-                llm=llm,
-                retriever=self.vectordb.as_retriever(
-                    search_type="mmr",
-                    search_kwargs={"k": self.k, "fetch_k": self.fetch_k},
-                ),
+            retriever = get_multi_query_retriever(
+                self.vectordb, self.k, self.fetch_k, self.scope
             )
 
             documents = retriever.get_relevant_documents(query)
+            if self.context_packer is not None:
+                documents = self.context_packer.pack(documents)
 
             if len(documents) == 0:
                 step.remove()
@@ -291,16 +754,13 @@ class Retriever(BaseTool):
 
         """
         async with cl.Step("RAG", show_input=True) as step:
-            llm = OpenAI(temperature=0.2)
-            retriever = MultiQueryRetriever.from_llm(
-                llm=llm,
-                retriever=self.vectordb.as_retriever(
-                    search_type="mmr",
-                    search_kwargs={"k": self.k, "fetch_k": self.fetch_k},
-                ),
+            retriever = get_multi_query_retriever(
+                self.vectordb, self.k, self.fetch_k, self.scope
             )
 
             documents = await retriever.aget_relevant_documents(query)
+            if self.context_packer is not None:
+                documents = await asyncio.to_thread(self.context_packer.pack, documents)
 
             if len(documents) == 0:
                 step.remove()
@@ -317,7 +777,7 @@ class Retriever(BaseTool):
                 )
 
             step.elements = elements
-            step.update()
+            await step.update()
 
         return documents
 
@@ -330,7 +790,8 @@ class RetrieverWithSearch(BaseTool):
         :type retriever: BaseRetriever
         :param vectordb: The search engine to use to find relevant documents.
         :type vectordb: VectorStore
-
+        :param context_packer: The packer fitting the retrieved documents into the token budget of the LLM. Defaults to None (no packing).
+        :type context_packer: Optional[ContextPacker]
 
     """
 
@@ -341,6 +802,10 @@ class RetrieverWithSearch(BaseTool):
     k: int = 3
     chunk_size: int = 1024
     chunk_overlap: int = 100
+    segmenter: Literal["spaCy", "Sentencizer", "Regex"] = "spaCy"
+    chunker: Literal["Text", "Section"] = "Text"
+    scope: str = PUBLIC_SCOPE
+    context_packer: Optional[ContextPacker] = None
     name: str = "RetrieverWithSearch"
     description: str = (
         "Retriever that uses a search engine to find relevant documents and then uses a retriever to get the documents from the vectorstore."
@@ -383,21 +848,22 @@ class RetrieverWithSearch(BaseTool):
                 self.vectordb,
                 pdf_parser=self.pdf_parser,
                 n_search_results=self.search_k,
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                segmenter=self.segmenter,
+                chunker=self.chunker,
             )
             index_tool._run(query)
             step.output = f"Indexed new papers: {index_tool.ids}"
 
         with cl.Step("RAG", show_input=True) as step:
-            llm = OpenAI(temperature=0.2)
-            retriever = MultiQueryRetriever.from_llm(
-                llm=llm,
-                retriever=self.vectordb.as_retriever(
-                    search_type="mmr",
-                    search_kwargs={"k": self.k, "fetch_k": self.fetch_k},
-                ),
+            retriever = get_multi_query_retriever(
+                self.vectordb, self.k, self.fetch_k, self.scope
             )
 
             documents = retriever.get_relevant_documents(query)
+            if self.context_packer is not None:
+                documents = self.context_packer.pack(documents)
 
             if len(documents) == 0:
                 step.remove()
@@ -454,21 +920,22 @@ class RetrieverWithSearch(BaseTool):
                 self.vectordb,
                 pdf_parser=self.pdf_parser,
                 n_search_results=self.search_k,
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                segmenter=self.segmenter,
+                chunker=self.chunker,
             )
             await index_tool._arun(query)
             step.output = f"Indexed new papers: {index_tool.ids}"
 
         async with cl.Step("RAG", show_input=True) as step:
-            llm = OpenAI(temperature=0.2)
-            retriever = MultiQueryRetriever.from_llm(
-                llm=llm,
-                retriever=self.vectordb.as_retriever(
-                    search_type="mmr",
-                    search_kwargs={"k": self.k, "fetch_k": self.fetch_k},
-                ),
+            retriever = get_multi_query_retriever(
+                self.vectordb, self.k, self.fetch_k, self.scope
             )
 
             documents = await retriever.aget_relevant_documents(query)
+            if self.context_packer is not None:
+                documents = await asyncio.to_thread(self.context_packer.pack, documents)
 
             if len(documents) == 0:
                 step.remove()
@@ -485,7 +952,7 @@ class RetrieverWithSearch(BaseTool):
                 )
 
             step.elements = elements
-            step.update()
+            await step.update()
 
         return documents
 
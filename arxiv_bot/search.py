@@ -1,18 +1,30 @@
+from arxiv_bot.cache import TTLCache, query_cache
+from arxiv_bot.download import PDFDownloader
+from arxiv_bot.grobid import GrobidService, get_grobid_service
+from arxiv_bot.ingest import EmbeddingWriter
+from arxiv_bot.lexical import get_bm25_index
+from arxiv_bot.parents import build_parents, get_parent_store
+from arxiv_bot.vectorstores import index_namespace
 from bs4 import BeautifulSoup  # type: ignore
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
 from dotenv import load_dotenv
-from grobid_client.grobid_client import GrobidClient  # type: ignore
 from langchain.schema.document import Document
-from langchain.text_splitter import SpacyTextSplitter
+from langchain.text_splitter import SpacyTextSplitter, TextSplitter
 from langchain_community.utilities import GoogleSearchAPIWrapper
 from langchain_core.vectorstores import VectorStore
+from lxml import etree  # type: ignore
 from typing import Literal
-from typing import List, Union
+from typing import Any, Iterable, Iterator, List, Tuple, Union
 import arxiv  # type: ignore
-import chromadb
+import asyncio
 import fitz  # type: ignore
+import hashlib
+import io
 import logging
+import multiprocessing
 import os
 import re
+import threading
 import time
 
 logger_index_new_arxiv_papers = logging.getLogger("IndexNewArxivPapers")
@@ -21,6 +33,11 @@ logger_index_new_arxiv_papers.setLevel(logging.INFO)
 logger_process_pdf = logging.getLogger("ProcessPDF")
 logger_process_pdf.setLevel(logging.INFO)
 
+logger_metadata_resolver = logging.getLogger("MetadataResolver")
+logger_metadata_resolver.setLevel(logging.INFO)
+
+PUBLIC_SCOPE = "public"
+
 
 try:
     load_dotenv()
@@ -28,16 +45,67 @@ except:
     pass
 
 
+arxiv_client = arxiv.Client(delay_seconds=0)
+lookup_cache = TTLCache(
+    ttls={
+        "search": float(os.environ.get("SEARCH_CACHE_TTL_HOURS", 24)) * 3600,
+        "arxiv": float(os.environ.get("ARXIV_CACHE_TTL_HOURS", 168)) * 3600,
+    }
+)
+
+
+def fetch_arxiv_metadata(
+    ids: List[str], cached_only: bool = False
+) -> dict[str, dict[str, str]]:
+    """
+    Get the metadata of arXiv papers, only querying the arXiv API for IDs that are not in the lookup cache.
+
+    :param ids: The unversioned arXiv IDs.
+    :type ids: List[str]
+    :param cached_only: Whether to skip the arXiv API and only return cached metadata. Defaults to False.
+    :type cached_only: bool
+
+    :return: The metadata of each paper found, including its PDF URL, keyed by arXiv ID.
+    :rtype: dict[str, dict[str, str]]
+    """
+    if not ids:
+        return {}
+
+    cached = lookup_cache.get_many("arxiv", ids)
+    missing = [id for id in ids if id not in cached]
+    if missing and not cached_only:
+        fetched = {}
+        for paper in arxiv_client.results(arxiv.Search(id_list=missing)):
+            paper_id = paper.entry_id.split("/")[-1]
+            arxiv_id = re.sub(r"v\d+$", "", paper_id)
+            fetched[arxiv_id] = {
+                "paper_id": paper_id,
+                "arxiv_id": arxiv_id,
+                "title": paper.title,
+                "authors": ", ".join([author.name for author in paper.authors]),
+                "date": paper.published.strftime("%Y-%m-%d"),
+                "abstract": paper.summary,
+                "pdf_url": paper.pdf_url,
+            }
+        lookup_cache.put_many("arxiv", fetched)
+        cached.update(fetched)
+    return cached
+
+
 def read_tei(tei_file):
     """
-    Read and parse a TEI file.
+    Read and parse a TEI file into a BeautifulSoup tree.
 
-    :param tei_file: The path to the TEI file.
-    :type tei_file: str
+    TEIFile does not use it; it is kept as the baseline of benchmarks/tei.py.
+
+    :param tei_file: The path to the TEI file, or the TEI document itself as returned by GROBID.
+    :type tei_file: Union[str, bytes]
     :return: The parsed TEI file as a BeautifulSoup object.
     :rtype: BeautifulSoup
     :raises RuntimeError: If the TEI file cannot be parsed.
     """
+    if isinstance(tei_file, bytes):
+        return BeautifulSoup(tei_file, "lxml-xml")
     with open(
         tei_file, "r", encoding="utf-8"
     ) as tei:  # Open the TEI file with 'ISO-8859-1' encoding
@@ -46,34 +114,40 @@ def read_tei(tei_file):
     raise RuntimeError("Cannot generate a soup from the input")
 
 
-def elem_to_text(elem, default=""):
+def _join_text(elem: etree._Element, separator: str = "", strip: bool = False) -> str:
     """
-    Convert an element to text.
+    Join the text inside an element, like BeautifulSoup's getText.
 
-    :param elem: The element to convert.
-    :type elem: bs4.element.Tag or None
-    :param default: The default value to return if the element is None.
-    :type default: str
+    :param elem: The element.
+    :type elem: etree._Element
+    :param separator: The separator between pieces of text. Defaults to "".
+    :type separator: str
+    :param strip: Whether to strip each piece and drop empty ones. Defaults to False.
+    :type strip: bool
 
-    :return: The text representation of the element, or the default value if the element is None.
+    :return: The text.
     :rtype: str
     """
-    if elem:
-        return elem.getText()
-    else:
-        return default
+    if not strip:
+        return separator.join(elem.itertext())
+    return separator.join(
+        piece.strip() for piece in elem.itertext() if piece.strip()
+    )
 
 
 class TEIFile(object):
     """Class representing a TEI file.
 
-    :param filename: The path to the TEI file.
-    :type filename: str
+    The document is read in a single streaming pass with lxml's iterparse. Header fields and
+    the text of the body divisions are extracted as their elements end, and every element is
+    cleared as soon as no field needs it anymore, so memory stays bounded by the largest
+    division rather than the whole document (references included).
 
-    :ivar filename: The path to the TEI file.
-    :vartype filename: str
-    :ivar soup: The BeautifulSoup object representing the TEI file.
-    :vartype soup: BeautifulSoup
+    :param filename: The path to the TEI file, or the TEI document itself as returned by GROBID.
+    :type filename: Union[str, bytes]
+
+    :ivar filename: The path to the TEI file, or the TEI document.
+    :vartype filename: Union[str, bytes]
     :ivar doi: The DOI of the TEI file.
     :vartype doi: str
     :ivar title: The title of the TEI file.
@@ -86,17 +160,188 @@ class TEIFile(object):
     :vartype authors: List[str]
     :ivar text: The plain text content of the TEI file.
     :vartype text: str
+    :ivar sections: The heading and blocks (paragraphs, formulas, captions) of each section of the body, with figure and table captions last.
+    :vartype sections: List[Tuple[str, List[str]]]
+
+    :cvar _TEXT_KEEPERS: The elements whose text is read when they end, so their descendants are only cleared after them.
+    :vartype _TEXT_KEEPERS: set[str]
+    :cvar FIGURES_SECTION: The heading of the section holding the captions of figures and tables outside any section.
+    :vartype FIGURES_SECTION: str
     """
 
-    def __init__(self, filename):
+    _TEXT_KEEPERS = {"title", "abstract", "author", "figure"}
+    FIGURES_SECTION = "Figures and tables"
+
+    def __init__(self, filename: Union[str, bytes]):
         """
         Constructor for TEIFile object.
         """
         self.filename = filename
-        self.soup = read_tei(filename)
-        self._title = None
-        self._abstract = None
-        self._text = None
+        self._doi: Union[str, None] = None
+        self._title: Union[str, None] = None
+        self._published: Union[str, None] = None
+        self._abstract: Union[str, None] = None
+        self._authors: Union[List[str], None] = None
+        self._text = ""
+        self._sections: List[Tuple[str, List[str]]] = []
+        self._parse()
+
+    def _parse(self):
+        """
+        Extract every field in one pass over the document.
+        """
+        source = (
+            io.BytesIO(self.filename)
+            if isinstance(self.filename, bytes)
+            else self.filename
+        )
+        divs: List[Union[str, None]] = []
+        sections: List[Union[Tuple[str, List[str]], None]] = []
+        captions: List[str] = []
+        open_divs: List[int] = []
+        keep = 0  # Number of open elements whose text is still needed.
+        in_body = False
+        in_analytic = False
+
+        for event, elem in etree.iterparse(
+            source, events=("start", "end"), remove_comments=True, remove_pis=True
+        ):
+            tag = etree.QName(elem).localname
+            if event == "start":
+                if tag == "body":
+                    in_body = True
+                elif tag == "div" and in_body:
+                    # Divisions with a type (e.g. appendices) are not plain text.
+                    open_divs.append(len(divs))
+                    divs.append(None if elem.get("type") else "")
+                    sections.append(None)
+                    keep += 1
+                elif tag == "analytic" and self._authors is None:
+                    in_analytic = True
+                    self._authors = []
+                if tag in self._TEXT_KEEPERS:
+                    keep += 1
+                continue
+
+            if tag == "div" and in_body:
+                idx = open_divs.pop()
+                if divs[idx] is not None:
+                    divs[idx] = _join_text(elem, ": ", strip=True).replace("\n", "")
+                    sections[idx] = self._section(elem)
+                keep -= 1
+            elif tag == "figure" and in_body and not open_divs:
+                captions.append(self._caption(elem))
+            elif tag == "body":
+                in_body = False
+            elif tag == "analytic":
+                in_analytic = False
+            elif tag == "title" and self._title is None:
+                self._title = _join_text(elem)
+            elif tag == "date" and self._published is None:
+                self._published = elem.get("when") or ""
+            elif tag == "idno" and self._doi is None and elem.get("type") == "DOI":
+                self._doi = _join_text(elem)
+            elif tag == "abstract" and self._abstract is None:
+                self._abstract = _join_text(elem, " ", strip=True)
+            elif tag == "author" and in_analytic:
+                self._authors.append(self._author_name(elem))  # type: ignore
+            if tag in self._TEXT_KEEPERS:
+                keep -= 1
+
+            if keep == 0:
+                elem.clear()
+                parent = elem.getparent()
+                while parent is not None and elem.getprevious() is not None:
+                    del parent[0]
+
+        self._text = "\n\n".join(text for text in divs if text is not None)
+        self._sections = [section for section in sections if section is not None]
+        captions = [caption for caption in captions if caption]
+        if captions:
+            self._sections.append((self.FIGURES_SECTION, captions))
+
+    @staticmethod
+    def _block_text(elem: etree._Element) -> str:
+        """
+        Get the text of a block element on a single line.
+
+        :param elem: The element.
+        :type elem: etree._Element
+
+        :return: The text, with whitespace collapsed.
+        :rtype: str
+        """
+        return " ".join(_join_text(elem).split())
+
+    @classmethod
+    def _caption(cls, figure: etree._Element) -> str:
+        """
+        Build the caption of a figure or table element from its head, label and description.
+
+        :param figure: The figure element.
+        :type figure: etree._Element
+
+        :return: The caption, e.g. "Figure 2: The architecture ...".
+        :rtype: str
+        """
+        head = figure.find("{*}head")
+        description = figure.find("{*}figDesc")
+        return ": ".join(
+            text
+            for text in (
+                "" if head is None else cls._block_text(head),
+                "" if description is None else cls._block_text(description),
+            )
+            if text
+        )
+
+    @classmethod
+    def _section(cls, div: etree._Element) -> Tuple[str, List[str]]:
+        """
+        Get the heading and blocks of a section. Nested sections are left out, they are sections of their own.
+
+        :param div: The div element of the section.
+        :type div: etree._Element
+
+        :return: The heading, prefixed with its number if any, and the paragraphs, formulas and captions of the section.
+        :rtype: Tuple[str, List[str]]
+        """
+        heading = ""
+        blocks = []
+        for child in div:
+            tag = etree.QName(child).localname
+            if tag == "head":
+                heading = " ".join(
+                    part for part in (child.get("n", ""), cls._block_text(child)) if part
+                )
+            elif tag == "figure":
+                blocks.append(cls._caption(child))
+            elif tag != "div":
+                blocks.append(cls._block_text(child))
+        return heading, [block for block in blocks if block]
+
+    @staticmethod
+    def _author_name(author: etree._Element) -> str:
+        """
+        Build the full name of an author element.
+
+        :param author: The author element.
+        :type author: etree._Element
+
+        :return: The full name.
+        :rtype: str
+        """
+
+        def first_text(path: str) -> str:
+            elem = author.find(path)
+            return "" if elem is None else _join_text(elem).strip()
+
+        firstname = first_text(".//{*}forename[@type='first']")
+        middlename = first_text(".//{*}forename[@type='middle']")
+        surname = first_text(".//{*}surname")
+        if middlename == "":
+            return f"{firstname} {surname}".strip()
+        return f"{firstname} {middlename} {surname}".strip()
 
     @property
     def doi(self) -> str:
@@ -106,11 +351,7 @@ class TEIFile(object):
         :return: The DOI string.
         :rtype: str
         """
-        idno_elem = self.soup.find("idno", type="DOI")
-        if not idno_elem:
-            return ""
-        else:
-            return idno_elem.getText()
+        return self._doi or ""
 
     @property
     def title(self) -> str:
@@ -120,9 +361,7 @@ class TEIFile(object):
         :return: The title string.
         :rtype: str
         """
-        if not self._title:
-            self._title = self.soup.title.getText()
-        return self._title
+        return self._title or ""
 
     @property
     def published(self) -> str:
@@ -132,11 +371,7 @@ class TEIFile(object):
         :return: The publication date string.
         :rtype: str
         """
-        date = self.soup.date.get("when")
-        if date:
-            return date
-        else:
-            return ""
+        return self._published or ""
 
     @property
     def abstract(self) -> str:
@@ -146,10 +381,7 @@ class TEIFile(object):
         :return: The abstract string.
         :rtype: str
         """
-        if not self._abstract:
-            abstract = self.soup.abstract.getText(separator=" ", strip=True)
-            self._abstract = abstract
-        return self._abstract
+        return self._abstract or ""
 
     @property
     def authors(self) -> List[str]:
@@ -159,19 +391,7 @@ class TEIFile(object):
         :return: A list of author names.
         :rtype: List[str]
         """
-        authors_in_header = self.soup.analytic.find_all("author")
-
-        result = []
-        for author in authors_in_header:
-            firstname = elem_to_text(author.find("forename", type="first")).strip()
-            middlename = elem_to_text(author.find("forename", type="middle")).strip()
-            surname = elem_to_text(author.surname).strip()
-            if middlename == "":
-                full_name = f"{firstname} {surname}".strip()
-            else:
-                full_name = f"{firstname} {middlename} {surname}".strip()
-            result.append(full_name)
-        return result
+        return list(self._authors or [])
 
     @property
     def text(self) -> str:
@@ -181,18 +401,52 @@ class TEIFile(object):
         :return: The plain text string.
         :rtype: str
         """
-        if not self._text:
-            divs_text = []
-            for div in self.soup.body.find_all("div"):
-                # div is neither an appendix nor references, just plain text.
-                if not div.get("type"):
-                    text = div.getText(separator=": ", strip=True).replace("\n", "")
-
-                    divs_text.append(text)
-            plain_text = "\n\n".join(divs_text)
-            self._text = plain_text
         return self._text
 
+    @property
+    def sections(self) -> List[Tuple[str, List[str]]]:
+        """
+        Get the sections of the body.
+
+        :return: The heading and blocks of each section, in document order.
+        :rtype: List[Tuple[str, List[str]]]
+        """
+        return list(self._sections)
+
+
+def tei_metadata(paper_id: str, tei: Union[bytes, None]) -> dict[str, str]:
+    """
+    Read the metadata of a paper from its TEI header.
+
+    :param paper_id: The ID of the paper.
+    :type paper_id: str
+    :param tei: The TEI document returned by GROBID, or None if GROBID failed.
+    :type tei: Union[bytes, None]
+
+    :return: The metadata of the paper. Only the paper ID is known when the TEI is missing or malformed.
+    :rtype: dict[str, str]
+    """
+    try:
+        if tei is None:
+            raise ValueError("no TEI document")
+        tei_object = TEIFile(tei)
+        return {
+            "paper_id": paper_id,
+            "title": tei_object.title or paper_id,
+            "authors": ", ".join([author for author in tei_object.authors]),
+            "date": tei_object.published,
+            "abstract": tei_object.abstract,
+        }
+    except (ValueError, etree.XMLSyntaxError) as e:
+        logger_process_pdf.warning(f"No metadata for {paper_id}: {e}")
+        return {
+            "paper_id": paper_id,
+            "title": paper_id,
+            "authors": "",
+            "date": "",
+            "abstract": "",
+        }
+
 
 class PyMuPDFParser:
     """
@@ -209,23 +463,234 @@ class PyMuPDFParser:
     :ivar id: The arXiv ID of the PDF file (if exist).
     :vartype id: str
 
-    :cvar _INTRO_DELIMITERS: The delimiters used to split the introduction from the rest of the content.
-    :vartype _INTRO_DELIMITERS: str
-    :cvar _REF_DELIMITERS: The delimiters used to split the references from the rest of the content.
-    :vartype _REF_DELIMITERS: str
-    :cvar _APPENDIX_DELIMITERS: The delimiters used to split the appendix from the rest of the content.
-    :vartype _APPENDIX_DELIMITERS: str
+    :cvar _SECTION_SCANNER: The pattern matching the Introduction, References and Appendix headings.
+    :vartype _SECTION_SCANNER: re.Pattern
+    :cvar _INTRO_SEARCH_PAGES: The number of pages searched for the Introduction heading before the whole text is kept.
+    :vartype _INTRO_SEARCH_PAGES: int
+    :cvar _HEADING: The pattern a line set in a heading font must match to be a heading.
+    :vartype _HEADING: re.Pattern
+    :cvar _BOLD_FONT: The pattern matching the names of bold fonts, for PDFs that do not flag them.
+    :vartype _BOLD_FONT: re.Pattern
     """
 
-    _INTRO_DELIMITERS = "|".join(map(re.escape, ["Introduction\n", "INTRODUCTION\n"]))
-    _REF_DELIMITERS = "|".join(map(re.escape, ["References\n", "REFERENCES\n"]))
-    _APPENDIX_DELIMITERS = "|".join(map(re.escape, ["Appendix\n", "APPENDIX\n"]))
+    _SECTION_SCANNER = re.compile(
+        r"(?P<intro>Introduction\n|INTRODUCTION\n)"
+        r"|(?P<references>References\n|REFERENCES\n)"
+        r"|(?P<appendix>Appendix\n|APPENDIX\n)"
+    )
+    _INTRO_SEARCH_PAGES = 3
+    _HEADING = re.compile(
+        r"^(?:(?:\d+(?:\.\d+)*|[IVX]+|[A-H](?:\.\d+)*)\.?\s+)?[A-Z][^\n]{1,100}(?<![.,;:])$"
+    )
+    _SECTION_NUMBER = re.compile(r"^(?:\d+(?:\.\d+)*|[IVX]+|[A-H](?:\.\d+)*)\.?\s+")
+    _BOLD_FONT = re.compile(r"bold|black|heavy|cmbx|medi", re.IGNORECASE)
 
     def __init__(self, pdf_path: str):
         self.pdf_path = pdf_path
         self.doc = fitz.open(self.pdf_path)
         self.id = self.pdf_path.split("/")[-1].split(".")[0]
 
+    def iter_pages(self) -> Iterator[str]:
+        """
+        Iterate over the text of the PDF file, one page at a time.
+
+        :return: An iterator over the text of each page.
+        :rtype: Iterator[str]
+        """
+        for page in self.doc:
+            yield page.get_text()  # type: ignore
+
+    def iter_content(self) -> Iterator[str]:
+        """
+        Iterate over the content of the PDF file (text body and appendices), page by page.
+
+        The Introduction, References and Appendix headings are detected incrementally with a
+        single scanner, so only the pages before the Introduction are ever buffered. Text before
+        the Introduction and the references are dropped.
+
+        :return: An iterator over pieces of the content.
+        :rtype: Iterator[str]
+        """
+        state = "preamble"
+        preamble: List[str] = []
+        for page_number, text in enumerate(self.iter_pages()):
+            if state == "preamble" and page_number >= self._INTRO_SEARCH_PAGES:
+                # No Introduction heading near the start, keep everything.
+                yield from preamble
+                preamble = []
+                state = "body"
+
+            start = 0
+            for match in self._SECTION_SCANNER.finditer(text):
+                section = match.lastgroup
+                if section == "intro" and state == "preamble":
+                    preamble = []
+                    state = "body"
+                elif section == "references" and state != "references":
+                    if state == "preamble":
+                        yield from preamble
+                        preamble = []
+                    yield text[start : match.start()]
+                    state = "references"
+                elif section == "appendix" and state in ("body", "references"):
+                    if state == "body":
+                        yield text[start : match.start()]
+                    yield "\n\n"
+                    state = "appendix"
+                else:
+                    continue
+                start = match.end()
+
+            if state == "preamble":
+                preamble.append(text[start:])
+            elif state != "references":
+                yield text[start:]
+
+        yield from preamble
+
+    def _body_font_size(self) -> float:
+        """
+        Get the font size of the body text: the size most characters of the first pages are set in.
+
+        :return: The font size.
+        :rtype: float
+        """
+        sizes: dict[float, int] = {}
+        for page in self.doc.pages(0, min(5, len(self.doc))):
+            for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:  # type: ignore
+                for line in block.get("lines", []):
+                    for span in line["spans"]:
+                        size = round(span["size"])
+                        sizes[size] = sizes.get(size, 0) + len(span["text"].strip())
+        return float(max(sizes, key=sizes.__getitem__)) if sizes else 10.0
+
+    def _is_heading(self, line: dict, body_size: float) -> bool:
+        """
+        Check if a line is a section heading: set in bold or larger than the body text, short, and not a sentence.
+
+        :param line: The line, as returned by PyMuPDF's "dict" extraction.
+        :type line: dict
+        :param body_size: The font size of the body text.
+        :type body_size: float
+
+        :return: Whether the line is a heading.
+        :rtype: bool
+        """
+        spans = [span for span in line["spans"] if span["text"].strip()]
+        if not spans:
+            return False
+        text = "".join(span["text"] for span in line["spans"]).strip()
+        return all(
+            span["size"] >= body_size * 1.15
+            or span["flags"] & 16
+            or self._BOLD_FONT.search(span["font"])
+            for span in spans
+        ) and bool(self._HEADING.match(text))
+
+    @staticmethod
+    def _join_lines(lines: List[str]) -> str:
+        """
+        Join the lines of a block into a single line, undoing hyphenation at line ends.
+
+        :param lines: The lines.
+        :type lines: List[str]
+
+        :return: The text of the block.
+        :rtype: str
+        """
+        text = ""
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if text.endswith("-") and line[:1].islower():
+                text = text[:-1] + line
+            else:
+                text = f"{text} {line}" if text else line
+        return text
+
+    def iter_blocks(self, page: fitz.Page, body_size: float) -> Iterator[Tuple[bool, str]]:
+        """
+        Iterate over the text blocks of a page, separating headings from paragraphs.
+
+        Rotated lines (e.g. the arXiv identifier in the margin) and bare page numbers are dropped.
+
+        :param page: The page.
+        :type page: fitz.Page
+        :param body_size: The font size of the body text.
+        :type body_size: float
+
+        :return: An iterator over whether each block is a heading, and its text.
+        :rtype: Iterator[Tuple[bool, str]]
+        """
+        for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:  # type: ignore
+            lines = [
+                line
+                for line in block.get("lines", [])
+                if tuple(line["dir"]) == (1.0, 0.0)
+            ]
+            n_heading = 0
+            while n_heading < len(lines) and self._is_heading(lines[n_heading], body_size):
+                n_heading += 1
+
+            texts = ["".join(span["text"] for span in line["spans"]) for line in lines]
+            if n_heading:
+                yield True, " ".join(" ".join(texts[:n_heading]).split())
+            paragraph = self._join_lines(texts[n_heading:])
+            if paragraph and not paragraph.isdigit():
+                yield False, paragraph
+
+    def iter_sections(self) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Iterate over the sections of the PDF file (text body and appendices), using the fonts of the headings.
+
+        Like iter_content, text before the Introduction and the references are dropped, and
+        only the sections before the Introduction are ever buffered.
+
+        :return: An iterator over the heading and blocks (paragraphs, formulas, captions) of each section.
+        :rtype: Iterator[Tuple[str, List[str]]]
+        """
+        body_size = self._body_font_size()
+        state = "preamble"
+        preamble: List[Tuple[str, List[str]]] = []
+        heading, blocks = "", []
+        for page_number, page in enumerate(self.doc):
+            if state == "preamble" and page_number >= self._INTRO_SEARCH_PAGES:
+                # No Introduction heading near the start, keep everything.
+                yield from preamble
+                preamble = []
+                state = "body"
+
+            for is_heading, text in self.iter_blocks(page, body_size):
+                if not is_heading:
+                    if state != "references":
+                        blocks.append(text)
+                    continue
+
+                if state == "preamble":
+                    preamble.append((heading, blocks))
+                elif state != "references":
+                    yield heading, blocks
+
+                name = self._SECTION_NUMBER.sub("", text).lower()
+                if state == "preamble" and name.startswith("introduction"):
+                    preamble = []
+                    state = "body"
+                elif name in ("references", "bibliography"):
+                    state = "references"
+                elif state == "references" and (
+                    name.startswith("appendix") or self._SECTION_NUMBER.match(text)
+                ):
+                    state = "appendix"
+                heading, blocks = text, []
+
+        if state != "references":
+            if state == "preamble":
+                preamble.append((heading, blocks))
+            else:
+                yield heading, blocks
+        yield from preamble
+
     def process(self) -> str:
         """
         Process the PDF file and extract the content (text body and appendices).
@@ -233,16 +698,676 @@ class PyMuPDFParser:
         :return: The content of the PDF file.
         :rtype: str
         """
-        content = ""
-        for page in self.doc:
-            content += page.get_text()  # type: ignore
+        return "".join(self.iter_content())
+
+
+def split_stream(
+    text_splitter: TextSplitter, pieces: Iterable[str], window: int
+) -> Iterator[str]:
+    """
+    Split a stream of text pieces into chunks without holding the whole text in memory.
+
+    Pieces are accumulated into a window of a few chunks; once the window is full it is
+    split and every chunk but the last is emitted. The last chunk is carried over into the
+    next window so chunks never end at an arbitrary page boundary.
+
+    :param text_splitter: The text splitter used to split each window.
+    :type text_splitter: TextSplitter
+    :param pieces: The pieces of text to split, e.g. the pages of a PDF.
+    :type pieces: Iterable[str]
+    :param window: The number of characters buffered before the window is split.
+    :type window: int
+
+    :return: An iterator over the chunks.
+    :rtype: Iterator[str]
+    """
+    buffer: List[str] = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size < window:
+            continue
+
+        chunks = text_splitter.split_text("".join(buffer))
+        yield from chunks[:-1]
+        buffer = chunks[-1:]
+        size = sum(len(chunk) for chunk in buffer)
+
+    if buffer:
+        yield from text_splitter.split_text("".join(buffer))
+
+
+_CAPTION = re.compile(r"^(?:Figure|Fig\.|Table)\s*\d+", re.IGNORECASE)
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\[])|\n{2,}")
+
+
+def _wrap(text: str, width: int) -> List[str]:
+    """
+    Split text at whitespace into pieces of at most width characters.
+
+    :param text: The text to split.
+    :type text: str
+    :param width: The maximum number of characters of a piece. Words longer than that are cut.
+    :type width: int
+
+    :return: The pieces.
+    :rtype: List[str]
+    """
+    pieces: List[str] = []
+    current = ""
+    for word in text.split():
+        while len(word) > width:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(word[:width])
+            word = word[width:]
+        if not word:
+            continue
+        if current and len(current) + 1 + len(word) > width:
+            pieces.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _join_pieces(pieces: List[Tuple[str, str]]) -> str:
+    """
+    Join the pieces of a chunk, each after its separator but the first.
+
+    :param pieces: The separator and text of each piece.
+    :type pieces: List[Tuple[str, str]]
+
+    :return: The text of the chunk.
+    :rtype: str
+    """
+    return "".join(f"{separator}{text}" if i else text for i, (separator, text) in enumerate(pieces))
+
+
+def chunk_sections(
+    text_splitter: TextSplitter,
+    sections: Iterable[Tuple[str, List[str]]],
+    chunk_size: int,
+    chunk_overlap: int = 0,
+) -> Iterator[Tuple[str, str]]:
+    """
+    Pack the blocks of each section into chunks that never straddle two sections.
+
+    Blocks (paragraphs, formulas, captions) are packed in order, sentence by sentence, until
+    the chunk is full; captions that fit in a chunk are kept whole, and only sentences longer
+    than a chunk are split with the text splitter (and at whitespace if still too long).
+    Every chunk starts with its section heading, cut to half a chunk, and a chunk of a section
+    starts with the last sentences of the previous one, up to chunk_overlap characters.
+    Sections with a heading but no text (e.g. "3 Method" directly followed by "3.1 Setup") are
+    folded into the heading of the next section. The last chunk of a section is shared with
+    the following sections that fit in it whole, so short sections and section ends do not
+    produce many small chunks.
+
+    :param text_splitter: The text splitter used to split blocks longer than a chunk.
+    :type text_splitter: TextSplitter
+    :param sections: The heading and blocks of each section.
+    :type sections: Iterable[Tuple[str, List[str]]]
+    :param chunk_size: The maximum number of characters of a chunk.
+    :type chunk_size: int
+    :param chunk_overlap: The maximum number of characters repeated from the previous chunk of the same section. Defaults to 0.
+    :type chunk_overlap: int
+
+    :return: An iterator over the section heading(s) and text of each chunk.
+    :rtype: Iterator[Tuple[str, str]]
+    """
+    parents: List[str] = []
+    merged: List[Tuple[str, str]] = []  # The last chunk of a section and whole sections after it.
+    for heading, blocks in sections:
+        if not blocks:
+            if heading:
+                parents.append(heading)
+            continue
+
+        # The heading takes at most half of a chunk, leaving the rest for text.
+        section = " / ".join(parents + ([heading] if heading else []))[: chunk_size // 2 - 1]
+        parents = []
+        prefix = f"{section}\n" if section else ""
+        budget = chunk_size - len(prefix)
+
+        chunks: List[str] = []
+        current: List[Tuple[str, str]] = []
+        for block in blocks:
+            if _CAPTION.match(block) and len(block) <= budget:
+                pieces = [block]
+            else:
+                pieces = []
+                for sentence in _SENTENCE_BOUNDARY.split(block):
+                    if len(sentence) > budget:
+                        for part in text_splitter.split_text(sentence):
+                            pieces.extend(_wrap(part, budget) if len(part) > budget else [part])
+                    elif sentence.strip():
+                        pieces.append(sentence)
+
+            separator = "\n\n"
+            for piece in pieces:
+                if current and len(_join_pieces(current)) + len(separator) + len(piece) > budget:
+                    chunks.append(prefix + _join_pieces(current))
+                    overlap: List[Tuple[str, str]] = []
+                    for previous in reversed(current):
+                        length = len(_join_pieces([previous] + overlap))
+                        if length > chunk_overlap or length + len(separator) + len(piece) > budget:
+                            break
+                        overlap.insert(0, previous)
+                    current = overlap
+                current.append((separator, piece))
+                separator = " "
+        if current:
+            chunks.append(prefix + _join_pieces(current))
+
+        merged_size = sum(len(text) + 2 for _, text in merged)
+        if len(chunks) == 1 and merged_size + len(chunks[0]) <= chunk_size:
+            merged.append((section, chunks[0]))
+            continue
+        if merged:
+            yield "; ".join(name for name, _ in merged), "\n\n".join(
+                text for _, text in merged
+            )
+        for text in chunks[:-1]:
+            yield section, text
+        merged = [(section, chunks[-1])]
+
+    if merged:
+        yield "; ".join(name for name, _ in merged), "\n\n".join(
+            text for _, text in merged
+        )
+
+
+def chunk_file(
+    text_splitter: TextSplitter,
+    parser: Literal["PyMuPDF", "GROBID"],
+    path: Union[str, bytes],
+    window: int,
+    chunker: Literal["Text", "Section"] = "Text",
+    chunk_size: int = 1024,
+    chunk_overlap: int = 0,
+) -> List[Tuple[str, str]]:
+    """
+    Parse a single file and split its content into chunks.
+
+    :param text_splitter: The text splitter used to split the content.
+    :type text_splitter: TextSplitter
+    :param parser: The parser the file comes from. "PyMuPDF" expects a PDF, "GROBID" a TEI file or document.
+    :type parser: Literal["PyMuPDF", "GROBID"]
+    :param path: The path to the PDF or TEI file, or the TEI document returned by GROBID.
+    :type path: Union[str, bytes]
+    :param window: The number of characters buffered before the stream is split.
+    :type window: int
+    :param chunker: "Text": split the flattened text. "Section": chunk each section on its own, see chunk_sections. Defaults to "Text".
+    :type chunker: Literal["Text", "Section"]
+    :param chunk_size: The maximum number of characters of a section chunk. Defaults to 1024.
+    :type chunk_size: int
+    :param chunk_overlap: The maximum overlap between consecutive chunks of a section. Defaults to 0.
+    :type chunk_overlap: int
+
+    :return: The section (empty for the "Text" chunker) and text of each chunk of the file, in document order.
+    :rtype: List[Tuple[str, str]]
+    """
+    if chunker == "Section":
+        sections = (
+            PyMuPDFParser(path).iter_sections()  # type: ignore
+            if parser == "PyMuPDF"
+            else TEIFile(path).sections
+        )
+        return list(chunk_sections(text_splitter, sections, chunk_size, chunk_overlap))
+
+    if parser == "PyMuPDF":
+        chunks: Iterable[str] = split_stream(
+            text_splitter, PyMuPDFParser(path).iter_content(), window  # type: ignore
+        )
+    else:
+        chunks = text_splitter.split_text(TEIFile(path).text)
+    return [("", chunk) for chunk in chunks]
+
+
+class RegexTextSplitter(TextSplitter):
+    """
+    Text splitter that segments sentences with a regular expression instead of a spaCy pipeline.
+
+    :param separator: The separator used to merge sentences into chunks. Defaults to "\\n\\n".
+    :type separator: str
+    """
+
+    def __init__(self, separator: str = "\n\n", **kwargs: Any):
+        """
+        Constructor for the RegexTextSplitter object.
+        """
+        super().__init__(**kwargs)
+        self._separator = separator
+
+    def split_text(self, text: str) -> List[str]:
+        """
+        Split text into sentences and merge them into chunks.
+
+        :param text: The text to split.
+        :type text: str
+
+        :return: The chunks.
+        :rtype: List[str]
+        """
+        splits = (
+            sentence
+            for sentence in _SENTENCE_BOUNDARY.split(text)
+            if sentence and not sentence.isspace()
+        )
+        return self._merge_splits(splits, self._separator)
+
+
+_text_splitters: dict[Tuple[int, int, str, str], TextSplitter] = {}
+_text_splitters_lock = threading.Lock()
+
+
+def get_text_splitter(
+    chunk_size: int = 1024,
+    chunk_overlap: int = 100,
+    separator: str = "\n\n",
+    segmenter: Literal["spaCy", "Sentencizer", "Regex"] = "spaCy",
+) -> TextSplitter:
+    """
+    Get the process-wide text splitter for a configuration, building it on first use.
+
+    Building a spaCy splitter loads a pipeline from disk, so splitters are shared by every
+    ProcessPDF object (and every session) with the same configuration.
+
+    :param chunk_size: The size of each text chunk. Defaults to 1024.
+    :type chunk_size: int
+    :param chunk_overlap: The overlap between consecutive text chunks. Defaults to 100.
+    :type chunk_overlap: int
+    :param separator: The separator used to merge sentences into chunks. Defaults to "\\n\\n".
+    :type separator: str
+    :param segmenter: The sentence segmentation. "spaCy": the en_core_web_sm pipeline. "Sentencizer": spaCy's rule-based sentencizer only. "Regex": a regular expression, no spaCy. Defaults to "spaCy".
+    :type segmenter: Literal["spaCy", "Sentencizer", "Regex"]
+
+    :return: The text splitter.
+    :rtype: TextSplitter
+    """
+    key = (chunk_size, chunk_overlap, separator, segmenter)
+    with _text_splitters_lock:
+        if key not in _text_splitters:
+            if segmenter == "Regex":
+                text_splitter: TextSplitter = RegexTextSplitter(
+                    separator=separator,
+                    chunk_size=chunk_size,
+                    chunk_overlap=chunk_overlap,
+                )
+            else:
+                text_splitter = SpacyTextSplitter(
+                    separator=separator,
+                    pipeline="sentencizer" if segmenter == "Sentencizer" else "en_core_web_sm",
+                    chunk_size=chunk_size,
+                    chunk_overlap=chunk_overlap,
+                )
+            _text_splitters[key] = text_splitter
+        return _text_splitters[key]
+
+
+def _chunk_file_in_worker(
+    parser: Literal["PyMuPDF", "GROBID"],
+    path: Union[str, bytes],
+    chunk_size: int,
+    chunk_overlap: int,
+    segmenter: Literal["spaCy", "Sentencizer", "Regex"],
+    window: int,
+    chunker: Literal["Text", "Section"],
+) -> List[Tuple[str, str]]:
+    """
+    Entry point of the process pool: parse and chunk a single file.
+    """
+    return chunk_file(
+        get_text_splitter(chunk_size, chunk_overlap, segmenter=segmenter),
+        parser,
+        path,
+        window,
+        chunker,
+        chunk_size,
+        chunk_overlap,
+    )
+
+
+_process_pools: dict[int, ProcessPoolExecutor] = {}
+
+
+def _get_process_pool(
+    n_workers: int,
+    chunk_size: int,
+    chunk_overlap: int,
+    segmenter: Literal["spaCy", "Sentencizer", "Regex"],
+) -> ProcessPoolExecutor:
+    """
+    Get the process pool shared by every ProcessPDF object with the same number of workers.
+
+    Workers are spawned rather than forked, since the parent process holds database
+    connections and thread pools, and each worker builds its text splitter on start.
+
+    :param n_workers: The number of worker processes.
+    :type n_workers: int
+    :param chunk_size: The chunk size the workers are warmed up with.
+    :type chunk_size: int
+    :param chunk_overlap: The chunk overlap the workers are warmed up with.
+    :type chunk_overlap: int
+    :param segmenter: The sentence segmentation the workers are warmed up with.
+    :type segmenter: Literal["spaCy", "Sentencizer", "Regex"]
+
+    :return: The process pool.
+    :rtype: ProcessPoolExecutor
+    """
+    if n_workers not in _process_pools:
+        _process_pools[n_workers] = ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=get_text_splitter,
+            initargs=(chunk_size, chunk_overlap, "\n\n", segmenter),
+        )
+    return _process_pools[n_workers]
+
+
+class MetadataResolver:
+    """
+    Resolve the metadata of PDF documents from the cheapest source that has it.
+
+    Sources are tried in order, and each one only sees the PDFs the previous ones could not
+    resolve:
+
+    - "cache": the arXiv ID in the file name, looked up in the local arXiv metadata cache.
+    - "arxiv": the same ID, looked up in one batched arXiv API query.
+    - "pdf_info": the title and author of the PDF information dictionary.
+    - "first_page": the title set in the largest font at the top of the first page.
+    - "grobid": the GROBID header of the PDF.
+
+    The abstract of the PDF sources is taken from the first page of the PDF.
+
+    :param grobid_client: The GROBID client used as the last resort.
+    :type grobid_client: GrobidService
+    :param sources: The sources to try, in order. Defaults to all of them, or the comma-separated METADATA_SOURCES environment variable.
+    :type sources: Union[List[str], None]
+
+    :ivar timings: The total time in seconds spent in each source.
+    :vartype timings: dict[str, float]
+    :ivar hits: The number of PDFs resolved by each source.
+    :vartype hits: dict[str, int]
+
+    :cvar SOURCES: The available sources, in their default order.
+    :vartype SOURCES: Tuple[str, ...]
+    """
+
+    SOURCES = ("cache", "arxiv", "pdf_info", "first_page", "grobid")
+
+    _ARXIV_ID = re.compile(r"^(\d{4}\.\d{4,5})(v\d+)?$")
+    _ABSTRACT = re.compile(
+        r"\babstract\b[\s.:—-]*(?P<abstract>.+?)"
+        r"(?:\n\s*(?:1|I)?\.?\s*(?:introduction|keywords|index terms)\b|$)",
+        re.IGNORECASE | re.DOTALL,
+    )
+    _NOT_A_TITLE = re.compile(
+        r"^(untitled|microsoft word\b.*|.*\.(dvi|pdf|tex|docx?))$", re.IGNORECASE
+    )
+
+    def __init__(
+        self, grobid_client: GrobidService, sources: Union[List[str], None] = None
+    ):
+        """
+        Constructor for the MetadataResolver object.
+        """
+        self.grobid_client = grobid_client
+        self.sources = sources or os.environ.get(
+            "METADATA_SOURCES", ",".join(self.SOURCES)
+        ).split(",")
+        self.timings: dict[str, float] = {source: 0.0 for source in self.SOURCES}
+        self.hits: dict[str, int] = {source: 0 for source in self.SOURCES}
+
+    def _from_arxiv(
+        self, paper_ids: dict[int, str], cached_only: bool
+    ) -> dict[int, dict[str, str]]:
+        """
+        Look up the papers whose ID is an arXiv ID.
+
+        :param paper_ids: The ID of each unresolved PDF, by position.
+        :type paper_ids: dict[int, str]
+        :param cached_only: Whether to only look in the local cache.
+        :type cached_only: bool
+
+        :return: The metadata of each resolved PDF, by position.
+        :rtype: dict[int, dict[str, str]]
+        """
+        arxiv_ids = {}
+        for idx, paper_id in paper_ids.items():
+            match = self._ARXIV_ID.match(paper_id)
+            if match:
+                arxiv_ids[idx] = match.group(1)
+        if not arxiv_ids:
+            return {}
+
+        try:
+            papers = fetch_arxiv_metadata(
+                list(dict.fromkeys(arxiv_ids.values())), cached_only=cached_only
+            )
+        except Exception as e:
+            logger_metadata_resolver.warning(f"arXiv lookup failed: {e}")
+            return {}
+
+        return {
+            idx: {
+                "paper_id": paper_ids[idx],
+                **{
+                    key: papers[arxiv_id][key]
+                    for key in ("title", "authors", "date", "abstract")
+                },
+            }
+            for idx, arxiv_id in arxiv_ids.items()
+            if arxiv_id in papers
+        }
+
+    def _abstract(self, doc: fitz.Document) -> str:
+        """
+        Find the abstract on the first page of a PDF.
+
+        :param doc: The PDF.
+        :type doc: fitz.Document
+
+        :return: The abstract, or an empty string.
+        :rtype: str
+        """
+        match = self._ABSTRACT.search(doc[0].get_text())  # type: ignore
+        if not match:
+            return ""
+        return " ".join(match.group("abstract").split())[:3000]
+
+    def _from_pdf_info(self, paper_id: str, doc: fitz.Document) -> Union[dict[str, str], None]:
+        """
+        Read the title and author of the PDF information dictionary.
+
+        :param paper_id: The ID of the paper.
+        :type paper_id: str
+        :param doc: The PDF.
+        :type doc: fitz.Document
+
+        :return: The metadata, or None if the dictionary has no usable title.
+        :rtype: Union[dict[str, str], None]
+        """
+        info = doc.metadata or {}
+        title = " ".join((info.get("title") or "").split())
+        if len(title) < 8 or self._NOT_A_TITLE.match(title):
+            return None
+
+        created = re.match(r"D:(\d{4})(\d{2})(\d{2})", info.get("creationDate") or "")
+        return {
+            "paper_id": paper_id,
+            "title": title,
+            "authors": " ".join((info.get("author") or "").split()),
+            "date": "-".join(created.groups()) if created else "",
+            "abstract": self._abstract(doc),
+        }
+
+    def _from_first_page(
+        self, paper_id: str, doc: fitz.Document
+    ) -> Union[dict[str, str], None]:
+        """
+        Take the lines set in the largest font in the top half of the first page as the title.
+
+        Rotated lines, like the arXiv identifier in the margin, are ignored.
+
+        :param paper_id: The ID of the paper.
+        :type paper_id: str
+        :param doc: The PDF.
+        :type doc: fitz.Document
+
+        :return: The metadata, or None if no line stands out from the body text.
+        :rtype: Union[dict[str, str], None]
+        """
+        page = doc[0]
+        lines = []
+        for block in page.get_text("dict")["blocks"]:  # type: ignore
+            for line in block.get("lines", []):
+                text = "".join(span["text"] for span in line["spans"]).strip()
+                if text and tuple(line["dir"]) == (1.0, 0.0):
+                    size = max(span["size"] for span in line["spans"])
+                    lines.append((line["bbox"][1], round(size, 1), text))
+        if not lines:
+            return None
+
+        body_size = sorted(size for _, size, _ in lines)[len(lines) // 2]
+        top = [line for line in lines if line[0] < page.rect.height / 2]
+        if not top:
+            return None
+        title_size = max(size for _, size, _ in top)
+        if title_size < body_size * 1.15:
+            return None
+
+        title = " ".join(
+            text for _, size, text in sorted(top) if size >= title_size - 0.5
+        )
+        if not 8 <= len(title) <= 300:
+            return None
+
+        author = " ".join(((doc.metadata or {}).get("author") or "").split())
+        return {
+            "paper_id": paper_id,
+            "title": title,
+            "authors": author,
+            "date": "",
+            "abstract": self._abstract(doc),
+        }
+
+    def _from_pdf(
+        self, source: str, pdf_paths: List[str], paper_ids: dict[int, str]
+    ) -> dict[int, dict[str, str]]:
+        """
+        Resolve metadata from the PDFs themselves with PyMuPDF.
+
+        :param source: Either "pdf_info" or "first_page".
+        :type source: str
+        :param pdf_paths: The paths to the PDF documents.
+        :type pdf_paths: List[str]
+        :param paper_ids: The ID of each unresolved PDF, by position.
+        :type paper_ids: dict[int, str]
+
+        :return: The metadata of each resolved PDF, by position.
+        :rtype: dict[int, dict[str, str]]
+        """
+        extract = self._from_pdf_info if source == "pdf_info" else self._from_first_page
+        resolved = {}
+        for idx, paper_id in paper_ids.items():
+            try:
+                with fitz.open(pdf_paths[idx]) as doc:
+                    metadata = extract(paper_id, doc)
+            except Exception as e:
+                logger_metadata_resolver.warning(
+                    f"Cannot read {pdf_paths[idx]} with PyMuPDF: {e}"
+                )
+                continue
+            if metadata:
+                resolved[idx] = metadata
+        return resolved
+
+    def _from_grobid(
+        self, pdf_paths: List[str], paper_ids: dict[int, str]
+    ) -> dict[int, dict[str, str]]:
+        """
+        Resolve metadata from the GROBID header of each PDF. PDFs GROBID fails on only get their ID.
 
-        content = re.split(self._INTRO_DELIMITERS, content)[-1]
-        content = re.split(self._REF_DELIMITERS, content)[0]
-        appendix = re.split(self._APPENDIX_DELIMITERS, content)[-1]
-        content += "\n\n" + appendix
+        :param pdf_paths: The paths to the PDF documents.
+        :type pdf_paths: List[str]
+        :param paper_ids: The ID of each unresolved PDF, by position.
+        :type paper_ids: dict[int, str]
 
-        return content
+        :return: The metadata of each PDF, by position.
+        :rtype: dict[int, dict[str, str]]
+        """
+        results = self.grobid_client.process_batch(
+            "processHeaderDocument", [pdf_paths[idx] for idx in paper_ids]
+        )
+        return {
+            idx: tei_metadata(paper_id, tei)
+            for (idx, paper_id), (_, _, tei) in zip(paper_ids.items(), results)
+        }
+
+    def resolve(
+        self, pdf_paths: List[str], paper_ids: List[str]
+    ) -> List[dict[str, str]]:
+        """
+        Resolve the metadata of PDF documents.
+
+        :param pdf_paths: The paths to the PDF documents.
+        :type pdf_paths: List[str]
+        :param paper_ids: The ID of each PDF, e.g. the arXiv ID in its file name.
+        :type paper_ids: List[str]
+
+        :return: The metadata of each PDF, in the order of the paths.
+        :rtype: List[dict[str, str]]
+        """
+        unresolved = dict(enumerate(paper_ids))
+        resolved: dict[int, dict[str, str]] = {}
+        used: dict[str, str] = {}
+        for source in self.sources:
+            if not unresolved:
+                break
+            start = time.perf_counter()
+            if source in ("cache", "arxiv"):
+                found = self._from_arxiv(unresolved, cached_only=source == "cache")
+            elif source in ("pdf_info", "first_page"):
+                found = self._from_pdf(source, pdf_paths, unresolved)
+            elif source == "grobid":
+                found = self._from_grobid(pdf_paths, unresolved)
+            else:
+                raise ValueError(f"Unknown metadata source: {source}")
+            seconds = time.perf_counter() - start
+            self.timings[source] += seconds
+            self.hits[source] += len(found)
+
+            for idx in found:
+                del unresolved[idx]
+            resolved.update(found)
+            used[source] = f"{len(found)} ({seconds:.2f}s)"
+
+        for idx, paper_id in unresolved.items():
+            logger_metadata_resolver.warning(f"No metadata for {paper_id}")
+            resolved[idx] = tei_metadata(paper_id, None)
+
+        logger_metadata_resolver.info(
+            f"Resolved metadata of {len(paper_ids)} PDFs: "
+            + ", ".join(f"{source}={hits}" for source, hits in used.items())
+        )
+        return [resolved[idx] for idx in range(len(paper_ids))]
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """
+        Get the number of PDFs resolved by each source and the time spent in it.
+
+        :return: The hits and seconds of each source.
+        :rtype: dict[str, dict[str, float]]
+        """
+        return {
+            source: {"hits": self.hits[source], "seconds": self.timings[source]}
+            for source in self.SOURCES
+        }
 
 
 class ProcessPDF:
@@ -257,37 +1382,364 @@ class ProcessPDF:
     :type chunk_size: int
     :param chunk_overlap: The overlap between consecutive text chunks in bytes. Defaults to 100.
     :type chunk_overlap: int
-
+    :param segmenter: The sentence segmentation used to split the text. Can be "spaCy", "Sentencizer" or "Regex". Defaults to "spaCy".
+    :type segmenter: Literal["spaCy", "Sentencizer", "Regex"]
+    :param scope: The scope of the indexed chunks. "public" for the corpus shared by all sessions, or a session ID for files only that session can retrieve. Defaults to "public".
+    :type scope: str
+    :param chunker: "Text": split the flattened text of each paper. "Section": chunk each section on its own and record its heading in the "section" metadata. Defaults to the CHUNKER environment variable, or "Text".
+    :type chunker: Union[Literal["Text", "Section"], None]
+    :param n_workers: The number of processes used to parse and chunk PDFs. Defaults to the PDF_PROCESS_WORKERS environment variable, or 1 (no pool).
+    :type n_workers: Union[int, None]
+    :param parent_chunks: The maximum number of chunks of a section grouped into the parent span returned in their place at retrieval time. Defaults to the PARENT_CHUNKS environment variable, or 4.
+    :type parent_chunks: Union[int, None]
 
     :ivar vectordb: The vector store used for storing document vectors.
     :vartype vectordb: VectorStore
     :ivar parser: The PDF parser to use. Can be either "PyMuPDF" or "GROBID". Defaults to "PyMuPDF".
     :vartype parser: Literal["PyMuPDF", "GROBID"]
-    :ivar text_splitter: The TextSplitter object from Langchain used to split the text into chunks. Defaults to SpacyTextSplitter.
+    :ivar text_splitter: The shared TextSplitter object from Langchain used to split the text into chunks, loaded on first use. Defaults to SpacyTextSplitter.
     :vartype text_splitter: langchain.text_splitter.TextSplitter
-
-    :cvar grobid_client: The GROBID client object.
-    :vartype grobid_client: grobid_client.grobid_client.GrobidClient
+    :ivar writer: The batched writer used to embed and store chunks.
+    :vartype writer: EmbeddingWriter
+    :ivar timings: The duration in seconds of each stage of the last call to process. Papers are streamed through the stages, so the stages overlap and their durations add up to more than "total".
+    :vartype timings: dict[str, float]
+    :ivar file_status: The status of each file of the last call to process: "indexed", or "failed" when GROBID could not parse it or some of its chunks could not be written.
+    :vartype file_status: dict[str, str]
+    :ivar grobid_client: The pooled GROBID client shared by the process.
+    :vartype grobid_client: GrobidService
+    :ivar metadata_resolver: The resolver of the metadata of PDFs processed without metadata.
+    :vartype metadata_resolver: MetadataResolver
+
+    :cvar _SPLIT_WINDOW_CHUNKS: The number of chunks of text buffered before the stream is split.
+    :vartype _SPLIT_WINDOW_CHUNKS: int
+    :cvar _QUEUED_PAPERS: The number of chunked papers aprocess buffers while they wait to be embedded.
+    :vartype _QUEUED_PAPERS: int
     """
 
+    _SPLIT_WINDOW_CHUNKS = 8
+    _QUEUED_PAPERS = 4
+
     def __init__(
         self,
         vectordb: VectorStore,
         parser: Literal["PyMuPDF", "GROBID"] = "PyMuPDF",
         chunk_size: int = 1024,
         chunk_overlap: int = 100,
+        segmenter: Literal["spaCy", "Sentencizer", "Regex"] = "spaCy",
+        scope: str = PUBLIC_SCOPE,
+        n_workers: Union[int, None] = None,
+        chunker: Union[Literal["Text", "Section"], None] = None,
+        parent_chunks: Union[int, None] = None,
     ):
         """
         Constructor for the ProcessPDF object.
         """
-        self.grobid_client = GrobidClient(
-            grobid_server=os.environ.get("GROBID_FQDN"), sleep_time=0, batch_size=10
-        )
+        self.grobid_client: GrobidService = get_grobid_service()
+        self.metadata_resolver = MetadataResolver(self.grobid_client)
         self.vectordb = vectordb
         self.parser = parser
-        self.text_splitter = SpacyTextSplitter(
-            chunk_size=chunk_size, chunk_overlap=chunk_overlap, separator="\n\n"
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.segmenter = segmenter
+        self.scope = scope
+        self.chunker = chunker or os.environ.get("CHUNKER", "Text")
+        self.n_workers = n_workers or int(os.environ.get("PDF_PROCESS_WORKERS", 1))
+        self.parent_chunks = parent_chunks or int(os.environ.get("PARENT_CHUNKS", 4))
+        self.writer = EmbeddingWriter(
+            vectordb,
+            max_batch_tokens=int(os.environ.get("EMBEDDING_BATCH_TOKENS", 50_000)),
+            max_concurrency=int(os.environ.get("EMBEDDING_CONCURRENCY", 4)),
+        )
+        self.timings: dict[str, float] = {}
+        self.file_status: dict[str, str] = {}
+
+    @property
+    def text_splitter(self) -> TextSplitter:
+        """
+        Get the shared text splitter of this configuration.
+
+        :return: The text splitter.
+        :rtype: TextSplitter
+        """
+        return get_text_splitter(
+            self.chunk_size, self.chunk_overlap, segmenter=self.segmenter
+        )
+
+    def _add_timing(self, stage: str, seconds: float):
+        """
+        Add time spent in a stage of the current call to process.
+
+        :param stage: The name of the stage.
+        :type stage: str
+        :param seconds: The duration in seconds.
+        :type seconds: float
+        """
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def _iter_chunks(
+        self,
+        parser: Literal["PyMuPDF", "GROBID"],
+        sources: Iterable[Tuple[int, Union[str, bytes]]],
+    ) -> Iterator[Tuple[int, List[Tuple[str, str]]]]:
+        """
+        Parse and chunk files as they become available, fanning out to the process pool when more than one worker is configured.
+
+        :param parser: The parser the files come from. "PyMuPDF" expects PDFs, "GROBID" TEI documents.
+        :type parser: Literal["PyMuPDF", "GROBID"]
+        :param sources: The position and path (or TEI document) of each file. May be lazy, e.g. fed by GROBID as each response arrives.
+        :type sources: Iterable[Tuple[int, Union[str, bytes]]]
+
+        :return: An iterator over the position and chunks (section and text) of each file, in completion order.
+        :rtype: Iterator[Tuple[int, List[Tuple[str, str]]]]
+        """
+        window = self.chunk_size * self._SPLIT_WINDOW_CHUNKS
+        if self.n_workers <= 1:
+            for idx, source in sources:
+                start = time.perf_counter()
+                chunks = chunk_file(
+                    self.text_splitter,
+                    parser,
+                    source,
+                    window,
+                    self.chunker,  # type: ignore
+                    self.chunk_size,
+                    self.chunk_overlap,
+                )
+                self._add_timing("parse_split", time.perf_counter() - start)
+                yield idx, chunks
+            return
+
+        pool = _get_process_pool(
+            self.n_workers, self.chunk_size, self.chunk_overlap, self.segmenter
+        )
+        pending: dict[Future, int] = {}
+        for idx, source in sources:
+            future = pool.submit(
+                _chunk_file_in_worker,
+                parser,
+                source,
+                self.chunk_size,
+                self.chunk_overlap,
+                self.segmenter,
+                window,
+                self.chunker,
+            )
+            pending[future] = idx
+            for done in [future for future in pending if future.done()]:
+                yield pending.pop(done), done.result()
+
+        remaining = as_completed(pending)
+        while True:
+            start = time.perf_counter()
+            done = next(remaining, None)
+            self._add_timing("parse_split", time.perf_counter() - start)
+            if done is None:
+                return
+            yield pending[done], done.result()
+
+    @staticmethod
+    def _chunk_id(paper_id: str, index: int, chunk: str) -> str:
+        """
+        Build the stable ID of a chunk from its paper, position and content.
+
+        :param paper_id: The ID of the paper the chunk belongs to.
+        :type paper_id: str
+        :param index: The position of the chunk in the paper.
+        :type index: int
+        :param chunk: The content of the chunk.
+        :type chunk: str
+
+        :return: The chunk ID.
+        :rtype: str
+        """
+        digest = hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:16]
+        return f"{paper_id}-{index}-{digest}"
+
+    def _to_documents(
+        self, chunks: List[Tuple[str, str]], metadata: dict[str, str]
+    ) -> List[Document]:
+        """
+        Turn the chunks of a paper into documents, each with its own metadata and chunk ID.
+
+        Chunks outside the public corpus get IDs prefixed with their scope, so two sessions
+        uploading a file with the same name never overwrite each other.
+
+        :param chunks: The section and text of each chunk of the paper, in document order.
+        :type chunks: List[Tuple[str, str]]
+        :param metadata: The metadata of the paper.
+        :type metadata: dict[str, str]
+
+        :return: The documents.
+        :rtype: List[Document]
+        """
+        paper_key = metadata["paper_id"]
+        if self.scope != PUBLIC_SCOPE:
+            paper_key = f"{self.scope}/{paper_key}"
+
+        indexed_at = time.time()
+        return [
+            Document(
+                page_content=chunk,
+                metadata={
+                    **metadata,
+                    "section": section,
+                    "scope": self.scope,
+                    "indexed_at": indexed_at,
+                    "chunk_id": self._chunk_id(paper_key, i, chunk),
+                },
+            )
+            for i, (section, chunk) in enumerate(chunks)
+        ]
+
+    def _plan_upsert(self, docs: List[Document]) -> Tuple[List[Document], List[str]]:
+        """
+        Compare documents with what is already indexed for their papers.
+
+        :param docs: The documents of one or more papers.
+        :type docs: List[Document]
+
+        :return: The documents that are not indexed yet, and the IDs of indexed chunks of these papers that no longer exist.
+        :rtype: Tuple[List[Document], List[str]]
+        """
+        paper_ids = list(dict.fromkeys(doc.metadata["paper_id"] for doc in docs))
+        if not paper_ids:
+            return [], []
+
+        existing = set(
+            self.vectordb.get(
+                where={
+                    "$and": [{"paper_id": {"$in": paper_ids}}, {"scope": self.scope}]
+                },
+                include=[],
+            )["ids"]
+        )
+        new = {}
+        for doc in docs:
+            if doc.metadata["chunk_id"] not in existing:
+                new.setdefault(doc.metadata["chunk_id"], doc)
+        current = {doc.metadata["chunk_id"] for doc in docs}
+        stale = [id for id in existing if id not in current]
+        return list(new.values()), stale
+
+    def _index_lexical(self, docs: List[Document], failed: List[Document]):
+        """
+        Add the chunks that are in the vector store to the BM25 index.
+
+        Unchanged chunks are passed too, so papers indexed before the BM25 index existed are
+        picked up the next time they are processed. Chunks already indexed are skipped.
+
+        :param docs: The documents of the upsert.
+        :type docs: List[Document]
+        :param failed: The documents that could not be written to the vector store.
+        :type failed: List[Document]
+        """
+        failed_ids = {doc.metadata["chunk_id"] for doc in failed}
+        get_bm25_index(index_namespace(self.vectordb)).add(
+            [doc for doc in docs if doc.metadata["chunk_id"] not in failed_ids]
+        )
+
+    def _index_parents(self, docs: List[Document], failed: List[Document]):
+        """
+        Group the chunks of each paper into parent spans and store them.
+
+        The spans are built from every chunk of the upsert, unchanged ones included, as the
+        span of a chunk depends on its neighbours. Chunks that are not in the vector store
+        are left out of the mapping.
+
+        :param docs: The documents of the upsert, in document order per paper.
+        :type docs: List[Document]
+        :param failed: The documents that could not be written to the vector store.
+        :type failed: List[Document]
+        """
+        failed_ids = {doc.metadata["chunk_id"] for doc in failed}
+        papers: dict[str, List[Document]] = {}
+        for doc in docs:
+            papers.setdefault(doc.metadata["paper_id"], []).append(doc)
+
+        parents = []
+        for paper_docs in papers.values():
+            for parent_id, content, chunk_ids in build_parents(
+                paper_docs,
+                max_chars=self.chunk_size * self.parent_chunks,
+                max_overlap=2 * self.chunk_overlap,
+            ):
+                chunk_ids = [id for id in chunk_ids if id not in failed_ids]
+                if chunk_ids:
+                    parents.append((parent_id, content, chunk_ids))
+        get_parent_store(index_namespace(self.vectordb)).add(parents)
+
+    def _delete_stale(self, stale: List[str], failed: List[Document]) -> List[str]:
+        """
+        Delete the chunks left over from a previous chunking, once the new chunks are written.
+
+        If any new chunk could not be written, the old chunks are kept so the paper never
+        drops out of the index; the next upsert of the paper deletes them.
+
+        :param stale: The IDs of the chunks left over from a previous chunking.
+        :type stale: List[str]
+        :param failed: The documents that could not be written to the vector store.
+        :type failed: List[Document]
+
+        :return: The IDs of the deleted chunks.
+        :rtype: List[str]
+        """
+        if not stale:
+            return []
+        if failed:
+            logger_process_pdf.warning(
+                f"Keeping {len(stale)} stale chunks, {len(failed)} new chunks could not be written"
+            )
+            return []
+        self.vectordb.delete(ids=stale)
+        get_bm25_index(index_namespace(self.vectordb)).delete(stale)
+        get_parent_store(index_namespace(self.vectordb)).delete(stale)
+        return stale
+
+    def _upsert(self, docs: List[Document]) -> List[Document]:
+        """
+        Idempotently write documents to the vector store: unchanged chunks are skipped and
+        chunks left over from a previous chunking of the same papers are deleted after the
+        new chunks are written.
+
+        :param docs: The documents to write.
+        :type docs: List[Document]
+
+        :return: The documents that could not be written.
+        :rtype: List[Document]
+        """
+        new, stale = self._plan_upsert(docs)
+        failed = self.writer.write(new)
+        self._index_lexical(docs, failed)
+        self._index_parents(docs, failed)
+        deleted = self._delete_stale(stale, failed)
+        if new or deleted:
+            query_cache.invalidate()
+        logger_process_pdf.info(
+            f"Upserted {len(docs)} chunks: {len(new) - len(failed)} added, {len(docs) - len(new)} unchanged, {len(deleted)} stale deleted"
         )
+        return failed
+
+    async def _aupsert(self, docs: List[Document]) -> List[Document]:
+        """
+        Asynchronously and idempotently write documents to the vector store.
+
+        :param docs: The documents to write.
+        :type docs: List[Document]
+
+        :return: The documents that could not be written.
+        :rtype: List[Document]
+        """
+        new, stale = await asyncio.to_thread(self._plan_upsert, docs)
+        failed = await self.writer.awrite(new)
+        await asyncio.to_thread(self._index_lexical, docs, failed)
+        await asyncio.to_thread(self._index_parents, docs, failed)
+        deleted = await asyncio.to_thread(self._delete_stale, stale, failed)
+        if new or deleted:
+            query_cache.invalidate()
+        logger_process_pdf.info(
+            f"Upserted {len(docs)} chunks: {len(new) - len(failed)} added, {len(docs) - len(new)} unchanged, {len(deleted)} stale deleted"
+        )
+        return failed
 
     def _get_id_from_str(self, string: str) -> str:
         """
@@ -303,168 +1755,129 @@ class ProcessPDF:
         else:
             return "".join(result[0])
 
-    def _extract_metadata(self, list_of_files: List[str]) -> List[dict[str, str]]:
+    def _paper_id(self, pdf_path: str) -> str:
         """
-        Extract metadata from a PDF document using GROBID.
+        Get the paper ID of a PDF from its file name.
 
-        :param paper: The path to the PDF document.
-        :type paper: str
+        :param pdf_path: The path to the PDF.
+        :type pdf_path: str
 
-        :return: A dictionary containing the extracted metadata.
-        :rtype: dict
+        :return: The arXiv ID in the file name, or the file name itself.
+        :rtype: str
         """
-        # filenames = [paper.split("/")[-1].replace('.pdf', '') for paper in list_of_files]
-        # entry_ids = [self._get_id_from_str(filename) for filename in filenames]
+        return self._get_id_from_str(pdf_path.split("/")[-1].replace(".pdf", ""))
 
-        files_to_process = []
-        for file in list_of_files:
-            filename = file.split("/")[-1].replace("pdf", "")
-            entry_id = self._get_id_from_str(filename)
-            if not os.path.exists(f"./output/{entry_id}.grobid.tei.xml"):
-                files_to_process.append(file)
-            else:
-                continue
-        if not files_to_process == []:
-            self.grobid_client.process_batch(
-                service="processHeaderDocument",
-                input_files=files_to_process,
-                input_path=os.path.dirname(files_to_process[0]),
-                output=f"./output/",
-                generateIDs=False,
-                n=10,
-                consolidate_header=False,
-                consolidate_citations=False,
-                include_raw_citations=False,
-                include_raw_affiliations=False,
-                tei_coordinates=False,
-                segment_sentences=False,
-                force=True,
-                verbose=False,
-            )
-        else:
-            pass
+    def _extract_metadata(self, list_of_files: List[str]) -> List[dict[str, str]]:
+        """
+        Extract metadata from PDF documents, only sending them to GROBID when no cheaper source has it.
 
-        metadatas = []
-        for paper in list_of_files:
-            filename = paper.split("/")[-1].replace(".pdf", "")
-            entry_id = self._get_id_from_str(filename)
-
-            new_path = ""
-            if self.parser == "PyMuPDF":
-                old_path = f"./output/{entry_id}.grobid.tei.xml"
-                new_path = f"./output/{entry_id}.header.grobid.tei.xml"
-                os.rename(old_path, new_path)
-            elif self.parser == "GROBID":
-                new_path = f"./output/{entry_id}.grobid.tei.xml"
-
-            tei_object = TEIFile(new_path)
-            metadatas.append(
-                {
-                    "paper_id": entry_id,
-                    "title": tei_object.title,
-                    "authors": ", ".join([author for author in tei_object.authors]),
-                    "date": tei_object.published,
-                    "abstract": tei_object.abstract,
-                }
-            )
-        return metadatas
+        :param list_of_files: The paths to the PDF documents.
+        :type list_of_files: List[str]
 
-    def _process_pymupdf(
+        :return: The metadata of each PDF, in the order of the paths.
+        :rtype: List[dict[str, str]]
+        """
+        return self.metadata_resolver.resolve(
+            list_of_files, [self._paper_id(path) for path in list_of_files]
+        )
+
+    def _iter_pymupdf(
         self, pdf_path: List[str], metadatas: Union[List[dict[str, str]], None] = None
-    ) -> List[Document]:
+    ) -> Iterator[Tuple[int, str, List[Document]]]:
         """
-        Process PDF documents using the PyMuPDF parser. Metadata is extracted using GROBID.
+        Process PDF documents using the PyMuPDF parser. Metadata missing from metadatas is resolved
+        by the MetadataResolver, which only falls back to GROBID when the cheaper sources fail.
 
         :param pdf_path: A list of paths to the PDF documents.
         :type pdf_path: List[str]
 
-        :return: A list of Document objects containing the processed content and metadata.
-        :rtype: List[Document]
+        :return: An iterator over the position, path and Document objects of each PDF, as soon as it is chunked.
+        :rtype: Iterator[Tuple[int, str, List[Document]]]
         """
 
         if not metadatas:
+            start = time.perf_counter()
             metadatas = self._extract_metadata(pdf_path)
+            self.timings["metadata"] = time.perf_counter() - start
 
-        docs = []
-        for idx, paper in enumerate(pdf_path):
-            text = PyMuPDFParser(paper).process()
-            chunks = self.text_splitter.split_text(text)
-            metadata = metadatas[idx]
-
-            for i, chunk in enumerate(chunks):
-                metadata["chunk_id"] = f"{metadata['paper_id']}-{i}"
-                docs.append(Document(page_content=chunk, metadata=metadata))
-        return docs
+        for idx, chunks in self._iter_chunks("PyMuPDF", enumerate(pdf_path)):
+            self.file_status[pdf_path[idx]] = "parsed"
+            yield idx, pdf_path[idx], self._to_documents(chunks, metadatas[idx])
 
-    def _process_grobid(
-        self, pdf_path: List[str], metadatas: Union[List[dict[str, str]], None] = None
-    ) -> List[Document]:
+    def _iter_tei(
+        self, pdf_path: List[str], metadatas: List[Union[dict[str, str], None]]
+    ) -> Iterator[Tuple[int, bytes]]:
         """
-        Process PDF documents using the GROBID parser.
+        Send PDF documents to GROBID and yield each TEI document as soon as GROBID returns it.
+
+        Missing metadata is filled in from the header of the TEI document. PDFs GROBID fails
+        on are marked as failed and skipped, without holding back the rest of the batch.
 
         :param pdf_path: A list of paths to the PDF documents.
         :type pdf_path: List[str]
+        :param metadatas: The metadata of each PDF, None where it is still unknown. Updated in place.
+        :type metadatas: List[Union[dict[str, str], None]]
 
-        :return: A list of Document objects containing the processed content.
-        :rtype: List[Document]
+        :return: An iterator over the position and TEI document of each parsed PDF, in completion order.
+        :rtype: Iterator[Tuple[int, bytes]]
         """
-        self.grobid_client.process_batch(
-            service="processFulltextDocument",
-            input_files=pdf_path,
-            input_path=os.path.dirname(pdf_path[0]),
-            output=f"./output/",
-            generateIDs=False,
-            n=10,
-            consolidate_header=False,
-            consolidate_citations=False,
-            include_raw_citations=False,
-            include_raw_affiliations=False,
-            tei_coordinates=False,
-            segment_sentences=False,
-            force=True,
-            verbose=False,
-        )
+        positions: dict[str, List[int]] = {}
+        for idx, path in enumerate(pdf_path):
+            positions.setdefault(path, []).append(idx)
 
-        while not all(
-            [
-                os.path.exists(
-                    f"./output/{paper.split('/')[-1].replace('.pdf', '')}.grobid.tei.xml"
-                )
-                for paper in pdf_path
-            ]
+        start = time.perf_counter()
+        for path, status, tei in self.grobid_client.iter_batch(
+            "processFulltextDocument", list(positions)
         ):
-            time.sleep(1)
+            if tei is None:
+                self.file_status[path] = "failed"
+                logger_process_pdf.warning(
+                    f"Skipping {path}: GROBID failed with status {status}"
+                )
+                continue
 
-        if not metadatas:
-            metadatas = self._extract_metadata(pdf_path)
+            self.file_status[path] = "parsed"
+            for idx in positions[path]:
+                if metadatas[idx] is None:
+                    metadatas[idx] = tei_metadata(self._paper_id(path), tei)
+                yield idx, tei
+        self.timings["grobid"] = time.perf_counter() - start
 
-        docs = []
-        for idx, paper in enumerate(pdf_path):
-            filename = paper.split("/")[-1].replace(".pdf", "")
-            id = self._get_id_from_str(filename)
-            tei_object = TEIFile(f"./output/{id}.grobid.tei.xml")
-            chunks = self.text_splitter.split_text(tei_object.text)
-            metadata = metadatas[idx]
+    def _iter_grobid(
+        self, pdf_path: List[str], metadatas: Union[List[dict[str, str]], None] = None
+    ) -> Iterator[Tuple[int, str, List[Document]]]:
+        """
+        Process PDF documents using the GROBID parser.
 
-            for i, chunk in enumerate(chunks):
-                metadata["chunk_id"] = f"{metadata['paper_id']}-{i}"
-                docs.append(Document(page_content=chunk, metadata=metadata))
+        The TEI documents are chunked in memory as GROBID returns them, so the first papers
+        are chunked (and embedded) while GROBID is still working on the rest.
 
-        return docs
+        :param pdf_path: A list of paths to the PDF documents.
+        :type pdf_path: List[str]
 
-    def process(
+        :return: An iterator over the position, path and Document objects of each PDF, as soon as it is chunked.
+        :rtype: Iterator[Tuple[int, str, List[Document]]]
+        """
+        paper_metadatas: List[Union[dict[str, str], None]] = (
+            list(metadatas) if metadatas else [None] * len(pdf_path)
+        )
+        tei_documents = self._iter_tei(pdf_path, paper_metadatas)
+        for idx, chunks in self._iter_chunks("GROBID", tei_documents):
+            yield idx, pdf_path[idx], self._to_documents(chunks, paper_metadatas[idx])  # type: ignore
+
+    def _iter_documents(
         self,
         pdf_path: Union[List[str], str],
         metadatas: Union[List[dict[str, str]], None] = None,
-    ) -> List[Document]:
+    ) -> Iterator[Tuple[int, str, List[Document]]]:
         """
-        Process PDF documents and add them to the vector store.
+        Parse and chunk PDF documents without adding them to the vector store.
 
         :param pdf_path: Directory of pdf files or a (list of) pdf file(s).
         :type pdf_path: Union[List[str], str]
 
-        :return: A list of Document objects containing the processed content.
-        :rtype: List[Document]
+        :return: An iterator over the position, path and Document objects of each PDF, in completion order.
+        :rtype: Iterator[Tuple[int, str, List[Document]]]
 
         :raises ValueError: If the input is not a list of paths to PDF documents or a directory containing PDF files.
         """
@@ -489,16 +1902,141 @@ class ProcessPDF:
                     "pdf_path must be a directory of pdf files or a (list of) pdf file(s)."
                 )
 
-        docs = []
         if self.parser == "PyMuPDF":
-            docs = self._process_pymupdf(list_of_files, metadatas)
+            yield from self._iter_pymupdf(list_of_files, metadatas)
         if self.parser == "GROBID":
-            docs = self._process_grobid(list_of_files, metadatas)
+            yield from self._iter_grobid(list_of_files, metadatas)
+
+    def process(
+        self,
+        pdf_path: Union[List[str], str],
+        metadatas: Union[List[dict[str, str]], None] = None,
+    ) -> List[Document]:
+        """
+        Process PDF documents and add them to the vector store.
 
-        self.vectordb.add_documents(docs)
+        Each paper is written to the vector store as soon as it is chunked.
 
+        :param pdf_path: Directory of pdf files or a (list of) pdf file(s).
+        :type pdf_path: Union[List[str], str]
+
+        :return: A list of Document objects containing the processed content, in the order of the files.
+        :rtype: List[Document]
+
+        :raises ValueError: If the input is not a list of paths to PDF documents or a directory containing PDF files.
+        """
+        self.timings = {}
+        self.file_status = {}
+        start = time.perf_counter()
+
+        papers: dict[int, List[Document]] = {}
+        for idx, path, paper_docs in self._iter_documents(pdf_path, metadatas):
+            upsert_start = time.perf_counter()
+            failed = self._upsert(paper_docs)
+            self._add_timing("embed_write", time.perf_counter() - upsert_start)
+            self.file_status[path] = "failed" if failed else "indexed"
+            papers[idx] = paper_docs
+
+        # Papers are written in completion order, but returned in the order of the files.
+        docs = [doc for idx in sorted(papers) for doc in papers[idx]]
+
+        self.timings["total"] = time.perf_counter() - start
+        self._log_timings(docs)
         return docs
 
+    async def aprocess(
+        self,
+        pdf_path: Union[List[str], str],
+        metadatas: Union[List[dict[str, str]], None] = None,
+    ) -> List[Document]:
+        """
+        Asynchronously process PDF documents and add them to the vector store.
+
+        Parsing and chunking run in a worker thread so the event loop is never blocked. The
+        worker hands each paper over as soon as it is chunked, and it is embedded while the
+        next papers are still being parsed. At most _QUEUED_PAPERS papers wait to be embedded,
+        so a slow embedding API holds the worker back instead of letting chunks pile up, and
+        the worker stops after its current paper once this call returns or fails.
+
+        :param pdf_path: Directory of pdf files or a (list of) pdf file(s).
+        :type pdf_path: Union[List[str], str]
+
+        :return: A list of Document objects containing the processed content, in the order of the files.
+        :rtype: List[Document]
+
+        :raises ValueError: If the input is not a list of paths to PDF documents or a directory containing PDF files.
+        """
+        self.timings = {}
+        self.file_status = {}
+        start = time.perf_counter()
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self._QUEUED_PAPERS)
+        stop = threading.Event()
+
+        def put(item: Any):
+            # Blocks the worker while the queue is full.
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def produce():
+            documents = self._iter_documents(pdf_path, metadatas)
+            try:
+                for item in documents:
+                    if stop.is_set():
+                        return
+                    put(item)
+            except BaseException as e:
+                put(e)
+            else:
+                put(None)
+            finally:
+                # Cancels the GROBID requests and pool tasks of the papers not parsed yet.
+                documents.close()
+
+        producer = loop.run_in_executor(None, produce)
+
+        papers: dict[int, List[Document]] = {}
+        try:
+            while (item := await queue.get()) is not None:
+                if isinstance(item, BaseException):
+                    raise item
+                idx, path, paper_docs = item
+                upsert_start = time.perf_counter()
+                failed = await self._aupsert(paper_docs)
+                self._add_timing("embed_write", time.perf_counter() - upsert_start)
+                self.file_status[path] = "failed" if failed else "indexed"
+                papers[idx] = paper_docs
+            await producer
+        finally:
+            # After the queue is emptied the worker puts at most one more item, so it never
+            # blocks, and it sees the stop event before parsing the next paper.
+            stop.set()
+            while not queue.empty():
+                queue.get_nowait()
+
+        docs = [doc for idx in sorted(papers) for doc in papers[idx]]
+        self.timings["total"] = time.perf_counter() - start
+        self._log_timings(docs)
+        return docs
+
+    def _log_timings(self, docs: List[Document]):
+        """
+        Log the duration of each stage of the last call to process.
+
+        :param docs: The documents that were processed.
+        :type docs: List[Document]
+        """
+        stages = ", ".join(
+            f"{stage}={seconds:.2f}s" for stage, seconds in self.timings.items()
+        )
+        failed = [path for path, status in self.file_status.items() if status == "failed"]
+        logger_process_pdf.info(
+            f"Processed {len(docs)} chunks from {len(self.file_status) - len(failed)} file(s) "
+            f"with {self.n_workers} worker(s): {stages}"
+        )
+        if failed:
+            logger_process_pdf.warning(f"Failed to process {len(failed)} file(s): {failed}")
+
 
 class IndexNewArxivPapers:
     """
@@ -514,6 +2052,10 @@ class IndexNewArxivPapers:
     :type chunk_size: int, optional
     :param chunk_overlap: The overlap between chunks when processing PDFs.
     :type chunk_overlap: int, optional
+    :param segmenter: The sentence segmentation used when processing PDFs.
+    :type segmenter: Literal["spaCy", "Sentencizer", "Regex"], optional
+    :param chunker: The chunking used when processing PDFs, "Text" or "Section".
+    :type chunker: Literal["Text", "Section"], optional
 
     :ivar vectordb: The vector store used for indexing.
     :vartype vectordb: VectorStore
@@ -525,17 +2067,31 @@ class IndexNewArxivPapers:
     :vartype chunk_size: int
     :ivar chunk_overlap: The overlap between chunks when processing PDFs. Defaults to 100.
     :vartype chunk_overlap: int
+    :ivar segmenter: The sentence segmentation used when processing PDFs. Defaults to "spaCy".
+    :vartype segmenter: Literal["spaCy", "Sentencizer", "Regex"]
+    :ivar chunker: The chunking used when processing PDFs. Defaults to the CHUNKER environment variable, or "Text".
+    :vartype chunker: Union[Literal["Text", "Section"], None]
 
     :cvar google_api: The GoogleSearchAPIWrapper object.
     :vartype google_api: GoogleSearchAPIWrapper
     :cvar arxiv_client: The arXiv client object.
     :vartype arxiv_client: arxiv.Client
-    :cvar chromadb_client: The chromadb client object.
-    :vartype chromadb_client: chromadb.PersistentClient
+    :cvar indexed_ids: The arXiv IDs known to be indexed, per vector store namespace (see index_namespace). IDs that are not in the set of the store are looked up in one batched query.
+    :vartype indexed_ids: dict[str, set[str]]
+    :cvar downloader: The concurrent PDF downloader shared by all instances.
+    :vartype downloader: PDFDownloader
+    :cvar lookup_cache: The persistent cache of search results (query to arXiv IDs, namespace "search") and arXiv metadata (arXiv ID to metadata, namespace "arxiv").
+    :vartype lookup_cache: TTLCache
     """
 
     google_api = GoogleSearchAPIWrapper()
-    arxiv_client = arxiv.Client(delay_seconds=0)
+    arxiv_client = arxiv_client
+    downloader = PDFDownloader(
+        max_workers=int(os.environ.get("PDF_DOWNLOAD_WORKERS", 8)),
+        per_host=int(os.environ.get("PDF_DOWNLOAD_PER_HOST", 4)),
+    )
+    indexed_ids: dict[str, set[str]] = {}
+    lookup_cache = lookup_cache
 
     def __init__(
         self,
@@ -544,6 +2100,8 @@ class IndexNewArxivPapers:
         pdf_parser: Literal["PyMuPDF", "GROBID"] = "PyMuPDF",
         chunk_size: int = 1024,
         chunk_overlap: int = 100,
+        segmenter: Literal["spaCy", "Sentencizer", "Regex"] = "spaCy",
+        chunker: Union[Literal["Text", "Section"], None] = None,
     ):
         """
         Constructor for the IndexNewArxivPapers object.
@@ -551,10 +2109,9 @@ class IndexNewArxivPapers:
         self.vectordb = vectordb
         self.n_search_results = n_search_results
         self.chunk_size = chunk_size
-        self.chromadb_client = chromadb.PersistentClient("arxiv_vdb").get_collection(
-            "arxiv"
-        )
         self.chunk_overlap = chunk_overlap
+        self.segmenter = segmenter
+        self.chunker = chunker
         self.pdf_parser = pdf_parser
 
     def _get_paper_ids(self, query: str) -> List[str]:
@@ -571,6 +2128,11 @@ class IndexNewArxivPapers:
         """
         ARXIV_ID_REGEX = r"\d{4}\.\d{4,5}"
 
+        key = f"{self.n_search_results}:{query.strip()}"
+        cached = self.lookup_cache.get("search", key)
+        if cached:
+            return cached
+
         ids = set()
         for result in self.google_api.results(query, self.n_search_results):
             id = re.findall(ARXIV_ID_REGEX, result["link"])
@@ -582,59 +2144,177 @@ class IndexNewArxivPapers:
         if not ids:
             raise IndexError("No papers found, try a different query.")
 
+        self.lookup_cache.put("search", key, list(ids))
         return list(ids)
 
-    def _run(self, query):
+    @property
+    def _indexed_ids(self) -> set[str]:
         """
-        Run the indexing process for the given query.
+        Get the arXiv IDs known to be indexed in the vector store of this instance.
 
-        :param query: The search query.
-        :type query: str
-        :return: The indexed documents.
-        :rtype: List[Document]
+        :return: The IDs.
+        :rtype: set[str]
+        """
+        return self.indexed_ids.setdefault(index_namespace(self.vectordb), set())
+
+    def _filter_indexed(self, ids: List[str]) -> List[str]:
+        """
+        Drop the arXiv IDs that are already indexed in the vector store.
+
+        :param ids: The candidate arXiv IDs.
+        :type ids: List[str]
+
+        :return: The arXiv IDs that still have to be indexed.
+        :rtype: List[str]
+        """
+        ids = list(dict.fromkeys(ids))
+        indexed_ids = self._indexed_ids
+        unknown = [id for id in ids if id not in indexed_ids]
+        if unknown:
+            # One batched lookup instead of one query per paper. Papers indexed from
+            # arXiv carry a versioned paper_id, so the unversioned arxiv_id is matched too.
+            results = self.vectordb.get(
+                where={
+                    "$and": [
+                        {"scope": PUBLIC_SCOPE},
+                        {
+                            "$or": [
+                                {"paper_id": {"$in": unknown}},
+                                {"arxiv_id": {"$in": unknown}},
+                            ]
+                        },
+                    ]
+                },
+                include=["metadatas"],
+            )
+            for metadata in results["metadatas"]:
+                for key in ("paper_id", "arxiv_id"):
+                    if metadata.get(key) in unknown:
+                        indexed_ids.add(metadata[key])
+
+        return [id for id in ids if id not in indexed_ids]
+
+    def _fetch_papers(self, ids: List[str]) -> List[dict[str, str]]:
+        """
+        Fetch the metadata of the given IDs, only querying the arXiv API for uncached IDs.
+
+        :param ids: The arXiv IDs.
+        :type ids: List[str]
+
+        :return: The metadata of each paper, including its PDF URL.
+        :rtype: List[dict[str, str]]
+        """
+        papers = fetch_arxiv_metadata(ids)
+        return [papers[id] for id in ids if id in papers]
+
+    def _download(
+        self, papers: List[dict[str, str]]
+    ) -> Tuple[List[str], List[dict[str, str]]]:
+        """
+        Download the PDFs of the given papers.
+
+        :param papers: The metadata of the papers, as returned by _fetch_papers.
+        :type papers: List[dict[str, str]]
+
+        :return: The paths of the downloaded PDFs and their metadata. Failed downloads are skipped.
+        :rtype: Tuple[List[str], List[dict[str, str]]]
         """
-        self.ids = self._get_paper_ids(query)
         os.makedirs(f"./output", exist_ok=True)
         os.makedirs(f"./pdfs", exist_ok=True)
 
-        for id in self.ids:
-            if len(self.chromadb_client.get(where={"paper_id": id})["ids"]) > 0:
-                self.ids.remove(id)
-            else:
-                continue
+        paths = self.downloader.download_many(
+            [(paper["pdf_url"], f"./pdfs/{paper['paper_id']}.pdf") for paper in papers]
+        )
 
-        papers = list(self.arxiv_client.results(arxiv.Search(id_list=self.ids)))
+        pdf_files = []
         metadatas = []
-        for paper in papers:
-            id = paper.entry_id.split("/")[-1]
-            paper.download_pdf(dirpath=f"./pdfs/", filename=f"{id}.pdf")
+        for paper, path in zip(papers, paths):
+            if path is None:
+                continue
+            pdf_files.append(path)
             metadatas.append(
-                {
-                    "paper_id": id,
-                    "title": paper.title,
-                    "authors": ", ".join([author.name for author in paper.authors]),
-                    "date": paper.published.strftime("%Y-%m-%d"),
-                    "abstract": paper.summary,
-                }
+                {key: value for key, value in paper.items() if key != "pdf_url"}
             )
+        return pdf_files, metadatas
 
-        while not all(
-            [
-                os.path.exists(f"./pdfs/{paper.entry_id.split('/')[-1]}.pdf")
-                for paper in papers
-            ]
-        ):
-            time.sleep(1)
+    def _processor(self) -> "ProcessPDF":
+        """
+        Build the PDF processor used to index the downloaded papers.
 
-        pdf_files = [f"./pdfs/{paper.entry_id.split('/')[-1]}.pdf" for paper in papers]
-        processor = ProcessPDF(
+        :return: The PDF processor.
+        :rtype: ProcessPDF
+        """
+        return ProcessPDF(
             vectordb=self.vectordb,
             parser=self.pdf_parser,
             chunk_size=self.chunk_size,
             chunk_overlap=self.chunk_overlap,
+            segmenter=self.segmenter,
+            chunker=self.chunker,
         )
 
+    def _mark_indexed(
+        self,
+        processor: "ProcessPDF",
+        pdf_files: List[str],
+        metadatas: List[dict[str, str]],
+    ):
+        """
+        Remember the papers that were fully indexed, so they are not looked up again.
+
+        Papers that failed to parse or to be written are left out and retried by the next
+        query that finds them.
+
+        :param processor: The PDF processor that indexed the papers.
+        :type processor: ProcessPDF
+        :param pdf_files: The paths of the processed PDFs.
+        :type pdf_files: List[str]
+        :param metadatas: The metadata of each PDF.
+        :type metadatas: List[dict[str, str]]
+        """
+        self._indexed_ids.update(
+            metadata["arxiv_id"]
+            for path, metadata in zip(pdf_files, metadatas)
+            if processor.file_status.get(path) == "indexed"
+        )
+
+    def _run(self, query: str):
+        """
+        Run the indexing process for the given query.
+
+        :param query: The search query.
+        :type query: str
+        """
+        self.ids = self._filter_indexed(self._get_paper_ids(query))
+        papers = self._fetch_papers(self.ids)
+        pdf_files, metadatas = self._download(papers)
+
+        if not pdf_files:
+            return
+
+        processor = self._processor()
         _ = processor.process(pdf_files, metadatas)
+        self._mark_indexed(processor, pdf_files, metadatas)
 
     async def _arun(self, query: str):
-        return self._run(query)
+        """
+        Run the indexing process for the given query without blocking the event loop.
+
+        Every blocking stage (search, vector store lookup, arXiv API, downloads, parsing)
+        runs in a worker thread and documents are added with ``aadd_documents``, so other
+        sessions served by the same event loop keep making progress.
+
+        :param query: The search query.
+        :type query: str
+        """
+        ids = await asyncio.to_thread(self._get_paper_ids, query)
+        self.ids = await asyncio.to_thread(self._filter_indexed, ids)
+        papers = await asyncio.to_thread(self._fetch_papers, self.ids)
+        pdf_files, metadatas = await asyncio.to_thread(self._download, papers)
+
+        if not pdf_files:
+            return
+
+        processor = await asyncio.to_thread(self._processor)
+        _ = await processor.aprocess(pdf_files, metadatas)
+        self._mark_indexed(processor, pdf_files, metadatas)
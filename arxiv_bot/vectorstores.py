@@ -0,0 +1,1245 @@
+from collections import OrderedDict
+from langchain.schema.document import Document
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from typing import Any, Callable, Iterable, List, Literal, Tuple, Union
+import asyncio
+import hashlib
+import hnswlib  # type: ignore
+import json
+import logging
+import numpy as np
+import os
+import sqlite3
+import threading
+import uuid
+
+logger_vectorstore = logging.getLogger("LocalVectorStore")
+logger_vectorstore.setLevel(logging.INFO)
+
+
+class HNSWIndex:
+    """
+    Approximate nearest neighbour index backed by hnswlib.
+
+    The index is persisted incrementally: only the elements changed since the last write
+    are flushed to disk, so inserts stay cheap as the corpus grows.
+
+    :param path: The directory of the index files.
+    :type path: str
+    :param dim: The dimension of the vectors.
+    :type dim: int
+    :param M: The number of links per node. Higher is more accurate but uses more memory. Defaults to 16.
+    :type M: int
+    :param ef_construction: The size of the candidate list while inserting. Defaults to 200.
+    :type ef_construction: int
+    :param ef: The size of the candidate list while searching. Higher is more accurate but slower. Defaults to 64.
+    :type ef: int
+    """
+
+    _INITIAL_CAPACITY = 1024
+
+    def __init__(
+        self,
+        path: str,
+        dim: int,
+        M: int = 16,
+        ef_construction: int = 200,
+        ef: int = 64,
+    ):
+        """
+        Constructor for the HNSWIndex object.
+        """
+        self.path = path
+        self.dim = dim
+        self.index = hnswlib.Index(space="cosine", dim=dim)
+        if os.path.exists(os.path.join(path, "header.bin")):
+            self.index.load_index(path, is_persistent_index=True)
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.index.init_index(
+                max_elements=self._INITIAL_CAPACITY,
+                M=M,
+                ef_construction=ef_construction,
+                is_persistent_index=True,
+                persistence_location=path,
+            )
+        self.set_ef(ef)
+
+    def set_ef(self, ef: int):
+        """
+        Set the size of the candidate list while searching.
+
+        :param ef: The size of the candidate list.
+        :type ef: int
+        """
+        self.ef = ef
+        self.index.set_ef(ef)
+
+    def labels(self) -> List[int]:
+        """
+        Get the labels stored in the index, including deleted ones.
+
+        :return: The labels.
+        :rtype: List[int]
+        """
+        return list(self.index.get_ids_list())
+
+    def add(self, labels: List[int], vectors: np.ndarray):
+        """
+        Add vectors to the index, growing it if needed, and flush them to disk.
+
+        :param labels: The labels of the vectors.
+        :type labels: List[int]
+        :param vectors: The vectors, one per row.
+        :type vectors: np.ndarray
+        """
+        needed = self.index.element_count + len(labels)
+        if needed > self.index.get_max_elements():
+            self.index.resize_index(max(needed, 2 * self.index.get_max_elements()))
+        self.index.add_items(vectors, labels)
+        self.index.persist_dirty()
+
+    def delete(self, labels: List[int]):
+        """
+        Mark vectors as deleted and flush the change to disk.
+
+        :param labels: The labels to delete.
+        :type labels: List[int]
+        """
+        for label in labels:
+            try:
+                self.index.mark_deleted(label)
+            except RuntimeError:
+                continue
+        self.index.persist_dirty()
+
+    def vectors(self, labels: List[int]) -> np.ndarray:
+        """
+        Get stored vectors.
+
+        :param labels: The labels of the vectors.
+        :type labels: List[int]
+
+        :return: The vectors, one per row.
+        :rtype: np.ndarray
+        """
+        if not labels:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.asarray(self.index.get_items(labels), dtype=np.float32)
+
+    def search(
+        self, vector: np.ndarray, k: int, allowed: Union[set[int], None]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search the nearest neighbours of a vector.
+
+        :param vector: The query vector.
+        :type vector: np.ndarray
+        :param k: The number of neighbours.
+        :type k: int
+        :param allowed: The labels the results are restricted to, or None.
+        :type allowed: Union[set[int], None]
+
+        :return: The labels and cosine distances of the neighbours, nearest first.
+        :rtype: Tuple[np.ndarray, np.ndarray]
+
+        :raises RuntimeError: If fewer than k neighbours are found, even with a candidate list as large as the index.
+        """
+        # A restrictive filter or many deleted elements can end the graph walk early, so the
+        # candidate list is widened before giving up.
+        ef = self.ef
+        try:
+            while True:
+                try:
+                    labels, distances = self.index.knn_query(
+                        vector, k=k, filter=None if allowed is None else allowed.__contains__
+                    )
+                    return labels[0], distances[0]
+                except RuntimeError:
+                    if ef >= self.index.element_count:
+                        raise
+                    ef = min(4 * ef, self.index.element_count)
+                    self.index.set_ef(ef)
+        finally:
+            if ef != self.ef:
+                self.index.set_ef(self.ef)
+
+    def close(self):
+        """
+        Flush pending changes and close the index files.
+        """
+        self.index.persist_dirty()
+        self.index.close_file_handles()
+
+
+class FlatIndex:
+    """
+    Exact nearest neighbour index over a memory-mapped float16 matrix.
+
+    Vectors are normalized and stored by label in a single file that grows by doubling,
+    so the corpus does not have to fit in memory and search is exact.
+
+    :param path: The path of the matrix file.
+    :type path: str
+    :param dim: The dimension of the vectors.
+    :type dim: int
+    """
+
+    _INITIAL_CAPACITY = 1024
+    _BLOCK_SIZE = 65536
+
+    def __init__(self, path: str, dim: int, **kwargs: Any):
+        """
+        Constructor for the FlatIndex object.
+        """
+        self.path = path
+        self.dim = dim
+        self.alive = np.zeros(0, dtype=bool)
+        row_bytes = dim * np.dtype(np.float16).itemsize
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "wb") as file:
+                file.truncate(self._INITIAL_CAPACITY * row_bytes)
+        self._open(os.path.getsize(path) // row_bytes)
+
+    def _open(self, capacity: int):
+        """
+        Memory-map the matrix file with the given number of rows.
+
+        :param capacity: The number of rows.
+        :type capacity: int
+        """
+        row_bytes = self.dim * np.dtype(np.float16).itemsize
+        if os.path.getsize(self.path) < capacity * row_bytes:
+            with open(self.path, "r+b") as file:
+                file.truncate(capacity * row_bytes)
+        self.matrix = np.memmap(
+            self.path, dtype=np.float16, mode="r+", shape=(capacity, self.dim)
+        )
+        alive = np.zeros(capacity, dtype=bool)
+        alive[: len(self.alive)] = self.alive[:capacity]
+        self.alive = alive
+
+    def set_ef(self, ef: int):
+        """
+        No-op, the flat index is exact.
+        """
+
+    def labels(self) -> List[int]:
+        """
+        Get the labels of the live vectors.
+
+        :return: The labels.
+        :rtype: List[int]
+        """
+        return np.flatnonzero(self.alive).tolist()
+
+    def restore(self, labels: List[int]):
+        """
+        Rebuild the live mask after loading the matrix file.
+
+        The mask is not persisted: the rows of the documents table are the source of truth,
+        and a deleted vector has no row, so it stays deleted across restarts.
+
+        :param labels: The labels of the rows of the documents table.
+        :type labels: List[int]
+        """
+        labels = [label for label in labels if label < len(self.alive)]
+        self.alive[:] = False
+        self.alive[labels] = True
+
+    def add(self, labels: List[int], vectors: np.ndarray):
+        """
+        Add vectors to the index, growing the file if needed, and flush them to disk.
+
+        :param labels: The labels of the vectors.
+        :type labels: List[int]
+        :param vectors: The vectors, one per row.
+        :type vectors: np.ndarray
+        """
+        needed = max(labels) + 1
+        if needed > len(self.alive):
+            self.matrix.flush()
+            self._open(max(needed, 2 * len(self.alive)))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.matrix[labels] = (vectors / np.where(norms > 0, norms, 1)).astype(np.float16)
+        self.matrix.flush()
+        self.alive[labels] = True
+
+    def delete(self, labels: List[int]):
+        """
+        Mark vectors as deleted.
+
+        :param labels: The labels to delete.
+        :type labels: List[int]
+        """
+        labels = [label for label in labels if label < len(self.alive)]
+        self.alive[labels] = False
+
+    def vectors(self, labels: List[int]) -> np.ndarray:
+        """
+        Get stored vectors.
+
+        :param labels: The labels of the vectors.
+        :type labels: List[int]
+
+        :return: The normalized vectors, one per row.
+        :rtype: np.ndarray
+        """
+        return np.asarray(self.matrix[labels], dtype=np.float32)
+
+    def search(
+        self, vector: np.ndarray, k: int, allowed: Union[set[int], None]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search the nearest neighbours of a vector by scanning the matrix in blocks.
+
+        :param vector: The query vector.
+        :type vector: np.ndarray
+        :param k: The number of neighbours.
+        :type k: int
+        :param allowed: The labels the results are restricted to, or None.
+        :type allowed: Union[set[int], None]
+
+        :return: The labels and cosine distances of the neighbours, nearest first.
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
+        query = vector / (np.linalg.norm(vector) or 1)
+        if allowed is None:
+            candidates = np.flatnonzero(self.alive)
+        else:
+            candidates = np.fromiter(sorted(allowed), dtype=np.int64, count=len(allowed))
+            candidates = candidates[candidates < len(self.alive)]
+            candidates = candidates[self.alive[candidates]]
+
+        similarities = np.empty(len(candidates), dtype=np.float32)
+        for start in range(0, len(candidates), self._BLOCK_SIZE):
+            block = candidates[start : start + self._BLOCK_SIZE]
+            similarities[start : start + len(block)] = (
+                np.asarray(self.matrix[block], dtype=np.float32) @ query
+            )
+
+        k = min(k, len(candidates))
+        top = np.argpartition(-similarities, k - 1)[:k] if k else np.zeros(0, int)
+        top = top[np.argsort(-similarities[top])]
+        return candidates[top], 1 - similarities[top]
+
+    def close(self):
+        """
+        Flush pending changes to disk.
+        """
+        self.matrix.flush()
+
+
+ENGINES = {"HNSW": HNSWIndex, "Flat": FlatIndex}
+
+
+def mmr_select(
+    query_embedding: Union[List[float], np.ndarray],
+    embeddings: Union[List[List[float]], np.ndarray],
+    k: int = 4,
+    lambda_mult: float = 0.5,
+) -> List[int]:
+    """
+    Select a diverse subset of candidates with maximal marginal relevance.
+
+    Candidates are normalized once and their similarities to the query computed in a single
+    product. Each greedy step then only adds the similarities to the last selected candidate
+    (one row of the candidate similarity matrix) to a running maximum, so selection is
+    O(k * fetch_k) on float32 arrays instead of recomputing the similarities to every selected
+    candidate at every step. Selects the same candidates as langchain's maximal_marginal_relevance.
+
+    :param query_embedding: The query embedding.
+    :type query_embedding: Union[List[float], np.ndarray]
+    :param embeddings: The candidate embeddings, one per row.
+    :type embeddings: Union[List[List[float]], np.ndarray]
+    :param k: The number of candidates to select. Defaults to 4.
+    :type k: int
+    :param lambda_mult: The trade-off between relevance (1) and diversity (0). Defaults to 0.5.
+    :type lambda_mult: float
+
+    :return: The indices of the selected candidates, in selection order.
+    :rtype: List[int]
+    """
+    candidates = np.asarray(embeddings, dtype=np.float32)
+    k = min(k, len(candidates))
+    if k <= 0:
+        return []
+
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+    norms = np.linalg.norm(candidates, axis=1, keepdims=True)
+    candidates = candidates / np.where(norms > 0, norms, 1)
+    query = query / (np.linalg.norm(query) or 1)
+
+    relevance = candidates @ query
+    redundancy = np.full(len(candidates), -np.inf, dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+
+    selected = [int(np.argmax(relevance))]
+    available[selected[0]] = False
+    while len(selected) < k:
+        np.maximum(redundancy, candidates @ candidates[selected[-1]], out=redundancy)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+    return selected
+
+
+def _where_clause(where: dict[str, Any]) -> Tuple[str, List[Any]]:
+    """
+    Translate a Chroma-style metadata filter into an SQL condition on the JSON metadata column.
+
+    Supports ``$and``, ``$or``, ``$eq``, ``$ne``, ``$in``, ``$nin``, ``$lt``, ``$lte``, ``$gt``
+    and ``$gte``. A bare value is treated as ``$eq``.
+
+    :param where: The metadata filter.
+    :type where: dict[str, Any]
+
+    :return: The SQL condition and its parameters.
+    :rtype: Tuple[str, List[Any]]
+
+    :raises ValueError: If the filter uses an unsupported operator.
+    """
+    OPERATORS = {"$eq": "=", "$ne": "!=", "$lt": "<", "$lte": "<=", "$gt": ">", "$gte": ">="}
+
+    clauses = []
+    params: List[Any] = []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [_where_clause(sub) for sub in condition]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append(
+                "(" + joiner.join(clause for clause, _ in parts) + ")" if parts else "1"
+            )
+            params.extend(param for _, sub_params in parts for param in sub_params)
+            continue
+
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, value in condition.items():
+            field = "json_extract(metadata, ?)"
+            path = f'$."{key}"'
+            if operator in ("$in", "$nin"):
+                placeholders = ",".join("?" * len(value))
+                negate = "NOT " if operator == "$nin" else ""
+                clauses.append(f"{field} {negate}IN ({placeholders})")
+                params.extend([path, *value])
+            elif operator in OPERATORS:
+                clauses.append(f"{field} {OPERATORS[operator]} ?")
+                params.extend([path, value])
+            else:
+                raise ValueError(f"Unsupported filter operator: {operator}")
+
+    return " AND ".join(clauses) or "1", params
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Vector store with a pluggable local index engine.
+
+    Texts and metadata are stored in SQLite and vectors in the index engine, both on disk
+    under ``persist_directory``. The store mirrors the parts of the Chroma API used by the
+    bot (``get`` with ``where`` filters, ``delete`` by ID and MMR search with a filter), so it
+    can be swapped in without changing the callers.
+
+    :param collection_name: The name of the collection.
+    :type collection_name: str
+    :param persist_directory: The directory of the collection files.
+    :type persist_directory: str
+    :param embedding_function: The embeddings used to embed texts and queries.
+    :type embedding_function: Embeddings
+    :param engine: The index engine. "HNSW": approximate, fast on large corpora. "Flat": exact, memory-mapped float16. Defaults to "HNSW".
+    :type engine: Literal["HNSW", "Flat"]
+    :param M: The number of links per node of the HNSW graph. Only used when the index is created. Defaults to 16.
+    :type M: int
+    :param ef_construction: The size of the candidate list while inserting into the HNSW graph. Defaults to 200.
+    :type ef_construction: int
+    :param ef: The size of the candidate list while searching the HNSW graph. Defaults to 64.
+    :type ef: int
+    """
+
+    _BRUTE_FORCE_LIMIT = 2048
+    _FILTER_CACHE_SIZE = 32
+
+    def __init__(
+        self,
+        collection_name: str,
+        persist_directory: str,
+        embedding_function: Embeddings,
+        engine: Literal["HNSW", "Flat"] = "HNSW",
+        M: int = 16,
+        ef_construction: int = 200,
+        ef: int = 64,
+    ):
+        """
+        Constructor for the LocalVectorStore object.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown index engine: {engine}")
+
+        self.collection_name = collection_name
+        self.persist_directory = persist_directory
+        self.engine = engine
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef = ef
+        self._embedding_function = embedding_function
+        self._index: Union[HNSWIndex, FlatIndex, None] = None
+        self._lock = threading.RLock()
+        # The number of rows and the labels of recent filters, maintained on every write so
+        # that a search does not have to count or scan the documents table.
+        self._count = 0
+        self._filter_labels: OrderedDict[str, set[int]] = OrderedDict()
+
+        os.makedirs(persist_directory, exist_ok=True)
+        self._conn = sqlite3.connect(
+            os.path.join(persist_directory, f"{collection_name}.sqlite"),
+            check_same_thread=False,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # AUTOINCREMENT never reuses the label of a deleted row, which the index may still hold.
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                label INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT UNIQUE NOT NULL,
+                document TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+        dim = self._setting("dim")
+        if dim is not None:
+            self._open_index(int(dim))
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    def _setting(self, key: str) -> Union[str, None]:
+        """
+        Read a setting of the collection.
+
+        :param key: The setting.
+        :type key: str
+
+        :return: The value, or None if unset.
+        :rtype: Union[str, None]
+        """
+        row = self._conn.execute(
+            "SELECT value FROM settings WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _open_index(self, dim: int):
+        """
+        Open or create the index and reconcile it with the stored rows.
+
+        Rows whose vector never reached the index (e.g. after a crash) are dropped, so they
+        are re-added the next time their paper is processed.
+
+        :param dim: The dimension of the vectors.
+        :type dim: int
+        """
+        M = int(self._setting("M") or self.M)
+        if M != self.M:
+            logger_vectorstore.info(
+                f"Keeping M={M} of the existing {self.collection_name} index."
+            )
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)",
+            [("dim", str(dim)), ("M", str(M))],
+        )
+        self._conn.commit()
+
+        suffix = "hnsw" if self.engine == "HNSW" else "f16"
+        self._index = ENGINES[self.engine](
+            os.path.join(self.persist_directory, f"{self.collection_name}.{suffix}"),
+            dim,
+            M=M,
+            ef_construction=self.ef_construction,
+            ef=self.ef,
+        )
+
+        stored = [label for (label,) in self._conn.execute("SELECT label FROM documents")]
+        if isinstance(self._index, FlatIndex):
+            self._index.restore(stored)
+        indexed = set(self._index.labels())
+        missing = [label for label in stored if label not in indexed]
+        if missing:
+            logger_vectorstore.warning(
+                f"Dropping {len(missing)} rows without a vector from {self.collection_name}."
+            )
+            self._conn.executemany(
+                "DELETE FROM documents WHERE label = ?", [(label,) for label in missing]
+            )
+            self._conn.commit()
+        orphans = indexed - set(stored)
+        if orphans:
+            self._index.delete(list(orphans))
+        self._count = len(stored) - len(missing)
+
+    def set_ef(self, ef: int):
+        """
+        Set the size of the candidate list while searching the HNSW graph.
+
+        :param ef: The size of the candidate list.
+        :type ef: int
+        """
+        self.ef = ef
+        with self._lock:
+            if self._index is not None:
+                self._index.set_ef(ef)
+
+    def _add(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Union[List[dict], None],
+        ids: Union[List[str], None],
+    ) -> List[str]:
+        """
+        Store embedded texts, replacing the rows with the same IDs.
+
+        :param texts: The texts.
+        :type texts: List[str]
+        :param embeddings: The embeddings of the texts.
+        :type embeddings: List[List[float]]
+        :param metadatas: The metadata of the texts.
+        :type metadatas: Union[List[dict], None]
+        :param ids: The IDs of the texts. Random IDs are generated if None.
+        :type ids: Union[List[str], None]
+
+        :return: The IDs of the texts.
+        :rtype: List[str]
+        """
+        if not texts:
+            return []
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+
+        with self._lock:
+            if self._index is None:
+                self._open_index(vectors.shape[1])
+            assert self._index is not None
+
+            replaced = self._delete(ids)
+            self._conn.executemany(
+                "INSERT INTO documents (id, document, metadata) VALUES (?, ?, ?)",
+                [
+                    (id, text, json.dumps(metadata))
+                    for id, text, metadata in zip(ids, texts, metadatas)
+                ],
+            )
+            order = dict(
+                self._conn.execute(
+                    f"SELECT id, label FROM documents WHERE id IN ({','.join('?' * len(ids))})",
+                    ids,
+                ).fetchall()
+            )
+            labels = [order[id] for id in ids]
+            try:
+                self._index.add(labels, vectors)
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+            if replaced:
+                self._index.delete(replaced)
+            self._wrote(len(ids) - len(replaced))
+        return ids
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Union[List[dict], None] = None,
+        ids: Union[List[str], None] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """
+        Embed and store texts.
+
+        :param texts: The texts.
+        :type texts: Iterable[str]
+        :param metadatas: The metadata of the texts.
+        :type metadatas: Union[List[dict], None]
+        :param ids: The IDs of the texts. Random IDs are generated if None.
+        :type ids: Union[List[str], None]
+
+        :return: The IDs of the texts.
+        :rtype: List[str]
+        """
+        texts = list(texts)
+        embeddings = self._embedding_function.embed_documents(texts)
+        return self._add(texts, embeddings, metadatas, ids)
+
+    async def aadd_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Union[List[dict], None] = None,
+        ids: Union[List[str], None] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """
+        Asynchronously embed and store texts.
+
+        :param texts: The texts.
+        :type texts: Iterable[str]
+        :param metadatas: The metadata of the texts.
+        :type metadatas: Union[List[dict], None]
+        :param ids: The IDs of the texts. Random IDs are generated if None.
+        :type ids: Union[List[str], None]
+
+        :return: The IDs of the texts.
+        :rtype: List[str]
+        """
+        texts = list(texts)
+        embeddings = await self._embedding_function.aembed_documents(texts)
+        return await asyncio.to_thread(self._add, texts, embeddings, metadatas, ids)
+
+    def delete(self, ids: Union[List[str], None] = None, **kwargs: Any) -> bool:
+        """
+        Delete texts by ID.
+
+        :param ids: The IDs to delete.
+        :type ids: Union[List[str], None]
+
+        :return: True.
+        :rtype: bool
+        """
+        with self._lock:
+            labels = self._delete(ids or [])
+            self._conn.commit()
+            if labels and self._index is not None:
+                self._index.delete(labels)
+            self._wrote(-len(labels))
+        return True
+
+    def _wrote(self, added: int):
+        """
+        Update the row count and drop the cached filter labels after a committed write.
+
+        :param added: The number of rows added, negative if rows were deleted.
+        :type added: int
+        """
+        self._count += added
+        self._filter_labels.clear()
+
+    def _delete(self, ids: List[str]) -> List[int]:
+        """
+        Delete the rows of texts by ID without committing.
+
+        The vectors are left in the index, the caller deletes them once the deletion is
+        committed, so a rolled back write never leaves rows without a live vector.
+
+        :param ids: The IDs to delete.
+        :type ids: List[str]
+
+        :return: The labels of the deleted rows.
+        :rtype: List[int]
+        """
+        with self._lock:
+            labels = []
+            for start in range(0, len(ids), 500):
+                batch = ids[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                labels.extend(
+                    label
+                    for (label,) in self._conn.execute(
+                        f"SELECT label FROM documents WHERE id IN ({placeholders})", batch
+                    )
+                )
+                self._conn.execute(
+                    f"DELETE FROM documents WHERE id IN ({placeholders})", batch
+                )
+            return labels
+
+    def get(
+        self,
+        ids: Union[List[str], None] = None,
+        where: Union[dict[str, Any], None] = None,
+        limit: Union[int, None] = None,
+        offset: Union[int, None] = None,
+        include: List[str] = ["metadatas", "documents"],
+        **kwargs: Any,
+    ) -> dict[str, Any]:
+        """
+        Get stored texts, like ``Chroma.get``.
+
+        :param ids: The IDs to get. All IDs if None.
+        :type ids: Union[List[str], None]
+        :param where: A Chroma-style metadata filter.
+        :type where: Union[dict[str, Any], None]
+        :param limit: The maximum number of results.
+        :type limit: Union[int, None]
+        :param offset: The number of results to skip.
+        :type offset: Union[int, None]
+        :param include: The fields to return, among "documents", "metadatas" and "embeddings".
+        :type include: List[str]
+
+        :return: The IDs and the included fields of the matching texts.
+        :rtype: dict[str, Any]
+        """
+        clause, params = _where_clause(where or {})
+        if ids is not None:
+            clause += f" AND id IN ({','.join('?' * len(ids))})"
+            params.extend(ids)
+        query = f"SELECT label, id, document, metadata FROM documents WHERE {clause} ORDER BY label"
+        if limit is not None or offset is not None:
+            query += " LIMIT ? OFFSET ?"
+            params.extend([-1 if limit is None else limit, offset or 0])
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+            vectors = (
+                self._index.vectors([row[0] for row in rows])
+                if "embeddings" in include and self._index is not None
+                else None
+            )
+
+        return {
+            "ids": [row[1] for row in rows],
+            "documents": [row[2] for row in rows] if "documents" in include else None,
+            "metadatas": (
+                [json.loads(row[3]) for row in rows] if "metadatas" in include else None
+            ),
+            "embeddings": vectors.tolist() if vectors is not None else None,
+        }
+
+    def _labels(self, filter: Union[dict[str, Any], None]) -> Union[set[int], None]:
+        """
+        Get the labels matching a metadata filter. The caller holds the lock.
+
+        The query variants of a retrieval share their filter, so the labels of the most recent
+        filters are cached until the next write.
+
+        :param filter: A Chroma-style metadata filter, or None.
+        :type filter: Union[dict[str, Any], None]
+
+        :return: The matching labels, or None if there is no filter.
+        :rtype: Union[set[int], None]
+        """
+        if not filter:
+            return None
+        key = json.dumps(filter, sort_keys=True)
+        if key in self._filter_labels:
+            self._filter_labels.move_to_end(key)
+            return self._filter_labels[key]
+
+        clause, params = _where_clause(filter)
+        labels = {
+            label
+            for (label,) in self._conn.execute(
+                f"SELECT label FROM documents WHERE {clause}", params
+            )
+        }
+        self._filter_labels[key] = labels
+        if len(self._filter_labels) > self._FILTER_CACHE_SIZE:
+            self._filter_labels.popitem(last=False)
+        return labels
+
+    def _search(
+        self, embedding: List[float], k: int, filter: Union[dict[str, Any], None]
+    ) -> List[Tuple[int, float]]:
+        """
+        Search the nearest stored vectors.
+
+        Small filtered subsets are scored exactly instead of walking the graph with a filter.
+
+        :param embedding: The query embedding.
+        :type embedding: List[float]
+        :param k: The number of results.
+        :type k: int
+        :param filter: A Chroma-style metadata filter, or None.
+        :type filter: Union[dict[str, Any], None]
+
+        :return: The labels and cosine distances of the results, nearest first.
+        :rtype: List[Tuple[int, float]]
+        """
+        if self._index is None:
+            return []
+        vector = np.asarray(embedding, dtype=np.float32)
+
+        allowed = self._labels(filter)
+        if allowed is not None and len(allowed) == self._count:
+            allowed = None
+        candidates = self._count if allowed is None else len(allowed)
+        k = min(k, candidates)
+        if k == 0:
+            return []
+
+        if allowed is not None and len(allowed) <= self._BRUTE_FORCE_LIMIT:
+            return self._exact_search(vector, k, list(allowed))
+        try:
+            labels, distances = self._index.search(vector, k, allowed)
+        except RuntimeError:
+            # Even the widest graph walk found fewer than k results. Only a filtered subset is
+            # scored exactly; without a filter, the results the walk can reach are returned.
+            if allowed is not None:
+                return self._exact_search(vector, k, list(allowed))
+            while k > 1:
+                k //= 2
+                try:
+                    labels, distances = self._index.search(vector, k, None)
+                    break
+                except RuntimeError:
+                    continue
+            else:
+                return []
+            logger_vectorstore.warning(
+                f"Only {k} results reachable in the {self.collection_name} index."
+            )
+        return list(zip(labels.tolist(), distances.tolist()))
+
+    def _exact_search(
+        self, vector: np.ndarray, k: int, labels: List[int]
+    ) -> List[Tuple[int, float]]:
+        """
+        Score a set of stored vectors exactly.
+
+        :param vector: The query vector.
+        :type vector: np.ndarray
+        :param k: The number of results.
+        :type k: int
+        :param labels: The labels to score.
+        :type labels: List[int]
+
+        :return: The labels and cosine distances of the results, nearest first.
+        :rtype: List[Tuple[int, float]]
+        """
+        assert self._index is not None
+        vectors = self._index.vectors(labels)
+        norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(vector) or 1)
+        similarities = (vectors @ vector) / np.where(norms > 0, norms, 1)
+        top = np.argsort(-similarities)[:k]
+        return [(labels[i], 1 - float(similarities[i])) for i in top]
+
+    def _documents(self, labels: List[int]) -> List[Document]:
+        """
+        Build the documents of stored labels.
+
+        :param labels: The labels.
+        :type labels: List[int]
+
+        :return: The documents, in the order of the labels.
+        :rtype: List[Document]
+        """
+        if not labels:
+            return []
+        rows = self._conn.execute(
+            f"SELECT label, document, metadata FROM documents WHERE label IN ({','.join('?' * len(labels))})",
+            labels,
+        ).fetchall()
+        found = {
+            label: Document(page_content=text, metadata=json.loads(metadata))
+            for label, text, metadata in rows
+        }
+        return [found[label] for label in labels if label in found]
+
+    def similarity_search_by_vector_with_score(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Union[dict[str, Any], None] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Search the texts nearest to an embedding.
+
+        :param embedding: The query embedding.
+        :type embedding: List[float]
+        :param k: The number of results. Defaults to 4.
+        :type k: int
+        :param filter: A Chroma-style metadata filter.
+        :type filter: Union[dict[str, Any], None]
+
+        :return: The documents and their cosine distances, nearest first.
+        :rtype: List[Tuple[Document, float]]
+        """
+        with self._lock:
+            results = self._search(embedding, k, filter)
+            documents = self._documents([label for label, _ in results])
+        return list(zip(documents, [distance for _, distance in results]))
+
+    def similarity_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Union[dict[str, Any], None] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """
+        Search the texts nearest to an embedding.
+
+        :param embedding: The query embedding.
+        :type embedding: List[float]
+        :param k: The number of results. Defaults to 4.
+        :type k: int
+        :param filter: A Chroma-style metadata filter.
+        :type filter: Union[dict[str, Any], None]
+
+        :return: The documents, nearest first.
+        :rtype: List[Document]
+        """
+        return [
+            document
+            for document, _ in self.similarity_search_by_vector_with_score(
+                embedding, k, filter
+            )
+        ]
+
+    def similarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Union[dict[str, Any], None] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Search the texts nearest to a query.
+
+        :param query: The query.
+        :type query: str
+        :param k: The number of results. Defaults to 4.
+        :type k: int
+        :param filter: A Chroma-style metadata filter.
+        :type filter: Union[dict[str, Any], None]
+
+        :return: The documents and their cosine distances, nearest first.
+        :rtype: List[Tuple[Document, float]]
+        """
+        return self.similarity_search_by_vector_with_score(
+            self._embedding_function.embed_query(query), k, filter
+        )
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Union[dict[str, Any], None] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """
+        Search the texts nearest to a query.
+
+        :param query: The query.
+        :type query: str
+        :param k: The number of results. Defaults to 4.
+        :type k: int
+        :param filter: A Chroma-style metadata filter.
+        :type filter: Union[dict[str, Any], None]
+
+        :return: The documents, nearest first.
+        :rtype: List[Document]
+        """
+        return [
+            document
+            for document, _ in self.similarity_search_with_score(query, k, filter)
+        ]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return self._cosine_relevance_score_fn
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: Union[dict[str, Any], None] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """
+        Search the texts nearest to an embedding, then select a diverse subset with MMR.
+
+        :param embedding: The query embedding.
+        :type embedding: List[float]
+        :param k: The number of results. Defaults to 4.
+        :type k: int
+        :param fetch_k: The number of candidates passed to MMR. Defaults to 20.
+        :type fetch_k: int
+        :param lambda_mult: The trade-off between relevance (1) and diversity (0). Defaults to 0.5.
+        :type lambda_mult: float
+        :param filter: A Chroma-style metadata filter.
+        :type filter: Union[dict[str, Any], None]
+
+        :return: The selected documents.
+        :rtype: List[Document]
+        """
+        with self._lock:
+            labels = [label for label, _ in self._search(embedding, fetch_k, filter)]
+            if not labels:
+                return []
+            assert self._index is not None
+            vectors = self._index.vectors(labels)
+            selected = mmr_select(embedding, vectors, k=k, lambda_mult=lambda_mult)
+            return self._documents([labels[i] for i in selected])
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: Union[dict[str, Any], None] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """
+        Search the texts nearest to a query, then select a diverse subset with MMR.
+
+        :param query: The query.
+        :type query: str
+        :param k: The number of results. Defaults to 4.
+        :type k: int
+        :param fetch_k: The number of candidates passed to MMR. Defaults to 20.
+        :type fetch_k: int
+        :param lambda_mult: The trade-off between relevance (1) and diversity (0). Defaults to 0.5.
+        :type lambda_mult: float
+        :param filter: A Chroma-style metadata filter.
+        :type filter: Union[dict[str, Any], None]
+
+        :return: The selected documents.
+        :rtype: List[Document]
+        """
+        return self.max_marginal_relevance_search_by_vector(
+            self._embedding_function.embed_query(query),
+            k,
+            fetch_k,
+            lambda_mult,
+            filter,
+        )
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Union[List[dict], None] = None,
+        ids: Union[List[str], None] = None,
+        collection_name: str = "langchain",
+        persist_directory: str = "./local_vdb",
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        """
+        Create a store and add texts to it.
+
+        :param texts: The texts.
+        :type texts: List[str]
+        :param embedding: The embeddings used to embed texts and queries.
+        :type embedding: Embeddings
+        :param metadatas: The metadata of the texts.
+        :type metadatas: Union[List[dict], None]
+        :param ids: The IDs of the texts.
+        :type ids: Union[List[str], None]
+        :param collection_name: The name of the collection. Defaults to "langchain".
+        :type collection_name: str
+        :param persist_directory: The directory of the collection files. Defaults to "./local_vdb".
+        :type persist_directory: str
+
+        :return: The store.
+        :rtype: LocalVectorStore
+        """
+        store = cls(collection_name, persist_directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+    def close(self):
+        """
+        Flush the index and close the database.
+        """
+        with self._lock:
+            if self._index is not None:
+                self._index.close()
+            self._conn.close()
+
+
+def index_namespace(vectordb: VectorStore) -> str:
+    """
+    Get the namespace of the indexes kept alongside a vector store: the BM25 index, the parent
+    spans and the arXiv IDs known to be indexed.
+
+    They must only ever describe the chunks of their own store, or a newly selected store would
+    skip papers that are only indexed in another one, and the BM25 index would return chunks it
+    cannot resolve. The bot keeps a single Chroma collection, which uses the default namespace;
+    every LocalVectorStore gets its own.
+
+    :param vectordb: The vector store.
+    :type vectordb: VectorStore
+
+    :return: The namespace, "" for the default one.
+    :rtype: str
+    """
+    if not isinstance(vectordb, LocalVectorStore):
+        return ""
+    location = os.path.abspath(
+        os.path.join(vectordb.persist_directory, vectordb.collection_name)
+    )
+    digest = hashlib.sha256(location.encode("utf-8")).hexdigest()[:16]
+    return f"{vectordb.engine.lower()}-{digest}"
+
+
+class ArxivChroma(Chroma):
+    """
+    Chroma vector store whose MMR search uses the vectorized mmr_select.
+    """
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: Union[dict[str, Any], None] = None,
+        where_document: Union[dict[str, Any], None] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """
+        Search the texts nearest to an embedding, then select a diverse subset with MMR.
+
+        :param embedding: The query embedding.
+        :type embedding: List[float]
+        :param k: The number of results. Defaults to 4.
+        :type k: int
+        :param fetch_k: The number of candidates passed to MMR. Defaults to 20.
+        :type fetch_k: int
+        :param lambda_mult: The trade-off between relevance (1) and diversity (0). Defaults to 0.5.
+        :type lambda_mult: float
+        :param filter: A metadata filter.
+        :type filter: Union[dict[str, Any], None]
+        :param where_document: A document content filter.
+        :type where_document: Union[dict[str, Any], None]
+
+        :return: The selected documents, in selection order.
+        :rtype: List[Document]
+        """
+        results = self._collection.query(
+            query_embeddings=[embedding],
+            n_results=fetch_k,
+            where=filter,
+            where_document=where_document,
+            include=["metadatas", "documents", "embeddings"],
+            **kwargs,
+        )
+        if not results["ids"][0]:
+            return []
+
+        selected = mmr_select(
+            embedding, results["embeddings"][0], k=k, lambda_mult=lambda_mult
+        )
+        return [
+            Document(
+                page_content=results["documents"][0][i],
+                metadata=results["metadatas"][0][i] or {},
+            )
+            for i in selected
+        ]
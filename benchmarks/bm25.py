@@ -0,0 +1,105 @@
+"""
+Query latency of the BM25 index over synthetic chunks.
+
+Usage: python -m benchmarks.bm25 [--chunks 100000] [--queries 100] [--k 10]
+"""
+
+from arxiv_bot.cache import cache_path
+from arxiv_bot.lexical import BM25Index
+from langchain.schema.document import Document
+from typing import Union
+import argparse
+import logging
+import numpy as np
+import os
+import time
+
+logger_benchmark = logging.getLogger("Benchmark")
+logger_benchmark.setLevel(logging.INFO)
+
+
+def benchmark(
+    n_chunks: int = 100_000,
+    chunk_terms: int = 150,
+    vocabulary: int = 50_000,
+    n_queries: int = 100,
+    k: int = 10,
+    path: Union[str, None] = None,
+    seed: int = 0,
+) -> dict[str, float]:
+    """
+    Measure the query latency of a BM25 index over synthetic chunks.
+
+    Terms are drawn from a Zipf distribution so that posting list lengths resemble text.
+
+    :param n_chunks: The number of chunks. Defaults to 100000.
+    :type n_chunks: int
+    :param chunk_terms: The number of terms per chunk. Defaults to 150.
+    :type chunk_terms: int
+    :param vocabulary: The number of distinct terms. Defaults to 50000.
+    :type vocabulary: int
+    :param n_queries: The number of queries. Defaults to 100.
+    :type n_queries: int
+    :param k: The number of results per query. Defaults to 10.
+    :type k: int
+    :param path: The path of the benchmark database. Defaults to ``bm25_benchmark.sqlite`` in CACHE_DIR, recreated.
+    :type path: str
+    :param seed: The random seed. Defaults to 0.
+    :type seed: int
+
+    :return: The indexing throughput and the mean and p95 query latency in milliseconds.
+    :rtype: dict[str, float]
+    """
+    path = path or cache_path("bm25_benchmark.sqlite")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    rng = np.random.default_rng(seed)
+    words = [f"w{i}" for i in range(vocabulary)]
+
+    def sample(n: int) -> str:
+        return " ".join(words[i] for i in np.minimum(rng.zipf(1.2, n), vocabulary) - 1)
+
+    index = BM25Index(path)
+    start = time.perf_counter()
+    for offset in range(0, n_chunks, 1000):
+        index.add(
+            [
+                Document(
+                    page_content=sample(chunk_terms),
+                    metadata={"chunk_id": f"c{i}", "scope": "public"},
+                )
+                for i in range(offset, min(offset + 1000, n_chunks))
+            ]
+        )
+    index_seconds = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(n_queries):
+        query = sample(8)
+        start = time.perf_counter()
+        index.search(query, k, scopes=["public", "session"])
+        latencies.append(time.perf_counter() - start)
+
+    result = {
+        "n_chunks": n_chunks,
+        "chunks_per_sec": n_chunks / index_seconds,
+        "mean_ms": 1000 * float(np.mean(latencies)),
+        "p95_ms": 1000 * float(np.percentile(latencies, 95)),
+    }
+    logger_benchmark.info(
+        f"BM25 over {n_chunks} chunks: indexed {result['chunks_per_sec']:.0f} chunks/s, "
+        f"query mean {result['mean_ms']:.1f}ms, p95 {result['p95_ms']:.1f}ms"
+    )
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    parser = argparse.ArgumentParser(description="Benchmark the BM25 index over synthetic chunks.")
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+    benchmark(n_chunks=args.chunks, n_queries=args.queries, k=args.k)
@@ -0,0 +1,122 @@
+"""
+Number of chunks and retrieval hit rate of the chunkers on an evaluation set.
+
+Usage: python -m benchmarks.chunking eval.json output/*.tei.xml [--parser GROBID] [--k 3]
+
+The evaluation set is a JSON list of {"query": ..., "answer": ...} objects, each answer
+found verbatim in the corpus. Chunks and queries are embedded with OpenAI embeddings.
+"""
+
+from arxiv_bot.search import ProcessPDF, chunk_file, get_text_splitter
+from langchain_core.embeddings import Embeddings
+from typing import List, Literal
+import argparse
+import json
+import logging
+import numpy as np
+import os
+
+logger_benchmark = logging.getLogger("Benchmark")
+logger_benchmark.setLevel(logging.INFO)
+
+
+def benchmark_chunking(
+    paths: List[str],
+    parser: Literal["PyMuPDF", "GROBID"],
+    eval_set: List[dict[str, str]],
+    embeddings: Embeddings,
+    chunkers: List[Literal["Text", "Section"]] = ["Text", "Section"],
+    k: int = 3,
+    chunk_size: int = 1024,
+    chunk_overlap: int = 100,
+    segmenter: Literal["spaCy", "Sentencizer", "Regex"] = "spaCy",
+) -> List[dict[str, float]]:
+    """
+    Compare chunkers by the number of chunks they produce and the retrieval hit rate on a fixed evaluation set.
+
+    A question is a hit when one of the k chunks closest to it (by cosine similarity of the
+    embeddings) contains its answer.
+
+    :param paths: The PDFs ("PyMuPDF") or TEI files ("GROBID") of the corpus.
+    :type paths: List[str]
+    :param parser: The parser the files come from.
+    :type parser: Literal["PyMuPDF", "GROBID"]
+    :param eval_set: The questions, each a dict with a "query" and an "answer" span found verbatim in the corpus.
+    :type eval_set: List[dict[str, str]]
+    :param embeddings: The embeddings used to embed chunks and questions.
+    :type embeddings: Embeddings
+    :param chunkers: The chunkers to compare. Defaults to ["Text", "Section"].
+    :type chunkers: List[Literal["Text", "Section"]]
+    :param k: The number of chunks retrieved per question. Defaults to 3.
+    :type k: int
+    :param chunk_size: The chunk size. Defaults to 1024.
+    :type chunk_size: int
+    :param chunk_overlap: The chunk overlap. Defaults to 100.
+    :type chunk_overlap: int
+    :param segmenter: The sentence segmentation. Defaults to "spaCy".
+    :type segmenter: Literal["spaCy", "Sentencizer", "Regex"]
+
+    :return: The number of chunks, mean chunk length, hit rate and characters retrieved per question of each chunker.
+    :rtype: List[dict[str, float]]
+    """
+    text_splitter = get_text_splitter(chunk_size, chunk_overlap, segmenter=segmenter)
+    window = chunk_size * ProcessPDF._SPLIT_WINDOW_CHUNKS
+    normalize = lambda text: " ".join(text.split()).lower()
+    queries = np.array(embeddings.embed_documents([item["query"] for item in eval_set]))
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    results = []
+    for chunker in chunkers:
+        chunks = [
+            text
+            for path in paths
+            for _, text in chunk_file(text_splitter, parser, path, window, chunker, chunk_size, chunk_overlap)
+        ]
+        vectors = np.array(embeddings.embed_documents(chunks))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        top_k = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+
+        normalized = [normalize(chunk) for chunk in chunks]
+        hits = sum(
+            any(normalize(item["answer"]) in normalized[idx] for idx in top)
+            for item, top in zip(eval_set, top_k)
+        )
+        results.append(
+            {
+                "chunker": chunker,
+                "chunks": len(chunks),
+                "mean_chunk_chars": sum(map(len, chunks)) / max(len(chunks), 1),
+                "hit_rate": hits / max(len(eval_set), 1),
+                "chars_per_question": float(
+                    np.mean([sum(len(chunks[idx]) for idx in top) for top in top_k])
+                ),
+            }
+        )
+        logger_benchmark.info(
+            f"Chunker {chunker}: {len(chunks)} chunks, hit rate@{k} {results[-1]['hit_rate']:.2%}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    from arxiv_bot.functions import load_embeddings
+
+    logging.basicConfig()
+    parser = argparse.ArgumentParser(description="Compare the chunkers on an evaluation set.")
+    parser.add_argument("eval_set", help="JSON list of {query, answer} objects.")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--parser", choices=["PyMuPDF", "GROBID"], default="GROBID")
+    parser.add_argument("--embedding-model", default=os.environ.get("INIT_EMBEDDING", "text-embedding-3-small"))
+    parser.add_argument("--segmenter", choices=["spaCy", "Sentencizer", "Regex"], default="spaCy")
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+    with open(args.eval_set) as file:
+        eval_set = json.load(file)
+    benchmark_chunking(
+        args.paths,
+        args.parser,
+        eval_set,
+        load_embeddings(args.embedding_model),
+        k=args.k,
+        segmenter=args.segmenter,
+    )
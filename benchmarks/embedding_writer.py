@@ -0,0 +1,205 @@
+"""
+Throughput of EmbeddingWriter against a local stub embedding API.
+
+Usage: python -m benchmarks.embedding_writer [--chunks 2000] [--concurrency 1 2 4 8] [--capacity 4] [--latency 0.1]
+
+The stub speaks the OpenAI embeddings API, takes longer the more tokens a request has and,
+like the real API under load, answers 429 with a Retry-After header when all of its slots
+are busy. The baseline writes every chunk with a single add_documents call, as the bot did
+before EmbeddingWriter.
+"""
+
+from arxiv_bot.ingest import EmbeddingWriter
+from arxiv_bot.vectorstores import LocalVectorStore
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain.schema.document import Document
+from langchain_openai.embeddings import OpenAIEmbeddings
+from typing import List
+import argparse
+import json
+import logging
+import numpy as np
+import os
+import tempfile
+import threading
+import time
+
+logger_benchmark = logging.getLogger("Benchmark")
+logger_benchmark.setLevel(logging.INFO)
+
+
+class StubEmbeddingHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the stub embedding API.
+
+    Answers after server.latency seconds plus server.per_token seconds per input token and
+    rejects requests with 429 when all of the server.slots are busy.
+    """
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        server = self.server
+        if not server.slots.acquire(blocking=False):  # type: ignore
+            server.rejected += 1  # type: ignore
+            self.send_response(429)
+            self.send_header("Retry-After", str(server.latency))  # type: ignore
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        try:
+            inputs = body["input"]
+            # Token IDs when the client tokenizes the input, texts otherwise.
+            tokens = sum(len(item) if isinstance(item, list) else len(item) // 4 + 1 for item in inputs)
+            time.sleep(server.latency + server.per_token * tokens)  # type: ignore
+            rng = np.random.default_rng(len(inputs))
+            vectors = rng.normal(size=(len(inputs), server.dim)).astype(np.float32)  # type: ignore
+            response = json.dumps(
+                {
+                    "object": "list",
+                    "data": [
+                        {"object": "embedding", "index": i, "embedding": vector.tolist()}
+                        for i, vector in enumerate(vectors)
+                    ],
+                    "model": body["model"],
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                }
+            ).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+        finally:
+            server.slots.release()  # type: ignore
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _documents(n_chunks: int, chunk_size: int) -> List[Document]:
+    """
+    Build synthetic chunks.
+
+    :param n_chunks: The number of chunks.
+    :type n_chunks: int
+    :param chunk_size: The number of characters per chunk.
+    :type chunk_size: int
+
+    :return: The chunks, each with a chunk_id in its metadata.
+    :rtype: List[Document]
+    """
+    words = "attention transformer embedding retrieval token layer model paper".split()
+    docs = []
+    for i in range(n_chunks):
+        text = " ".join(words[(i + j) % len(words)] for j in range(chunk_size // 8))
+        docs.append(Document(page_content=f"{i} {text}", metadata={"chunk_id": f"chunk-{i}"}))
+    return docs
+
+
+def benchmark(
+    n_chunks: int = 2000,
+    chunk_size: int = 1024,
+    concurrency_values: List[int] = [1, 2, 4, 8],
+    max_batch_tokens: int = 50_000,
+    server_capacity: int = 4,
+    latency: float = 0.1,
+    per_token: float = 2e-5,
+    embedding_model: str = os.environ.get("INIT_EMBEDDING", "text-embedding-3-small"),
+) -> List[dict[str, float]]:
+    """
+    Measure the throughput of EmbeddingWriter against a local stub embedding API.
+
+    :param n_chunks: The number of chunks per run. Defaults to 2000.
+    :type n_chunks: int
+    :param chunk_size: The number of characters per chunk. Defaults to 1024.
+    :type chunk_size: int
+    :param concurrency_values: The writer concurrencies to measure. Defaults to [1, 2, 4, 8].
+    :type concurrency_values: List[int]
+    :param max_batch_tokens: The maximum number of tokens per batch. Defaults to 50000.
+    :type max_batch_tokens: int
+    :param server_capacity: The number of requests the stub serves at once. Defaults to 4.
+    :type server_capacity: int
+    :param latency: The base latency in seconds of the stub per request. Defaults to 0.1.
+    :type latency: float
+    :param per_token: The latency in seconds of the stub per token. Defaults to 2e-5.
+    :type per_token: float
+    :param embedding_model: The model name sent to the stub. Defaults to the INIT_EMBEDDING environment variable, or "text-embedding-3-small".
+    :type embedding_model: str
+
+    :return: The chunks per second, failed chunks and rejected requests of the baseline and each concurrency.
+    :rtype: List[dict[str, float]]
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubEmbeddingHandler)
+    server.slots = threading.BoundedSemaphore(server_capacity)  # type: ignore
+    server.latency = latency  # type: ignore
+    server.per_token = per_token  # type: ignore
+    server.dim = 256  # type: ignore
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Retries are left to EmbeddingWriter, so rejected requests show up in its stats.
+    embeddings = OpenAIEmbeddings(
+        model=embedding_model,
+        openai_api_base=f"http://127.0.0.1:{server.server_address[1]}/v1",
+        openai_api_key="stub",
+        max_retries=0,
+    )
+    docs = _documents(n_chunks, chunk_size)
+
+    results = []
+    try:
+        for concurrency in [0, *concurrency_values]:
+            server.rejected = 0  # type: ignore
+            with tempfile.TemporaryDirectory() as persist_directory:
+                store = LocalVectorStore("benchmark", persist_directory, embeddings, engine="Flat")
+                start = time.perf_counter()
+                if concurrency:
+                    writer = EmbeddingWriter(
+                        store,
+                        max_batch_tokens=max_batch_tokens,
+                        max_concurrency=concurrency,
+                        backoff=latency,
+                    )
+                    failed = len(writer.write(docs))
+                else:
+                    store.add_documents(docs, ids=[doc.metadata["chunk_id"] for doc in docs])
+                    failed = 0
+                seconds = time.perf_counter() - start
+            results.append(
+                {
+                    "concurrency": concurrency,
+                    "chunks_per_sec": n_chunks / seconds,
+                    "failed": failed,
+                    "rejected": server.rejected,  # type: ignore
+                }
+            )
+            name = f"EmbeddingWriter, concurrency {concurrency}" if concurrency else "Single add_documents call"
+            logger_benchmark.info(
+                f"{name} against {server_capacity} API slots: "
+                f"{results[-1]['chunks_per_sec']:.1f} chunks/s, {failed} failed, "
+                f"{results[-1]['rejected']} requests rejected with 429"
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    parser = argparse.ArgumentParser(description="Benchmark EmbeddingWriter against a stub embedding API.")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--batch-tokens", type=int, default=50_000)
+    parser.add_argument("--capacity", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.1)
+    args = parser.parse_args()
+
+    benchmark(
+        n_chunks=args.chunks,
+        chunk_size=args.chunk_size,
+        concurrency_values=args.concurrency,
+        max_batch_tokens=args.batch_tokens,
+        server_capacity=args.capacity,
+        latency=args.latency,
+    )
@@ -0,0 +1,124 @@
+"""
+Throughput of GrobidService against a local stub GROBID server.
+
+Usage: python -m benchmarks.grobid_load [--pdfs 40] [--concurrency 1 2 4 8] [--capacity 4] [--latency 0.2]
+"""
+
+from arxiv_bot.grobid import GrobidService
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Union
+import argparse
+import logging
+import os
+import threading
+import time
+
+logger_benchmark = logging.getLogger("Benchmark")
+logger_benchmark.setLevel(logging.INFO)
+
+
+class StubGrobidHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the stub GROBID server.
+
+    Answers after server.latency seconds and, like GROBID, rejects requests with 503 when
+    all of the server.slots are busy.
+    """
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        if not server.slots.acquire(blocking=False):  # type: ignore
+            self.send_response(503)
+            self.end_headers()
+            return
+        try:
+            time.sleep(server.latency)  # type: ignore
+            body = b'<TEI xmlns="http://www.tei-c.org/ns/1.0"><text><body/></text></TEI>'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/xml")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            server.slots.release()  # type: ignore
+
+    def log_message(self, format, *args):
+        pass
+
+
+def load_test(
+    n_pdfs: int = 40,
+    concurrency_values: List[int] = [1, 2, 4, 8],
+    server_capacity: int = 4,
+    latency: float = 0.2,
+    output_dir: Union[str, None] = None,
+) -> List[dict[str, float]]:
+    """
+    Measure the throughput of GrobidService against a local stub GROBID server.
+
+    :param n_pdfs: The number of PDFs per run. Defaults to 40.
+    :type n_pdfs: int
+    :param concurrency_values: The client concurrencies to measure. Defaults to [1, 2, 4, 8].
+    :type concurrency_values: List[int]
+    :param server_capacity: The number of worker slots of the stub. Defaults to 4.
+    :type server_capacity: int
+    :param latency: The processing time in seconds of the stub per PDF. Defaults to 0.2.
+    :type latency: float
+    :param output_dir: The directory of the stub PDFs. Defaults to ``./output/grobid_load_test``.
+    :type output_dir: Union[str, None]
+
+    :return: The PDFs per second and number of failures of each concurrency.
+    :rtype: List[dict[str, float]]
+    """
+    output_dir = output_dir or os.path.join("./output", "grobid_load_test")
+    os.makedirs(output_dir, exist_ok=True)
+    pdf_paths = []
+    for i in range(n_pdfs):
+        path = os.path.join(output_dir, f"stub{i}.pdf")
+        with open(path, "wb") as file:
+            file.write(b"%PDF-1.4\n" + os.urandom(64 * 1024))
+        pdf_paths.append(path)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGrobidHandler)
+    server.slots = threading.BoundedSemaphore(server_capacity)  # type: ignore
+    server.latency = latency  # type: ignore
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = []
+    try:
+        for concurrency in concurrency_values:
+            client = GrobidService(
+                f"http://127.0.0.1:{server.server_address[1]}",
+                concurrency=concurrency,
+                backoff=latency / 4,
+            )
+            start = time.perf_counter()
+            statuses = client.process_batch("processFulltextDocument", pdf_paths)
+            seconds = time.perf_counter() - start
+            results.append(
+                {
+                    "concurrency": concurrency,
+                    "pdfs_per_sec": n_pdfs / seconds,
+                    "failed": sum(status != 200 for _, status, _ in statuses),
+                }
+            )
+            logger_benchmark.info(
+                f"Load test, concurrency {concurrency} against {server_capacity} GROBID slots: "
+                f"{results[-1]['pdfs_per_sec']:.2f} PDFs/s, {results[-1]['failed']} failed"
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    parser = argparse.ArgumentParser(description="Load test GrobidService against a stub GROBID server.")
+    parser.add_argument("--pdfs", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--capacity", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+    load_test(args.pdfs, args.concurrency, args.capacity, args.latency)
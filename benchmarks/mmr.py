@@ -0,0 +1,84 @@
+"""
+Latency of mmr_select against langchain's maximal_marginal_relevance.
+
+Usage: python -m benchmarks.mmr [--dim 1536] [--k 3] [--fetch-k 10 50 100 200 400]
+"""
+
+from arxiv_bot.vectorstores import mmr_select
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from typing import List
+import argparse
+import logging
+import numpy as np
+import time
+
+logger_benchmark = logging.getLogger("Benchmark")
+logger_benchmark.setLevel(logging.INFO)
+
+
+def benchmark_mmr(
+    dim: int = 1536,
+    k: int = 3,
+    fetch_k_values: List[int] = [10, 50, 100, 200, 400],
+    repeats: int = 20,
+    seed: int = 0,
+) -> List[dict[str, float]]:
+    """
+    Compare the latency of mmr_select against langchain's maximal_marginal_relevance.
+
+    :param dim: The dimension of the random embeddings. Defaults to 1536.
+    :type dim: int
+    :param k: The number of candidates to select. Defaults to 3.
+    :type k: int
+    :param fetch_k_values: The numbers of candidates to measure. Defaults to [10, 50, 100, 200, 400].
+    :type fetch_k_values: List[int]
+    :param repeats: The number of runs per size. Defaults to 20.
+    :type repeats: int
+    :param seed: The random seed. Defaults to 0.
+    :type seed: int
+
+    :return: The mean latency in milliseconds of both implementations for each fetch_k, and whether they agree.
+    :rtype: List[dict[str, float]]
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for fetch_k in fetch_k_values:
+        baseline, vectorized = [], []
+        agree = True
+        for _ in range(repeats):
+            query = rng.normal(size=dim).astype(np.float32)
+            candidates = rng.normal(size=(fetch_k, dim)).astype(np.float32)
+
+            start = time.perf_counter()
+            expected = maximal_marginal_relevance(query, candidates, k=k)
+            baseline.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            selected = mmr_select(query, candidates, k=k)
+            vectorized.append(time.perf_counter() - start)
+            agree = agree and selected == expected
+
+        results.append(
+            {
+                "fetch_k": fetch_k,
+                "baseline_ms": 1000 * float(np.mean(baseline)),
+                "vectorized_ms": 1000 * float(np.mean(vectorized)),
+                "agree": agree,
+            }
+        )
+        logger_benchmark.info(
+            f"MMR fetch_k={fetch_k}, k={k}: baseline {results[-1]['baseline_ms']:.2f}ms, "
+            f"vectorized {results[-1]['vectorized_ms']:.2f}ms, same selection: {agree}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    parser = argparse.ArgumentParser(description="Benchmark mmr_select against langchain.")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--fetch-k", type=int, nargs="+", default=[10, 50, 100, 200, 400])
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+    benchmark_mmr(args.dim, args.k, args.fetch_k, args.repeats)
@@ -0,0 +1,192 @@
+"""
+Extraction time and peak memory of PyMuPDF parsing on large synthetic PDFs.
+
+Usage: python -m benchmarks.pymupdf [--pages 50 200 800] [--extractors concatenate streaming] [--segmenter Regex] [--output-dir ./output/pymupdf_benchmark]
+
+Each PDF has a title page, an Introduction, a body of dense pages, References and an
+Appendix, like a long survey or thesis. The previous extractor concatenated the text of
+every page and split the whole document three times before chunking it; it is kept here as
+the baseline of the streaming extractor (PyMuPDFParser.iter_content and split_stream).
+
+The baseline reports about twice as many chunks: it looked for the Appendix after cutting
+the text at References, found none and appended the whole body a second time.
+"""
+
+from arxiv_bot.search import PyMuPDFParser, ProcessPDF, get_text_splitter, split_stream
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Literal, Tuple
+import argparse
+import fitz
+import logging
+import multiprocessing
+import os
+import random
+import re
+import resource
+import time
+
+logger_benchmark = logging.getLogger("Benchmark")
+logger_benchmark.setLevel(logging.INFO)
+
+_INTRO_DELIMITERS = "|".join(map(re.escape, ["Introduction\n", "INTRODUCTION\n"]))
+_REF_DELIMITERS = "|".join(map(re.escape, ["References\n", "REFERENCES\n"]))
+_APPENDIX_DELIMITERS = "|".join(map(re.escape, ["Appendix\n", "APPENDIX\n"]))
+
+WORDS = "the model attends to every token of the input sequence with learned weights".split()
+
+
+def make_pdf(path: str, n_pages: int, seed: int = 0):
+    """
+    Write a synthetic paper: a title page, the body, References and an Appendix.
+
+    :param path: The path of the PDF.
+    :type path: str
+    :param n_pages: The number of pages of the body.
+    :type n_pages: int
+    :param seed: The random seed of the text. Defaults to 0.
+    :type seed: int
+    """
+    rng = random.Random(seed)
+
+    def paragraph(n_sentences: int) -> str:
+        return " ".join(
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 30))).capitalize() + "."
+            for _ in range(n_sentences)
+        )
+
+    def add_page(doc: fitz.Document, heading: str, text: str):
+        page = doc.new_page()
+        y = 50
+        if heading:
+            page.insert_text((50, y + 14), heading, fontsize=14)
+            y += 30
+        page.insert_textbox(fitz.Rect(50, y, 550, 800), text, fontsize=9)
+
+    doc = fitz.open()
+    add_page(doc, "A Synthetic Paper", "Abstract\n" + paragraph(8))
+    for i in range(n_pages):
+        add_page(doc, "Introduction" if i == 0 else "", paragraph(30))
+    add_page(doc, "References", "\n".join(f"[{i}] {paragraph(1)}" for i in range(40)))
+    add_page(doc, "Appendix", paragraph(30))
+    doc.save(path)
+    doc.close()
+
+
+def extract_in_worker(
+    extractor: Literal["concatenate", "streaming"],
+    pdf_path: str,
+    chunk_size: int,
+    segmenter: Literal["spaCy", "Sentencizer", "Regex"],
+) -> Tuple[float, int, int, int]:
+    """
+    Extract and chunk a PDF in a fresh process, see benchmark_pymupdf.
+
+    :param extractor: "concatenate": the previous extractor. "streaming": iter_content fed to split_stream.
+    :type extractor: Literal["concatenate", "streaming"]
+    :param pdf_path: The path to the PDF.
+    :type pdf_path: str
+    :param chunk_size: The chunk size.
+    :type chunk_size: int
+    :param segmenter: The sentence segmentation.
+    :type segmenter: Literal["spaCy", "Sentencizer", "Regex"]
+
+    :return: The time in seconds, the peak RSS growth in KiB, the number of chunks and their total length.
+    :rtype: Tuple[float, int, int, int]
+    """
+    text_splitter = get_text_splitter(chunk_size, 0, segmenter=segmenter)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    parser = PyMuPDFParser(pdf_path)
+    if extractor == "streaming":
+        chunks = split_stream(
+            text_splitter, parser.iter_content(), chunk_size * ProcessPDF._SPLIT_WINDOW_CHUNKS
+        )
+    else:
+        content = ""
+        for page in parser.doc:
+            content += page.get_text()  # type: ignore
+        content = re.split(_INTRO_DELIMITERS, content)[-1]
+        content = re.split(_REF_DELIMITERS, content)[0]
+        appendix = re.split(_APPENDIX_DELIMITERS, content)[-1]
+        content += "\n\n" + appendix
+        chunks = text_splitter.split_text(content)
+
+    n_chunks = n_chars = 0
+    for chunk in chunks:
+        n_chunks += 1
+        n_chars += len(chunk)
+    seconds = time.perf_counter() - start
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    return seconds, rss_growth, n_chunks, n_chars
+
+
+def benchmark_pymupdf(
+    page_counts: List[int] = [50, 200, 800],
+    extractors: List[Literal["concatenate", "streaming"]] = ["concatenate", "streaming"],
+    chunk_size: int = 1024,
+    segmenter: Literal["spaCy", "Sentencizer", "Regex"] = "Regex",
+    output_dir: str = os.path.join("./output", "pymupdf_benchmark"),
+) -> List[dict[str, float]]:
+    """
+    Measure the time and peak memory of extracting and chunking synthetic PDFs of growing length.
+
+    Each extraction runs in its own freshly spawned process, so the peak RSS growth of one
+    does not hide the other's.
+
+    :param page_counts: The numbers of body pages of the PDFs. Defaults to [50, 200, 800].
+    :type page_counts: List[int]
+    :param extractors: The extractors to measure. Defaults to both.
+    :type extractors: List[Literal["concatenate", "streaming"]]
+    :param chunk_size: The chunk size. Defaults to 1024.
+    :type chunk_size: int
+    :param segmenter: The sentence segmentation. Defaults to "Regex", as spaCy rejects texts over 1M characters in one piece.
+    :type segmenter: Literal["spaCy", "Sentencizer", "Regex"]
+    :param output_dir: The directory of the synthetic PDFs. Defaults to ``./output/pymupdf_benchmark``.
+    :type output_dir: str
+
+    :return: The seconds, pages per second, peak RSS growth in MiB and number of chunks of each extractor and PDF.
+    :rtype: List[dict[str, float]]
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    for n_pages in page_counts:
+        pdf_path = os.path.join(output_dir, f"synthetic-{n_pages}.pdf")
+        if not os.path.exists(pdf_path):
+            make_pdf(pdf_path, n_pages)
+
+        for extractor in extractors:
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                seconds, rss_growth, n_chunks, n_chars = pool.submit(
+                    extract_in_worker, extractor, pdf_path, chunk_size, segmenter
+                ).result()
+            results.append(
+                {
+                    "pages": n_pages,
+                    "extractor": extractor,
+                    "seconds": seconds,
+                    "pages_per_sec": n_pages / seconds,
+                    "peak_rss_growth_mb": rss_growth / 1024,
+                    "chunks": n_chunks,
+                    "chars": n_chars,
+                }
+            )
+            logger_benchmark.info(
+                f"PyMuPDF {extractor}, {n_pages} pages: {seconds:.2f}s "
+                f"({results[-1]['pages_per_sec']:.0f} pages/s), peak RSS +{results[-1]['peak_rss_growth_mb']:.1f} MiB, "
+                f"{n_chunks} chunks"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    parser = argparse.ArgumentParser(description="Benchmark PyMuPDF extraction on large synthetic PDFs.")
+    parser.add_argument("--pages", type=int, nargs="+", default=[50, 200, 800])
+    parser.add_argument("--extractors", nargs="+", default=["concatenate", "streaming"])
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--segmenter", default="Regex")
+    parser.add_argument("--output-dir", default=os.path.join("./output", "pymupdf_benchmark"))
+    args = parser.parse_args()
+    benchmark_pymupdf(args.pages, args.extractors, args.chunk_size, args.segmenter, args.output_dir)
@@ -0,0 +1,123 @@
+"""
+Per-call setup overhead of the multi-query retriever, built on every tool call or cached.
+
+Usage: python -m benchmarks.retriever_setup [--calls 200] [--k 3] [--fetch-k 10]
+
+Before the retriever was cached, every tool call built a new OpenAI client and a new
+retriever with its prompt chain. The benchmark builds the retriever both ways, once with a
+new OpenAI client and once with a stub LLM to separate the cost of the client from the cost
+of the chain, and compares them with get_multi_query_retriever. No request is sent to any API.
+"""
+
+from arxiv_bot.lexical import get_bm25_index
+from arxiv_bot.parents import get_parent_store
+from arxiv_bot.retrievers import (
+    ParallelMultiQueryRetriever,
+    _get_multi_query_retriever,
+    get_multi_query_retriever,
+)
+from arxiv_bot.search import PUBLIC_SCOPE
+from arxiv_bot.vectorstores import LocalVectorStore, index_namespace
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.llms.fake import FakeListLLM
+from langchain_core.vectorstores import VectorStore
+from langchain_openai.llms import OpenAI
+from typing import Callable, List
+import argparse
+import logging
+import numpy as np
+import tempfile
+import time
+
+logger_benchmark = logging.getLogger("Benchmark")
+logger_benchmark.setLevel(logging.INFO)
+
+
+def _build_per_call(
+    vectordb: VectorStore, llm: Callable[[], object], k: int, fetch_k: int
+) -> ParallelMultiQueryRetriever:
+    """
+    Build the retriever the way every tool call did before it was cached.
+
+    :param vectordb: The vector store to retrieve from.
+    :type vectordb: VectorStore
+    :param llm: The factory of the LLM generating the query variants.
+    :type llm: Callable[[], object]
+    :param k: The number of documents to return per query.
+    :type k: int
+    :param fetch_k: The number of documents fetched before MMR reranking.
+    :type fetch_k: int
+
+    :return: The retriever.
+    :rtype: ParallelMultiQueryRetriever
+    """
+    return ParallelMultiQueryRetriever.from_llm(
+        vectordb=vectordb,
+        llm=llm(),  # type: ignore
+        k=k,
+        fetch_k=fetch_k,
+        lexical_index=get_bm25_index(index_namespace(vectordb)),
+        parent_store=get_parent_store(index_namespace(vectordb)),
+    ).for_scope(PUBLIC_SCOPE)
+
+
+def benchmark(n_calls: int = 200, k: int = 3, fetch_k: int = 10) -> List[dict[str, float]]:
+    """
+    Measure the per-call setup time of the retriever with and without caching.
+
+    :param n_calls: The number of tool calls per variant. Defaults to 200.
+    :type n_calls: int
+    :param k: The number of documents to return per query. Defaults to 3.
+    :type k: int
+    :param fetch_k: The number of documents fetched before MMR reranking. Defaults to 10.
+    :type fetch_k: int
+
+    :return: The mean and p95 setup time in milliseconds of each variant.
+    :rtype: List[dict[str, float]]
+    """
+    stub_llm = lambda: FakeListLLM(responses=["What is attention?\nHow do transformers work?"])
+    openai_llm = lambda: OpenAI(temperature=0.2, openai_api_key="stub")
+    variants = {
+        "Per call, new OpenAI client": lambda vectordb: _build_per_call(vectordb, openai_llm, k, fetch_k),
+        "Per call, stub LLM": lambda vectordb: _build_per_call(vectordb, stub_llm, k, fetch_k),
+        "Cached": lambda vectordb: get_multi_query_retriever(vectordb, k, fetch_k, PUBLIC_SCOPE),
+    }
+
+    results = []
+    with tempfile.TemporaryDirectory() as persist_directory:
+        vectordb = LocalVectorStore(
+            "benchmark", persist_directory, DeterministicFakeEmbedding(size=64), engine="Flat"
+        )
+        vectordb.add_texts(
+            [f"Chunk {i} about attention." for i in range(100)],
+            metadatas=[{"scope": PUBLIC_SCOPE, "paper_id": str(i)} for i in range(100)],
+        )
+        _get_multi_query_retriever.cache_clear()
+        for name, build in variants.items():
+            timings = []
+            for _ in range(n_calls):
+                start = time.perf_counter()
+                build(vectordb)
+                timings.append(time.perf_counter() - start)
+            results.append(
+                {
+                    "variant": name,
+                    "mean_ms": 1000 * float(np.mean(timings)),
+                    "p95_ms": 1000 * float(np.percentile(timings, 95)),
+                }
+            )
+            logger_benchmark.info(
+                f"{name}: {results[-1]['mean_ms']:.3f}ms mean, "
+                f"{results[-1]['p95_ms']:.3f}ms p95 setup per call over {n_calls} calls"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    parser = argparse.ArgumentParser(description="Benchmark the per-call setup of the retriever.")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--fetch-k", type=int, default=10)
+    args = parser.parse_args()
+    benchmark(args.calls, args.k, args.fetch_k)
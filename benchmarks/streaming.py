@@ -0,0 +1,165 @@
+"""
+Time to first token of the agent with and without FinalAnswerStreamHandler.
+
+Usage: python -m benchmarks.streaming [--words 200] [--token-latency 0.02] [--tool-latency 0.5]
+"""
+
+from arxiv_bot.callbacks import FinalAnswerStreamHandler
+from arxiv_bot.prompts import FORMAT_INSTRUCTIONS, PREFIX, SUFFIX
+from langchain.agents import initialize_agent
+from langchain.memory import ConversationBufferWindowMemory
+from langchain.tools import Tool
+from langchain_core.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from typing import Any, Iterator, List, Optional, Union
+import argparse
+import asyncio
+import json
+import logging
+import re
+import time
+
+logger_benchmark = logging.getLogger("Benchmark")
+logger_benchmark.setLevel(logging.INFO)
+
+
+class StubStreamingChatModel(BaseChatModel):
+    """
+    Chat model replaying canned responses token by token, with a fixed latency per token.
+    """
+
+    responses: List[str]
+    token_latency: float = 0.02
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-streaming"
+
+    def _tokens(self) -> Iterator[str]:
+        text = self.responses[self.calls % len(self.responses)]
+        self.calls += 1
+        return iter(re.findall(r"\s*\S{1,4}|\s+$", text))
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = []
+        for token in self._tokens():
+            time.sleep(self.token_latency)
+            if run_manager:
+                run_manager.on_llm_new_token(token)
+            tokens.append(token)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = []
+        for token in self._tokens():
+            await asyncio.sleep(self.token_latency)
+            if run_manager:
+                await run_manager.on_llm_new_token(token)
+            tokens.append(token)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+
+def benchmark_streaming(
+    answer_words: int = 200,
+    token_latency: float = 0.02,
+    tool_latency: float = 0.5,
+) -> dict[str, Union[float, bool]]:
+    """
+    Measure the time to first token of the agent with and without FinalAnswerStreamHandler.
+
+    A stub chat model calls a stub Retriever tool once and then writes a final answer, with
+    a fixed latency per token. Without streaming, the first token of the answer is shown
+    when the whole agent loop is done.
+
+    :param answer_words: The number of words of the final answer. Defaults to 200.
+    :type answer_words: int
+    :param token_latency: The seconds between two tokens of the stub model. Defaults to 0.02.
+    :type token_latency: float
+    :param tool_latency: The seconds the stub tool takes. Defaults to 0.5.
+    :type tool_latency: float
+
+    :return: The total time, the time to first token with streaming, and whether the streamed answer matches the output of the agent.
+    :rtype: dict[str, Union[float, bool]]
+    """
+    answer = " ".join(f'word{i}{chr(10) if i % 25 == 24 else ""}' for i in range(answer_words))
+    answer += ' with "quotes", a \\ backslash and café'
+    responses = [
+        '```json\n{\n    "action": "Retriever",\n    "action_input": "stub query"\n}\n```',
+        "```json\n"
+        + json.dumps({"action": "Final Answer", "action_input": answer}, indent=4)
+        + "\n```",
+    ]
+
+    async def retrieve(query: str) -> str:
+        await asyncio.sleep(tool_latency)
+        return "Stub documents."
+
+    async def run() -> dict[str, Union[float, bool]]:
+        agent = initialize_agent(
+            [Tool(name="Retriever", func=lambda query: "Stub documents.", coroutine=retrieve, description="Stub retriever.")],
+            StubStreamingChatModel(responses=responses, token_latency=token_latency),
+            agent="chat-conversational-react-description",
+            agent_kwargs={
+                "system_message": PREFIX,
+                "human_message": SUFFIX,
+                "format_instructions": FORMAT_INSTRUCTIONS,
+            },
+            memory=ConversationBufferWindowMemory(
+                memory_key="chat_history",
+                input_key="input",
+                output_key="output",
+                return_messages=True,
+            ),
+            handle_parsing_errors=True,
+        )
+        pieces: List[str] = []
+
+        async def collect(text: str):
+            pieces.append(text)
+
+        handler = FinalAnswerStreamHandler(collect)
+        start = time.perf_counter()
+        response = await agent.acall({"input": "stub question"}, callbacks=[handler])
+        total = time.perf_counter() - start
+        return {
+            "total": total,
+            "time_to_first_token_without_streaming": total,
+            "time_to_first_token": handler.time_to_first_token or total,
+            "matches_output": "".join(pieces) == response["output"] == answer,
+        }
+
+    results = asyncio.run(run())
+    logger_benchmark.info(
+        f"Time to first token: {results['time_to_first_token']:.2f}s streamed, "
+        f"{results['time_to_first_token_without_streaming']:.2f}s without streaming; "
+        f"streamed answer matches the output: {results['matches_output']}"
+    )
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    parser = argparse.ArgumentParser(description="Benchmark the time to first token of the agent.")
+    parser.add_argument("--words", type=int, default=200)
+    parser.add_argument("--token-latency", type=float, default=0.02)
+    parser.add_argument("--tool-latency", type=float, default=0.5)
+    args = parser.parse_args()
+    benchmark_streaming(args.words, args.token_latency, args.tool_latency)
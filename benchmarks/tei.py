@@ -0,0 +1,109 @@
+"""
+Parse time and peak memory of the TEI readers.
+
+Usage: python -m benchmarks.tei output/*.tei.xml [--readers BeautifulSoup iterparse]
+"""
+
+from arxiv_bot.search import TEIFile, read_tei
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Literal, Tuple
+import argparse
+import logging
+import multiprocessing
+import resource
+import time
+
+logger_benchmark = logging.getLogger("Benchmark")
+logger_benchmark.setLevel(logging.INFO)
+
+
+def parse_tei_in_worker(
+    reader: Literal["BeautifulSoup", "iterparse"], tei_paths: List[str]
+) -> Tuple[float, int, int]:
+    """
+    Read TEI files in a fresh process, see benchmark_tei.
+
+    :param reader: The reader to use.
+    :type reader: Literal["BeautifulSoup", "iterparse"]
+    :param tei_paths: The paths to the TEI files.
+    :type tei_paths: List[str]
+
+    :return: The parse time in seconds, the peak RSS growth in KiB and the number of characters of text.
+    :rtype: Tuple[float, int, int]
+    """
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    n_chars = 0
+    for path in tei_paths:
+        if reader == "iterparse":
+            tei_object = TEIFile(path)
+            fields = [tei_object.title, tei_object.abstract, tei_object.text]
+        else:
+            soup = read_tei(path)
+            fields = [
+                soup.title.getText(),
+                soup.abstract.getText(separator=" ", strip=True),
+                "\n\n".join(
+                    div.getText(separator=": ", strip=True).replace("\n", "")
+                    for div in soup.body.find_all("div")
+                    if not div.get("type")
+                ),
+            ]
+        n_chars += sum(len(field) for field in fields)
+    seconds = time.perf_counter() - start
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    return seconds, rss_growth, n_chars
+
+
+def benchmark_tei(
+    tei_paths: List[str],
+    readers: List[Literal["BeautifulSoup", "iterparse"]] = [
+        "BeautifulSoup",
+        "iterparse",
+    ],
+) -> List[dict[str, float]]:
+    """
+    Measure the parse time and peak memory of reading a corpus of TEI files.
+
+    Each reader runs in its own freshly spawned process, so the peak RSS growth of one
+    does not hide the other's.
+
+    :param tei_paths: The paths to the TEI files, e.g. the GROBID output of real papers.
+    :type tei_paths: List[str]
+    :param readers: The readers to measure. "BeautifulSoup": read_tei, the previous soup-based reader. "iterparse": TEIFile. Defaults to both.
+    :type readers: List[Literal["BeautifulSoup", "iterparse"]]
+
+    :return: The seconds, milliseconds per file and peak RSS growth in MiB of each reader.
+    :rtype: List[dict[str, float]]
+    """
+    results = []
+    for reader in readers:
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            seconds, rss_growth, n_chars = pool.submit(
+                parse_tei_in_worker, reader, tei_paths
+            ).result()
+        results.append(
+            {
+                "reader": reader,
+                "seconds": seconds,
+                "ms_per_file": 1000 * seconds / max(len(tei_paths), 1),
+                "peak_rss_growth_mb": rss_growth / 1024,
+                "chars": n_chars,
+            }
+        )
+        logger_benchmark.info(
+            f"TEI {reader}: {len(tei_paths)} files in {seconds:.2f}s "
+            f"({results[-1]['ms_per_file']:.1f} ms/file), peak RSS +{results[-1]['peak_rss_growth_mb']:.1f} MiB"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    parser = argparse.ArgumentParser(description="Benchmark the TEI readers on GROBID output.")
+    parser.add_argument("tei_paths", nargs="+")
+    parser.add_argument("--readers", nargs="+", default=["BeautifulSoup", "iterparse"])
+    args = parser.parse_args()
+    benchmark_tei(args.tei_paths, args.readers)
@@ -0,0 +1,125 @@
+"""
+Recall@k and latency of a local vector store against brute-force search.
+
+Usage: python -m benchmarks.vector_search <persist_directory> <collection_name> [--engine HNSW] [--ef 16 32 64 128 256]
+
+The persist directory is the one of an indexed LocalVectorStore, e.g.
+``./vectordb/hnsw/text-embedding-3-small``. Queries are stored vectors with a small
+perturbation, so no embedding API calls are made.
+"""
+
+from arxiv_bot.vectorstores import LocalVectorStore
+from typing import List
+import argparse
+import logging
+import numpy as np
+import os
+import time
+
+logger_benchmark = logging.getLogger("Benchmark")
+logger_benchmark.setLevel(logging.INFO)
+
+
+def benchmark(
+    store: LocalVectorStore,
+    n_queries: int = 100,
+    k: int = 10,
+    ef_values: List[int] = [16, 32, 64, 128, 256],
+    seed: int = 0,
+) -> List[dict[str, float]]:
+    """
+    Measure recall@k and latency of a store against brute-force search on the same embeddings.
+
+    :param store: The store to benchmark.
+    :type store: LocalVectorStore
+    :param n_queries: The number of queries. Defaults to 100.
+    :type n_queries: int
+    :param k: The number of neighbours per query. Defaults to 10.
+    :type k: int
+    :param ef_values: The ef values to measure. Defaults to [16, 32, 64, 128, 256].
+    :type ef_values: List[int]
+    :param seed: The random seed. Defaults to 0.
+    :type seed: int
+
+    :return: The recall@k, mean and p95 latency in milliseconds of each ef value, and of brute force.
+    :rtype: List[dict[str, float]]
+    """
+    assert store._index is not None, "The store is empty."
+    labels = [label for (label,) in store._conn.execute("SELECT label FROM documents")]
+    vectors = store._index.vectors(labels)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)]
+    queries = queries + rng.normal(0, 0.01, queries.shape).astype(np.float32)
+
+    exact = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        top = np.argsort(-(vectors @ query))[:k]
+        latencies.append(time.perf_counter() - start)
+        exact.append({labels[i] for i in top})
+    results = [
+        {
+            "ef": 0,
+            "recall": 1.0,
+            "mean_ms": 1000 * float(np.mean(latencies)),
+            "p95_ms": 1000 * float(np.percentile(latencies, 95)),
+        }
+    ]
+
+    original_ef = store.ef
+    for ef in ef_values if store.engine == "HNSW" else [original_ef]:
+        store.set_ef(ef)
+        hits = 0
+        latencies = []
+        for query, truth in zip(queries, exact):
+            start = time.perf_counter()
+            found = store._search(query.tolist(), k, None)
+            latencies.append(time.perf_counter() - start)
+            hits += len(truth & {label for label, _ in found})
+        results.append(
+            {
+                "ef": ef,
+                "recall": hits / (len(queries) * k),
+                "mean_ms": 1000 * float(np.mean(latencies)),
+                "p95_ms": 1000 * float(np.percentile(latencies, 95)),
+            }
+        )
+    store.set_ef(original_ef)
+
+    for result in results:
+        if result["ef"] == 0:
+            name = "brute force"
+        elif store.engine == "HNSW":
+            name = f"HNSW ef={result['ef']}"
+        else:
+            name = store.engine
+        logger_benchmark.info(
+            f"{name}: "
+            f"recall@{k}={result['recall']:.3f}, mean={result['mean_ms']:.2f}ms, p95={result['p95_ms']:.2f}ms"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    from arxiv_bot.functions import load_embeddings
+
+    logging.basicConfig()
+    parser = argparse.ArgumentParser(description="Benchmark a local vector store against brute force.")
+    parser.add_argument("persist_directory")
+    parser.add_argument("collection_name")
+    parser.add_argument("--engine", choices=["HNSW", "Flat"], default="HNSW")
+    parser.add_argument("--embedding-model", default=os.environ.get("INIT_EMBEDDING", "text-embedding-3-small"))
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    args = parser.parse_args()
+    store = LocalVectorStore(
+        args.collection_name,
+        args.persist_directory,
+        load_embeddings(args.embedding_model),
+        engine=args.engine,
+    )
+    benchmark(store, args.queries, args.k, args.ef)
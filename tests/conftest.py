@@ -0,0 +1,53 @@
+from langchain_core.embeddings import Embeddings
+from typing import List
+import hashlib
+import os
+import pytest
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the caches and indexes created by the tests out of the working directory.
+os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="arxiv_bot_tests_")
+# arxiv_bot.search builds its Google search client on import; no test calls an API.
+for key in ("GOOGLE_API_KEY", "GOOGLE_CSE_ID", "OPENAI_API_KEY"):
+    os.environ.setdefault(key, "test")
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic embeddings derived from a hash of each text, counting the texts embedded.
+
+    Texts containing ``fail_on`` raise a ValueError, as a rejected embedding request would.
+    """
+
+    def __init__(self, dim: int = 16, fail_on: str = ""):
+        self.dim = dim
+        self.fail_on = fail_on
+        self.calls: List[List[str]] = []
+
+    def _embed(self, text: str) -> List[float]:
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [digest[i % len(digest)] / 255 - 0.5 for i in range(self.dim)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.fail_on and any(self.fail_on in text for text in texts):
+            raise ValueError("Rejected by the embedding API")
+        self.calls.append(list(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+@pytest.fixture
+def embeddings():
+    return FakeEmbeddings()
+
+
+@pytest.fixture
+def vectordb(tmp_path, embeddings):
+    from arxiv_bot.vectorstores import LocalVectorStore
+
+    return LocalVectorStore("arxiv", str(tmp_path / "vdb"), embeddings, engine="Flat")
@@ -0,0 +1,116 @@
+from arxiv_bot.cache import CachedEmbeddings, SemanticQueryCache, TTLCache
+from types import SimpleNamespace
+import asyncio
+import numpy as np
+import time
+
+
+def test_cached_embeddings_counts_hits_and_misses(tmp_path, embeddings):
+    cached = CachedEmbeddings(embeddings, "model", path=str(tmp_path / "embeddings.sqlite"))
+
+    vectors = cached.embed_documents(["a", "b", "a"])
+    assert embeddings.calls == [["a", "b"]]
+    assert cached.stats == {"hits": 1, "misses": 2}
+    assert vectors[0] == vectors[2]
+    np.testing.assert_allclose(vectors[1], embeddings.embed_query("b"), atol=1e-6)
+
+    np.testing.assert_allclose(cached.embed_documents(["b", "a"]), vectors[1::-1])
+    np.testing.assert_allclose(
+        asyncio.run(cached.aembed_query("c")), embeddings.embed_query("c"), atol=1e-6
+    )
+    assert embeddings.calls == [["a", "b"], ["c"]]
+    assert cached.stats == {"hits": 3, "misses": 3}
+
+
+def test_cached_embeddings_are_keyed_by_model_and_text(tmp_path, embeddings):
+    path = str(tmp_path / "embeddings.sqlite")
+    CachedEmbeddings(embeddings, "small", path=path).embed_documents(["a"])
+
+    large = CachedEmbeddings(embeddings, "large", path=path)
+    large.embed_documents(["a", "a "])
+    assert large.stats == {"hits": 0, "misses": 2}
+    assert embeddings.calls == [["a"], ["a", "a "]]
+
+
+def test_cached_embeddings_evict_least_recently_used(tmp_path, embeddings):
+    cached = CachedEmbeddings(
+        embeddings, "model", path=str(tmp_path / "embeddings.sqlite"), max_entries=2
+    )
+    cached.embed_documents(["a", "b"])
+    time.sleep(0.01)
+    cached.embed_documents(["a"])  # "b" is now the least recently used.
+    time.sleep(0.01)
+    cached.embed_documents(["c"])
+
+    embeddings.calls.clear()
+    cached.embed_documents(["a", "b", "c"])
+    assert embeddings.calls == [["b"]]
+
+
+def test_cached_embeddings_survive_reopening(tmp_path, embeddings):
+    path = str(tmp_path / "embeddings.sqlite")
+    vectors = CachedEmbeddings(embeddings, "model", path=path).embed_documents(["a", "b"])
+
+    reopened = CachedEmbeddings(embeddings, "model", path=path)
+    np.testing.assert_allclose(reopened.embed_documents(["a", "b"]), vectors)
+    assert reopened.stats == {"hits": 2, "misses": 0}
+    assert embeddings.calls == [["a", "b"]]
+
+
+def test_ttl_cache_expires_entries_per_namespace(tmp_path, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr("arxiv_bot.cache.time", SimpleNamespace(time=lambda: now[0]))
+    cache = TTLCache(path=str(tmp_path / "lookups.sqlite"), ttls={"search": 60})
+    cache.put("search", "query", ["2401.00001"])
+    cache.put_many("arxiv", {"2401.00001": {"title": "Paper"}})
+
+    now[0] += 59
+    assert cache.get("search", "query") == ["2401.00001"]
+    now[0] += 2
+    assert cache.get("search", "query") is None
+    # Namespaces without a TTL never expire, and survive reopening the database.
+    reopened = TTLCache(path=cache.path, ttls={"search": 60})
+    assert reopened.get_many("arxiv", ["2401.00001", "2401.00002"]) == {"2401.00001": {"title": "Paper"}}
+    assert cache.stats == {"hits": 1, "misses": 1}
+    assert reopened.stats == {"hits": 1, "misses": 1}
+
+
+def test_semantic_query_cache_threshold(embeddings):
+    cache = SemanticQueryCache(threshold=0.95)
+    query = np.array(embeddings.embed_query("attention"))
+    cache.put(query, "public", ["c1", "c2"])
+
+    assert cache.get(query * 3, "public") == ["c1", "c2"]
+    similar = query + 0.01 * np.array(embeddings.embed_query("noise"))
+    assert cache.get(similar, "public") == ["c1", "c2"]
+    assert cache.get(embeddings.embed_query("transformers"), "public") is None
+    assert cache.get(query, "session") is None
+    assert cache.stats("public") == {"hits": 2, "misses": 1, "hit_rate": 2 / 3}
+    assert cache.stats() == {"hits": 2, "misses": 2, "hit_rate": 0.5}
+
+
+def test_semantic_query_cache_evicts_least_recently_used(embeddings):
+    cache = SemanticQueryCache(max_entries=2)
+    for text in ["a", "b"]:
+        cache.put(embeddings.embed_query(text), "public", [text])
+    cache.get(embeddings.embed_query("a"), "public")
+    cache.put(embeddings.embed_query("c"), "public", ["c"])
+
+    assert cache.get(embeddings.embed_query("a"), "public") == ["a"]
+    assert cache.get(embeddings.embed_query("b"), "public") is None
+    assert cache.get(embeddings.embed_query("c"), "public") == ["c"]
+
+
+def test_semantic_query_cache_drops_writes_of_an_older_generation(embeddings):
+    cache = SemanticQueryCache()
+    query = embeddings.embed_query("attention")
+    cache.put(query, "public", ["c1"])
+
+    generation = cache.generation
+    cache.invalidate()
+    assert cache.get(query, "public") is None
+    # Results retrieved before the invalidation may refer to deleted chunks.
+    cache.put(query, "public", ["c1"], generation=generation)
+    assert cache.get(query, "public") is None
+    cache.put(query, "public", ["c2"], generation=cache.generation)
+    assert cache.get(query, "public") == ["c2"]
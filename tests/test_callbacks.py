@@ -0,0 +1,68 @@
+from arxiv_bot.callbacks import FinalAnswerParser, FinalAnswerStreamHandler
+from uuid import uuid4
+import asyncio
+import json
+import random
+import pytest
+
+ANSWERS = [
+    "Plain answer.",
+    'Quotes "inside", a \\ backslash,\na newline and a\ttab.',
+    "Unicode: café, ∑, and an emoji 😀 outside the BMP.",
+    "",
+]
+
+
+def _blob(action, action_input, ensure_ascii=True):
+    blob = json.dumps({"action": action, "action_input": action_input}, indent=4, ensure_ascii=ensure_ascii)
+    return f"```json\n{blob}\n```"
+
+
+def _split(text, rng):
+    cuts = sorted(rng.sample(range(1, len(text)), min(len(text) - 1, rng.randint(1, 40))))
+    return [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+
+
+@pytest.mark.parametrize("answer", ANSWERS)
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_parser_decodes_across_token_boundaries(answer, ensure_ascii):
+    blob = _blob("Final Answer", answer, ensure_ascii)
+    rng = random.Random(0)
+    for _ in range(50):
+        parser = FinalAnswerParser()
+        assert "".join(parser.feed(token) for token in _split(blob, rng)) == answer
+
+
+def test_parser_single_characters():
+    answer = ANSWERS[2]
+    parser = FinalAnswerParser()
+    assert "".join(parser.feed(char) for char in _blob("Final Answer", answer)) == answer
+
+
+def test_parser_ignores_tool_calls():
+    parser = FinalAnswerParser()
+    blob = _blob("Retriever", "attention mechanisms")
+    assert "".join(parser.feed(char) for char in blob) == ""
+    assert parser.state == "done"
+
+
+def test_stream_handler_streams_only_final_answers():
+    pieces = []
+
+    async def stream(text):
+        pieces.append(text)
+
+    async def run():
+        handler = FinalAnswerStreamHandler(stream)
+        for blob in [_blob("Retriever", "query"), _blob("Final Answer", "The answer.")]:
+            run_id = uuid4()
+            await handler.on_chat_model_start({}, [[]], run_id=run_id)
+            for token in _split(blob, random.Random(1)):
+                await handler.on_llm_new_token(token, run_id=run_id)
+            await handler.on_llm_end(None, run_id=run_id)
+        return handler
+
+    handler = asyncio.run(run())
+    assert "".join(pieces) == "The answer."
+    assert handler.streamed
+    assert handler.time_to_first_token is not None
@@ -0,0 +1,90 @@
+from arxiv_bot.context import CONTEXT_METADATA, ContextPacker
+from arxiv_bot.ingest import count_tokens
+from langchain.schema.document import Document
+import pytest
+
+
+def _doc(paper_id, index, text, **metadata):
+    return Document(
+        page_content=text,
+        metadata={
+            "paper_id": paper_id,
+            "title": f"Paper {paper_id}",
+            "chunk_id": f"{paper_id}-{index}-{'0' * 16}",
+            "abstract": "A long abstract repeated on every chunk. " * 20,
+            **metadata,
+        },
+    )
+
+
+def _docs():
+    return [
+        _doc(f"p{i}", 0, f"Chunk {i}: " + "lorem ipsum dolor sit amet " * (10 + 5 * i))
+        for i in range(8)
+    ]
+
+
+@pytest.mark.parametrize("max_tokens", [200, 500, 1000, 5000])
+def test_pack_fits_budget(max_tokens):
+    packer = ContextPacker(max_tokens)
+    packed = packer.pack(_docs())
+    assert packed
+    assert sum(count_tokens([str(doc) for doc in packed])) <= max_tokens
+    assert packer.turn["tokens_out"] <= max_tokens
+    assert packer.turn["documents_out"] == len(packed)
+
+
+def test_pack_keeps_relevance_order_and_metadata():
+    packed = ContextPacker(5000).pack(_docs())
+    assert [doc.metadata["paper_id"] for doc in packed] == [f"p{i}" for i in range(8)]
+    for doc in packed:
+        assert set(doc.metadata) <= set(CONTEXT_METADATA)
+
+
+def test_pack_truncates_top_document_over_budget():
+    doc = _doc("p0", 0, "word " * 2000)
+    packer = ContextPacker(100)
+    packed = packer.pack([doc])
+    assert len(packed) == 1
+    assert doc.page_content.startswith(packed[0].page_content)
+    assert packer.turn["tokens_out"] <= 100
+
+
+def test_pack_dedupes_and_merges():
+    first = _doc("p0", 0, "The first chunk of the paper ends with this shared overlap text.")
+    second = _doc("p0", 1, "this shared overlap text. The second chunk continues here.")
+    packer = ContextPacker(5000)
+    packed = packer.pack([first, Document(page_content=first.page_content, metadata=first.metadata), second])
+    assert len(packed) == 1
+    assert packed[0].page_content == (
+        "The first chunk of the paper ends with this shared overlap text. The second chunk continues here."
+    )
+    assert packer.turn["duplicates"] == 1
+    assert packer.turn["merged"] == 1
+
+
+def test_end_turn_resets():
+    packer = ContextPacker(500)
+    packer.pack(_docs())
+    turn = packer.end_turn()
+    assert turn["calls"] == 1
+    assert turn["tokens_saved"] == turn["tokens_in"] - turn["tokens_out"]
+    assert packer.turn["calls"] == 0
+    assert packer.totals["calls"] == 1
+
+
+def test_pack_keeps_date():
+    packed = ContextPacker(5000).pack([_doc("p0", 0, "Some text.", date="2024-01-31", authors="A. Author")])
+    assert packed[0].metadata["date"] == "2024-01-31"
+    assert "abstract" not in packed[0].metadata
+
+
+def test_pack_reports_savings_by_cause():
+    packer = ContextPacker(500)
+    docs = _docs()
+    packer.pack(docs + [Document(page_content=docs[0].page_content, metadata=docs[0].metadata)])
+    turn = packer.end_turn()
+    assert turn["tokens_deduped"] > 0
+    assert turn["tokens_trimmed"] > 0
+    assert turn["tokens_over_budget"] > 0
+    assert turn["tokens_deduped"] + turn["tokens_trimmed"] + turn["tokens_over_budget"] == turn["tokens_saved"]
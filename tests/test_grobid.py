@@ -0,0 +1,76 @@
+from arxiv_bot.grobid import GrobidService
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import pytest
+
+TEI = b'<TEI xmlns="http://www.tei-c.org/ns/1.0"><text><body/></text></TEI>'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        with server.lock:  # type: ignore
+            server.calls += 1  # type: ignore
+            status = server.statuses.pop(0) if server.statuses else 200  # type: ignore
+        body = TEI if status == 200 else b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.lock = threading.Lock()  # type: ignore
+    server.calls = 0  # type: ignore
+    server.statuses = []  # type: ignore
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / "paper.pdf"
+    path.write_bytes(b"%PDF-1.4\n")
+    return str(path)
+
+
+def _client(server, retries=5):
+    return GrobidService(f"http://127.0.0.1:{server.server_address[1]}", retries=retries, backoff=0.01)
+
+
+def test_retries_busy_server(server, pdf):
+    server.statuses = [503, 503]
+    assert _client(server).process("processFulltextDocument", pdf) == (200, TEI)
+    assert server.calls == 3
+
+
+def test_gives_up_after_retries(server, pdf):
+    server.statuses = [503] * 10
+    assert _client(server, retries=2).process("processFulltextDocument", pdf) == (503, None)
+    assert server.calls == 3
+
+
+def test_does_not_retry_client_errors(server, pdf):
+    server.statuses = [400]
+    assert _client(server).process("processFulltextDocument", pdf) == (400, None)
+    assert server.calls == 1
+
+
+def test_process_batch_keeps_order(server, tmp_path):
+    paths = []
+    for i in range(6):
+        path = tmp_path / f"paper{i}.pdf"
+        path.write_bytes(b"%PDF-1.4\n")
+        paths.append(str(path))
+    server.statuses = [503, 503, 503]
+    results = _client(server).process_batch("processFulltextDocument", paths)
+    assert [path for path, _, _ in results] == paths
+    assert all(status == 200 and tei == TEI for _, status, tei in results)
@@ -0,0 +1,152 @@
+from arxiv_bot.ingest import EmbeddingWriter, count_tokens
+from langchain.schema.document import Document
+import asyncio
+import httpx
+import openai
+import pytest
+import threading
+import time
+
+
+class RecordingStore:
+    """Vector store stub recording the batches written and the batches in flight."""
+
+    def __init__(self, latency=0.0, errors=None):
+        self.latency = latency
+        # Errors raised, in turn, by the attempts to write a batch containing a given chunk ID.
+        self.errors = errors or {}
+        self.attempts = []
+        self.written = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _attempt(self, ids):
+        with self._lock:
+            self.attempts.append(ids)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return [error for id in ids for error in self.errors.get(id, [])[:1]]
+
+    def _done(self, ids, raised):
+        with self._lock:
+            self.in_flight -= 1
+            if raised:
+                for id in ids:
+                    if self.errors.get(id):
+                        self.errors[id].pop(0)
+            else:
+                self.written.append(ids)
+
+    def add_documents(self, docs, ids):
+        raised = self._attempt(ids)
+        if self.latency:
+            time.sleep(self.latency)
+        self._done(ids, raised)
+        if raised:
+            raise raised[0]
+
+    async def aadd_documents(self, docs, ids):
+        raised = self._attempt(ids)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self._done(ids, raised)
+        if raised:
+            raise raised[0]
+
+
+def _docs(n, words=20):
+    return [
+        Document(page_content=" ".join(["token"] * words) + f" {i}", metadata={"chunk_id": f"c{i}"})
+        for i in range(n)
+    ]
+
+
+def _rate_limit(retry_after):
+    response = httpx.Response(
+        429,
+        headers={"retry-after": str(retry_after)},
+        request=httpx.Request("POST", "https://api.openai.com/v1/embeddings"),
+    )
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def _write(writer, docs, use_async):
+    if use_async:
+        return asyncio.run(writer.awrite(docs))
+    return writer.write(docs)
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_batches_stay_within_the_token_budget(use_async):
+    docs = _docs(40)
+    tokens = count_tokens([doc.page_content for doc in docs])
+    store = RecordingStore()
+    writer = EmbeddingWriter(store, max_batch_tokens=5 * max(tokens), max_concurrency=1)
+
+    assert _write(writer, docs, use_async) == []
+    assert [id for batch in store.written for id in batch] == [doc.metadata["chunk_id"] for doc in docs]
+    sizes = {doc.metadata["chunk_id"]: n for doc, n in zip(docs, tokens)}
+    assert all(sum(sizes[id] for id in batch) <= writer.max_batch_tokens for batch in store.written)
+    assert len(store.written) == writer.stats["batches"] == 8
+    assert writer.stats["tokens"] == sum(tokens)
+
+
+def test_oversized_document_gets_its_own_batch():
+    docs = _docs(3)
+    docs[1].page_content *= 50
+    store = RecordingStore()
+    writer = EmbeddingWriter(store, max_batch_tokens=count_tokens([docs[0].page_content])[0] * 2)
+
+    assert writer.write(docs) == []
+    assert sorted(store.written) == [["c0"], ["c1"], ["c2"]]
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_concurrency_is_bounded(use_async):
+    store = RecordingStore(latency=0.05)
+    writer = EmbeddingWriter(store, max_batch_tokens=1, max_concurrency=3)
+
+    assert _write(writer, _docs(12), use_async) == []
+    assert len(store.written) == 12
+    assert store.max_in_flight == 3
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_only_the_rate_limited_batch_is_retried(use_async, monkeypatch):
+    delays = []
+
+    async def asleep(seconds):
+        delays.append(seconds)
+
+    monkeypatch.setattr("arxiv_bot.ingest.time.sleep", delays.append)
+    monkeypatch.setattr("arxiv_bot.ingest.asyncio.sleep", asleep)
+    store = RecordingStore(errors={"c2": [_rate_limit(7)]})
+    writer = EmbeddingWriter(store, max_batch_tokens=1, max_concurrency=2, backoff=100)
+
+    assert _write(writer, _docs(4), use_async) == []
+    assert sorted(store.attempts) == [["c0"], ["c1"], ["c2"], ["c2"], ["c3"]]
+    assert sorted(store.written) == [["c0"], ["c1"], ["c2"], ["c3"]]
+    assert delays == [7.0]
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_failed_batches_are_returned(use_async, monkeypatch):
+    async def asleep(seconds):
+        pass
+
+    monkeypatch.setattr("arxiv_bot.ingest.time.sleep", lambda seconds: None)
+    monkeypatch.setattr("arxiv_bot.ingest.asyncio.sleep", asleep)
+    docs = _docs(6)
+    store = RecordingStore(errors={"c1": [ValueError("Invalid input")], "c4": [_rate_limit(0)] * 3})
+    tokens = count_tokens([doc.page_content for doc in docs])
+    writer = EmbeddingWriter(store, max_batch_tokens=2 * max(tokens), retries=2)
+
+    failed = _write(writer, docs, use_async)
+
+    # A bad request is not retried, a rate limit is retried until the retries run out.
+    assert [doc.metadata["chunk_id"] for doc in failed] == ["c0", "c1", "c4", "c5"]
+    assert store.attempts.count(["c0", "c1"]) == 1
+    assert store.attempts.count(["c4", "c5"]) == 3
+    assert store.written == [["c2", "c3"]]
+    assert writer.stats["failed"] == 4
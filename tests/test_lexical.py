@@ -0,0 +1,68 @@
+from arxiv_bot.lexical import BM25Index, reciprocal_rank_fusion
+from langchain.schema.document import Document
+import pytest
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]], k=60)
+    assert [key for key, _ in fused] == ["b", "a", "d", "c"]
+    scores = dict(fused)
+    assert scores["b"] == pytest.approx(1 / 62 + 1 / 61)
+    assert scores["a"] == pytest.approx(1 / 61)
+
+
+def test_reciprocal_rank_fusion_ties_keep_first_appearance():
+    fused = reciprocal_rank_fusion([["a", "b"], ["b", "a"]])
+    assert [key for key, _ in fused] == ["a", "b"]
+
+
+def _chunk(chunk_id, text, scope="public"):
+    return Document(page_content=text, metadata={"chunk_id": chunk_id, "scope": scope})
+
+
+@pytest.fixture
+def index(tmp_path):
+    return BM25Index(str(tmp_path / "bm25.sqlite"))
+
+
+def test_bm25_add_search_delete(index):
+    index.add(
+        [
+            _chunk("c1", "transformers use self attention"),
+            _chunk("c2", "convolutional networks for images"),
+            _chunk("c3", "attention is all you need, attention everywhere"),
+        ]
+    )
+    assert len(index) == 3
+    assert [chunk_id for chunk_id, _ in index.search("attention")] == ["c3", "c1"]
+
+    # Adding a chunk twice does not index it twice.
+    index.add([_chunk("c1", "transformers use self attention")])
+    assert len(index) == 3
+
+    index.delete(["c3", "unknown"])
+    assert len(index) == 2
+    assert [chunk_id for chunk_id, _ in index.search("attention")] == ["c1"]
+    assert index.search("need") == []
+
+
+def test_bm25_scopes(index):
+    index.add([_chunk("p", "graph neural networks"), _chunk("s", "graph databases", scope="session")])
+    assert [chunk_id for chunk_id, _ in index.search("graph", scopes=["public"])] == ["p"]
+    assert {chunk_id for chunk_id, _ in index.search("graph", scopes=["public", "session"])} == {"p", "s"}
+    assert index.search("graph", scopes=["other"]) == []
+
+
+def test_bm25_reopen(tmp_path):
+    path = str(tmp_path / "bm25.sqlite")
+    index = BM25Index(path)
+    index.add([_chunk("c1", "sparse retrieval"), _chunk("c2", "dense retrieval")])
+    index.search("retrieval")  # Caches the posting list.
+    index.delete(["c1"])
+    index.add([_chunk("c3", "hybrid retrieval")])
+    expected = index.search("retrieval")
+
+    reopened = BM25Index(path)
+    assert len(reopened) == 2
+    assert reopened.search("retrieval") == pytest.approx(expected)
+
@@ -0,0 +1,75 @@
+from arxiv_bot.parents import ParentStore, build_parents, join_chunks, overlap_length
+from arxiv_bot.search import chunk_sections, get_text_splitter
+from langchain.schema.document import Document
+
+
+def _chunks(chunk_size=200, chunk_overlap=60):
+    sections = [
+        ("1 Introduction", [" ".join(f"Introduction sentence number {i}." for i in range(40))]),
+        ("2 Method", [" ".join(f"Method sentence number {i}." for i in range(25))]),
+        ("3 Results", ["A single short paragraph."]),
+    ]
+    text_splitter = get_text_splitter(chunk_size, 0, segmenter="Regex")
+    return [
+        Document(page_content=text, metadata={"section": section, "chunk_id": f"c{i}"})
+        for i, (section, text) in enumerate(
+            chunk_sections(text_splitter, sections, chunk_size, chunk_overlap)
+        )
+    ]
+
+
+def test_overlap_length_and_join_chunks():
+    assert overlap_length("The first chunk ends with this sentence.", "ends with this sentence. And goes on.", 100) == 24
+    assert overlap_length("The first chunk ends here.", "The second one starts there.", 100) == 0
+    # Short matches are a coincidence rather than an overlap.
+    assert overlap_length("ends with the", "the start", 100) == 0
+    texts = ["The first chunk ends with this sentence.", "ends with this sentence. And goes on.", "Unrelated."]
+    assert join_chunks(texts, 100) == "The first chunk ends with this sentence. And goes on.\n\nUnrelated."
+
+
+def test_parent_spans_contain_their_chunks():
+    docs = _chunks()
+    parents = build_parents(docs, max_chars=600, max_overlap=120)
+    by_id = {doc.metadata["chunk_id"]: doc for doc in docs}
+
+    # Every chunk belongs to exactly one span, and spans keep the document order.
+    assert [id for _, _, chunk_ids in parents for id in chunk_ids] == list(by_id)
+    assert len(parents) < len(docs)
+    for parent_id, content, chunk_ids in parents:
+        sections = {by_id[id].metadata["section"] for id in chunk_ids}
+        assert len(sections) == 1
+        prefix = f"{sections.pop()}\n"
+        if by_id[chunk_ids[0]].page_content.startswith(prefix):
+            # The heading the chunks of a section start with is kept once.
+            assert content.count(prefix) == 1
+        for id in chunk_ids:
+            text = by_id[id].page_content
+            assert (text[len(prefix) :] if text.startswith(prefix) else text) in content
+        if len(chunk_ids) > 1:
+            assert sum(len(by_id[id].page_content) for id in chunk_ids) <= 600
+            # The overlaps between consecutive chunks are only kept once.
+            assert len(content) < sum(len(by_id[id].page_content) for id in chunk_ids)
+    # The ID of a span only depends on its chunks.
+    assert build_parents(docs, max_chars=600, max_overlap=120) == parents
+
+
+def test_parent_store(tmp_path):
+    path = str(tmp_path / "parents.sqlite")
+    store = ParentStore(path)
+    store.add([("p1", "Span one.", ["c1", "c2"]), ("p2", "Span two.", ["c3"])])
+
+    assert store.get(["c1", "c3", "c9"]) == {"c1": ("p1", "Span one."), "c3": ("p2", "Span two.")}
+    # A re-chunked paper maps its chunks to the new span, and the old span goes once it has no chunks left.
+    store.add([("p3", "Span three.", ["c3", "c4"])])
+    assert store.get(["c3"]) == {"c3": ("p3", "Span three.")}
+    store.delete(["c1"])
+    assert store.get(["c1", "c2"]) == {"c2": ("p1", "Span one.")}
+    store.delete(["c2"])
+
+    reopened = ParentStore(path)
+    assert reopened.get(["c1", "c2", "c3", "c4"]) == {
+        "c3": ("p3", "Span three."),
+        "c4": ("p3", "Span three."),
+    }
+    (count,) = reopened._conn.execute("SELECT COUNT(*) FROM parents").fetchone()
+    assert count == 1
@@ -0,0 +1,38 @@
+from arxiv_bot.parents import ParentStore
+from arxiv_bot.retrievers import ParallelMultiQueryRetriever
+from langchain.schema.document import Document
+from langchain_community.llms.fake import FakeListLLM
+
+
+def _retriever(vectordb, parent_store):
+    return ParallelMultiQueryRetriever.from_llm(
+        vectordb=vectordb, llm=FakeListLLM(responses=["A query"]), parent_store=parent_store
+    )
+
+
+def _doc(chunk_id, title="Paper"):
+    return Document(page_content=f"Chunk {chunk_id}.", metadata={"chunk_id": chunk_id, "title": title})
+
+
+def test_expand_replaces_chunks_by_spans_in_rank_order(tmp_path, vectordb):
+    store = ParentStore(str(tmp_path / "parents.sqlite"))
+    store.add([("p1", "Span one.", ["c1", "c2"]), ("p2", "Span two.", ["c3", "c4"])])
+    unmapped = _doc("c9")
+    without_id = Document(page_content="No chunk ID.", metadata={"title": "Paper"})
+    documents = [_doc("c3", "Best"), _doc("c1"), unmapped, _doc("c4"), without_id, _doc("c2")]
+
+    expanded = _retriever(vectordb, store)._expand(documents)
+
+    # Each span takes the rank and metadata of its best chunk and appears once.
+    assert [doc.page_content for doc in expanded] == ["Span two.", "Span one.", "Chunk c9.", "No chunk ID."]
+    assert expanded[0].metadata == {"chunk_id": "c3", "title": "Best", "parent_id": "p2"}
+    assert expanded[1].metadata == {"chunk_id": "c1", "title": "Paper", "parent_id": "p1"}
+    assert expanded[2] is unmapped and expanded[3] is without_id
+
+
+def test_expand_passes_chunks_without_spans_through(tmp_path, vectordb):
+    documents = [_doc("c1"), _doc("c2")]
+    assert _retriever(vectordb, None)._expand(documents) == documents
+    empty = ParentStore(str(tmp_path / "parents.sqlite"))
+    assert _retriever(vectordb, empty)._expand(documents) == documents
+    assert _retriever(vectordb, empty)._expand([]) == []
@@ -0,0 +1,524 @@
+from arxiv_bot.cache import SemanticQueryCache, TTLCache
+from arxiv_bot.search import (
+    IndexNewArxivPapers,
+    MetadataResolver,
+    ProcessPDF,
+    TEIFile,
+    chunk_sections,
+    fetch_arxiv_metadata,
+    get_text_splitter,
+    read_tei,
+    tei_metadata,
+)
+from datetime import datetime
+from types import SimpleNamespace
+import asyncio
+import fitz
+import os
+import random
+import pytest
+import time
+
+WORDS = "the model attends to every token of the input sequence with learned weights".split()
+
+
+def _sentence(rng, n_words):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + "."
+
+
+def _sections(seed):
+    rng = random.Random(seed)
+    sections = [("1 Introduction", []), ("1.1 " + "Very long heading " * 40, [])]
+    for i in range(6):
+        blocks = [
+            " ".join(_sentence(rng, rng.randint(3, 40)) for _ in range(rng.randint(1, 12)))
+            for _ in range(rng.randint(1, 5))
+        ]
+        blocks.append("Figure 1: " + _sentence(rng, rng.randint(5, 150)))
+        blocks.append("x" * rng.randint(0, 1500))  # A formula or table without spaces.
+        sections.append((f"{i + 2} Section", [block for block in blocks if block]))
+    return sections
+
+
+@pytest.mark.parametrize("chunk_size", [128, 256, 1024])
+@pytest.mark.parametrize("seed", range(5))
+def test_chunk_sections_never_exceed_chunk_size(chunk_size, seed):
+    text_splitter = get_text_splitter(chunk_size, 0, segmenter="Regex")
+    chunks = list(chunk_sections(text_splitter, _sections(seed), chunk_size, chunk_size // 10))
+    assert chunks
+    assert max(len(text) for _, text in chunks) <= chunk_size
+
+
+def test_chunk_sections_prefix_and_folded_headings():
+    sections = [("3 Method", []), ("3.1 Setup", ["Short text."]), ("4 Results", ["More text."])]
+    chunks = list(chunk_sections(get_text_splitter(256, 0, segmenter="Regex"), sections, 256))
+    assert chunks == [
+        ("3 Method / 3.1 Setup; 4 Results", "3 Method / 3.1 Setup\nShort text.\n\n4 Results\nMore text.")
+    ]
+
+
+def test_chunk_sections_overlap():
+    sentences = [f"Sentence number {i} of the section." for i in range(30)]
+    sections = [("Intro", [" ".join(sentences)])]
+    text_splitter = get_text_splitter(200, 0, segmenter="Regex")
+
+    without = [text for _, text in chunk_sections(text_splitter, sections, 200)]
+    with_overlap = [text for _, text in chunk_sections(text_splitter, sections, 200, 80)]
+    assert len(with_overlap) > len(without)
+    for previous, following in zip(with_overlap, with_overlap[1:]):
+        first = following[len("Intro\n") :].split(". ")[0] + "."
+        assert first in previous
+    for previous, following in zip(without, without[1:]):
+        first = following[len("Intro\n") :].split(". ")[0] + "."
+        assert first not in previous
+    # Every sentence is kept.
+    assert all(any(sentence in text for text in with_overlap) for sentence in sentences)
+
+
+def _make_pdf(path, pages):
+    doc = fitz.open()
+    for text in pages:
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), text, fontsize=10)
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def _metadata(arxiv_id):
+    return {
+        "paper_id": f"{arxiv_id}v1",
+        "arxiv_id": arxiv_id,
+        "title": f"Paper {arxiv_id}",
+        "authors": "A. Author",
+        "date": "2024-01-01",
+    }
+
+
+def test_run_only_marks_written_papers_indexed(tmp_path, vectordb, embeddings, monkeypatch):
+    embeddings.fail_on = "Unwritable"
+    pdf_files = [
+        _make_pdf(tmp_path / "2401.00001.pdf", ["A paper about attention. " * 20]),
+        _make_pdf(tmp_path / "2401.00002.pdf", ["Unwritable paper about transformers. " * 20]),
+    ]
+    papers = [_metadata("2401.00001"), _metadata("2401.00002")]
+    indexer = IndexNewArxivPapers(vectordb, segmenter="Regex")
+    monkeypatch.setattr(indexer, "_get_paper_ids", lambda query: ["2401.00001", "2401.00002"])
+    monkeypatch.setattr(indexer, "_fetch_papers", lambda ids: papers)
+    monkeypatch.setattr(indexer, "_download", lambda papers: (pdf_files, papers))
+
+    indexer._run("attention")
+
+    assert indexer._indexed_ids == {"2401.00001"}
+    # The failed paper is looked up, and indexed, again by the next query that finds it.
+    assert indexer._filter_indexed(["2401.00001", "2401.00002"]) == ["2401.00002"]
+
+
+def test_process_returns_documents_in_file_order_with_workers(tmp_path, vectordb):
+    ids = [f"2401.0000{i}" for i in range(1, 5)]
+    # The first paper is by far the longest, so the pool finishes it last.
+    pdf_files = [_make_pdf(tmp_path / f"{ids[0]}.pdf", ["A long paper about attention. " * 100] * 30)]
+    pdf_files += [
+        _make_pdf(tmp_path / f"{id}.pdf", [f"A short paper number {id}. " * 10]) for id in ids[1:]
+    ]
+    metadatas = [_metadata(id) for id in ids]
+
+    pooled = ProcessPDF(vectordb, segmenter="Regex", chunk_size=256, chunk_overlap=0, n_workers=2)
+    docs = pooled.process(pdf_files, metadatas)
+    serial = ProcessPDF(vectordb, segmenter="Regex", chunk_size=256, chunk_overlap=0, n_workers=1)
+    expected = serial.process(pdf_files, metadatas)
+
+    assert list(dict.fromkeys(doc.metadata["arxiv_id"] for doc in docs)) == ids
+    assert [doc.metadata["chunk_id"] for doc in docs] == [
+        doc.metadata["chunk_id"] for doc in expected
+    ]
+
+
+def test_arun_keeps_the_event_loop_responsive(tmp_path, vectordb, monkeypatch):
+    # Another session keeps being served while every blocking stage of _arun sleeps.
+    ids = ["2401.00001", "2401.00002"]
+    pdf_files = [_make_pdf(tmp_path / f"{id}.pdf", [f"A paper numbered {id}. " * 20]) for id in ids]
+    papers = [_metadata(id) for id in ids]
+
+    def slow(result):
+        def stage(*args):
+            time.sleep(0.2)
+            return result
+
+        return stage
+
+    indexer = IndexNewArxivPapers(vectordb, segmenter="Regex")
+    monkeypatch.setattr(indexer, "_get_paper_ids", slow(ids))
+    monkeypatch.setattr(indexer, "_fetch_papers", slow(papers))
+    monkeypatch.setattr(indexer, "_download", slow((pdf_files, papers)))
+    processor = ProcessPDF(vectordb, segmenter="Regex")
+    iter_documents = processor._iter_documents
+
+    def slow_iter_documents(*args):
+        for item in iter_documents(*args):
+            time.sleep(0.2)
+            yield item
+
+    monkeypatch.setattr(processor, "_iter_documents", slow_iter_documents)
+    monkeypatch.setattr(indexer, "_processor", slow(processor))
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        ticks = []
+        task = asyncio.create_task(indexer._arun("attention"))
+        while not task.done():
+            ticks.append(loop.time())
+            await asyncio.sleep(0.01)
+        await task
+        return ticks
+
+    ticks = asyncio.run(run())
+
+    assert ticks[-1] - ticks[0] >= 1.2
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.15
+    assert indexer._indexed_ids == set(ids)
+
+
+class FakeSearch:
+    def __init__(self, links):
+        self.links = links
+        self.queries = []
+
+    def results(self, query, n):
+        self.queries.append(query)
+        return [{"link": link} for link in self.links.get(query.strip(), [])[:n]]
+
+
+class FakeArxivClient:
+    def __init__(self, ids):
+        self.ids = ids
+        self.searches = []
+
+    def results(self, search):
+        self.searches.append(list(search.id_list))
+        return [
+            SimpleNamespace(
+                entry_id=f"http://arxiv.org/abs/{id}v2",
+                title=f"Paper {id}",
+                authors=[SimpleNamespace(name="A. Author"), SimpleNamespace(name="B. Author")],
+                published=datetime(2024, 1, 1),
+                summary="An abstract.",
+                pdf_url=f"http://arxiv.org/pdf/{id}v2",
+            )
+            for id in search.id_list
+            if id in self.ids
+        ]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr("arxiv_bot.cache.time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def lookups(tmp_path, monkeypatch, clock):
+    cache = TTLCache(path=str(tmp_path / "lookups.sqlite"), ttls={"search": 60, "arxiv": 3600})
+    monkeypatch.setattr("arxiv_bot.search.lookup_cache", cache)
+    monkeypatch.setattr(IndexNewArxivPapers, "lookup_cache", cache)
+    return cache
+
+
+def test_fetch_arxiv_metadata_only_queries_uncached_ids(lookups, monkeypatch):
+    client = FakeArxivClient(["2401.00001", "2401.00002", "2401.00003"])
+    monkeypatch.setattr("arxiv_bot.search.arxiv_client", client)
+
+    first = fetch_arxiv_metadata(["2401.00001", "2401.00002"])
+    assert first["2401.00001"] == {
+        "paper_id": "2401.00001v2",
+        "arxiv_id": "2401.00001",
+        "title": "Paper 2401.00001",
+        "authors": "A. Author, B. Author",
+        "date": "2024-01-01",
+        "abstract": "An abstract.",
+        "pdf_url": "http://arxiv.org/pdf/2401.00001v2",
+    }
+    fetch_arxiv_metadata(["2401.00002", "2401.00003"])
+    assert fetch_arxiv_metadata(["2401.00001", "2401.00003"]).keys() == {"2401.00001", "2401.00003"}
+    assert fetch_arxiv_metadata(["2401.00004"], cached_only=True) == {}
+    assert client.searches == [["2401.00001", "2401.00002"], ["2401.00003"]]
+
+
+def test_get_paper_ids_caches_search_results(vectordb, lookups, clock, monkeypatch):
+    links = ["https://arxiv.org/abs/2401.00001v2", "https://arxiv.org/pdf/2401.00002", "https://example.com"]
+    search = FakeSearch({"attention": links})
+    monkeypatch.setattr(IndexNewArxivPapers, "google_api", search)
+    indexer = IndexNewArxivPapers(vectordb, n_search_results=3)
+
+    assert sorted(indexer._get_paper_ids("attention")) == ["2401.00001", "2401.00002"]
+    assert sorted(indexer._get_paper_ids(" attention ")) == ["2401.00001", "2401.00002"]
+    assert len(search.queries) == 1
+    # The number of results is part of the key.
+    IndexNewArxivPapers(vectordb, n_search_results=1)._get_paper_ids("attention")
+    assert len(search.queries) == 2
+    # Queries without papers are not cached.
+    for _ in range(2):
+        with pytest.raises(IndexError):
+            indexer._get_paper_ids("nothing")
+    assert len(search.queries) == 4
+
+    clock[0] += 61
+    indexer._get_paper_ids("attention")
+    assert len(search.queries) == 5
+
+
+def test_run_skips_search_and_arxiv_for_known_papers(tmp_path, vectordb, lookups, monkeypatch):
+    ids = ["2401.00001", "2401.00002"]
+    search = FakeSearch({"attention": [f"https://arxiv.org/abs/{id}" for id in ids]})
+    client = FakeArxivClient(ids)
+    monkeypatch.setattr(IndexNewArxivPapers, "google_api", search)
+    monkeypatch.setattr("arxiv_bot.search.arxiv_client", client)
+    indexer = IndexNewArxivPapers(vectordb, segmenter="Regex")
+
+    def download(papers):
+        pdf_files = [
+            _make_pdf(tmp_path / f"{paper['paper_id']}.pdf", [f"{paper['title']}. " * 20])
+            for paper in papers
+        ]
+        metadatas = [{key: value for key, value in paper.items() if key != "pdf_url"} for paper in papers]
+        return pdf_files, metadatas
+
+    monkeypatch.setattr(indexer, "_download", download)
+
+    indexer._run("attention")
+    assert indexer._indexed_ids == set(ids)
+    indexer._run("attention")
+    IndexNewArxivPapers(vectordb, segmenter="Regex")._run("attention")
+
+    assert search.queries == ["attention"]
+    assert [sorted(id_list) for id_list in client.searches] == [ids]
+
+
+def _stored_ids(vectordb, paper_id):
+    return vectordb.get(where={"paper_id": paper_id}, include=[])["ids"]
+
+
+def test_reprocessing_a_pdf_is_idempotent(tmp_path, vectordb, embeddings):
+    pages = [f"Page {i} about attention. " * 40 for i in range(3)]
+    pdf_file = _make_pdf(tmp_path / "2401.00001.pdf", pages)
+    processor = ProcessPDF(vectordb, segmenter="Regex", chunk_size=256, chunk_overlap=0)
+
+    def process():
+        return [doc.metadata["chunk_id"] for doc in processor.process([pdf_file], [_metadata("2401.00001")])]
+
+    first = process()
+    embeddings.calls.clear()
+    second = process()
+
+    assert len(first) > 1
+    assert second == first
+    assert embeddings.calls == []
+    assert sorted(_stored_ids(vectordb, "2401.00001v1")) == sorted(first)
+    # The ID depends on the paper, the position and the content of the chunk.
+    assert ProcessPDF._chunk_id("a", 0, "text") == ProcessPDF._chunk_id("a", 0, "text")
+    keys = [("a", 0, "text"), ("b", 0, "text"), ("a", 1, "text"), ("a", 0, "text.")]
+    assert len({ProcessPDF._chunk_id(*key) for key in keys}) == 4
+
+
+def test_stale_chunks_are_deleted_only_after_every_write(tmp_path, vectordb, embeddings):
+    path = tmp_path / "2401.00001.pdf"
+    processor = ProcessPDF(vectordb, segmenter="Regex", chunk_size=256, chunk_overlap=0)
+    old = processor.process([_make_pdf(path, ["The first version. " * 40])], [_metadata("2401.00001")])
+
+    embeddings.fail_on = "Unwritable"
+    pdf_file = _make_pdf(path, ["The second version. " * 20 + "Unwritable. " + "More text. " * 20])
+    new = processor.process([pdf_file], [_metadata("2401.00001")])
+    assert processor.file_status == {pdf_file: "failed"}
+    assert sorted(_stored_ids(vectordb, "2401.00001v1")) == sorted(doc.metadata["chunk_id"] for doc in old)
+
+    embeddings.fail_on = ""
+    processor.process([pdf_file], [_metadata("2401.00001")])
+    assert processor.file_status == {pdf_file: "indexed"}
+    assert sorted(_stored_ids(vectordb, "2401.00001v1")) == sorted(doc.metadata["chunk_id"] for doc in new)
+
+
+def test_upsert_invalidates_the_query_cache_when_chunks_change(tmp_path, vectordb, embeddings, monkeypatch):
+    cache = SemanticQueryCache()
+    monkeypatch.setattr("arxiv_bot.search.query_cache", cache)
+    query = embeddings.embed_query("attention")
+    path = tmp_path / "2401.00001.pdf"
+    processor = ProcessPDF(vectordb, segmenter="Regex", chunk_size=256, chunk_overlap=0)
+
+    cache.put(query, "public", ["c1"])
+    processor.process([_make_pdf(path, ["The first version. " * 40])], [_metadata("2401.00001")])
+    assert cache.get(query, "public") is None
+
+    # Re-processing an unchanged paper writes nothing, so the cached results stay valid.
+    cache.put(query, "public", ["c1"])
+    processor.process([str(path)], [_metadata("2401.00001")])
+    assert cache.get(query, "public") == ["c1"]
+
+    processor.process([_make_pdf(path, ["The second version. " * 40])], [_metadata("2401.00001")])
+    assert cache.get(query, "public") is None
+    assert cache.generation == 2
+
+
+class FakeGrobid:
+    def __init__(self, teis):
+        self.teis = teis
+        self.batches = []
+
+    def process_batch(self, service, pdf_paths):
+        self.batches.append((service, list(pdf_paths)))
+        return [(path, 200 if path in self.teis else 500, self.teis.get(path)) for path in pdf_paths]
+
+
+def test_metadata_resolver_falls_back_source_by_source(tmp_path, lookups, monkeypatch):
+    body = ["Some body text of the paper. " * 10]
+    names = ["2401.00001", "2401.00002", "info", "page", "header", "2401.00009"]
+    paths = {name: str(tmp_path / f"{name}.pdf") for name in names}
+    for name in ["2401.00001", "2401.00002", "header", "2401.00009"]:
+        _make_pdf(paths[name], body)
+    with fitz.open() as doc:
+        doc.new_page().insert_textbox(fitz.Rect(50, 50, 550, 800), body[0], fontsize=10)
+        doc.set_metadata({"title": "A Title From the Information Dictionary", "author": "C. Author"})
+        doc.save(paths["info"])
+    with fitz.open() as doc:
+        page = doc.new_page()
+        page.insert_text((50, 80), "A Title Set in a Large Font", fontsize=24)
+        page.insert_textbox(fitz.Rect(50, 120, 550, 800), body[0] * 3, fontsize=10)
+        doc.save(paths["page"])
+
+    lookups.put("arxiv", "2401.00001", {**_metadata("2401.00001"), "abstract": "Cached."})
+    client = FakeArxivClient(["2401.00002"])
+    monkeypatch.setattr("arxiv_bot.search.arxiv_client", client)
+    tei = b'''<TEI xmlns="http://www.tei-c.org/ns/1.0"><teiHeader><fileDesc><titleStmt>
+        <title>A Title From GROBID</title></titleStmt></fileDesc></teiHeader></TEI>'''
+    grobid = FakeGrobid({paths["header"]: tei})
+    resolver = MetadataResolver(grobid, sources=list(MetadataResolver.SOURCES))
+    seen = []
+    from_pdf = resolver._from_pdf
+
+    def spy(source, pdf_paths, paper_ids):
+        seen.append((source, sorted(paper_ids.values())))
+        return from_pdf(source, pdf_paths, paper_ids)
+
+    monkeypatch.setattr(resolver, "_from_pdf", spy)
+
+    metadatas = resolver.resolve(list(paths.values()), list(paths))
+
+    assert [metadata["title"] for metadata in metadatas] == [
+        "Paper 2401.00001",
+        "Paper 2401.00002",
+        "A Title From the Information Dictionary",
+        "A Title Set in a Large Font",
+        "A Title From GROBID",
+        "2401.00009",
+    ]
+    assert [metadata["paper_id"] for metadata in metadatas] == list(paths)
+    assert metadatas[0]["abstract"] == "Cached."
+    assert metadatas[2]["authors"] == "C. Author"
+    # Each source only sees the PDFs the sources before it could not resolve.
+    assert client.searches == [["2401.00002", "2401.00009"]]
+    assert seen == [
+        ("pdf_info", ["2401.00009", "header", "info", "page"]),
+        ("first_page", ["2401.00009", "header", "page"]),
+    ]
+    assert grobid.batches == [("processHeaderDocument", [paths["header"], paths["2401.00009"]])]
+    assert {source: stats["hits"] for source, stats in resolver.stats().items()} == {
+        "cache": 1,
+        "arxiv": 1,
+        "pdf_info": 1,
+        "first_page": 1,
+        "grobid": 2,
+    }
+
+
+TEI_PATH = os.path.join(os.path.dirname(__file__), "data", "paper.tei.xml")
+
+
+def _soup_fields(tei):
+    """The fields of a TEI document read with the BeautifulSoup baseline."""
+    soup = read_tei(tei)
+
+    def block(elem):
+        return " ".join(elem.getText().split())
+
+    def caption(figure):
+        parts = [figure.find(name, recursive=False) for name in ("head", "figDesc")]
+        return ": ".join(text for text in (block(part) for part in parts if part is not None) if text)
+
+    def name(author, path, **attrs):
+        elem = author.find(path, **attrs)
+        return "" if elem is None else elem.getText().strip()
+
+    authors = []
+    for author in soup.analytic.find_all("author"):
+        parts = [name(author, "forename", type="first"), name(author, "forename", type="middle")]
+        authors.append(" ".join(part for part in [*parts, name(author, "surname")] if part))
+
+    sections = []
+    for div in soup.body.find_all("div"):
+        if div.get("type"):
+            continue
+        heading, blocks = "", []
+        for child in div.find_all(recursive=False):
+            if child.name == "head":
+                heading = " ".join(part for part in (child.get("n", ""), block(child)) if part)
+            elif child.name == "figure":
+                blocks.append(caption(child))
+            elif child.name != "div":
+                blocks.append(block(child))
+        sections.append((heading, [block for block in blocks if block]))
+    captions = [caption(figure) for figure in soup.body.find_all("figure", recursive=False)]
+    if any(captions):
+        sections.append((TEIFile.FIGURES_SECTION, [caption for caption in captions if caption]))
+
+    doi = soup.find("idno", type="DOI")
+    return {
+        "doi": "" if doi is None else doi.getText(),
+        "title": soup.title.getText(),
+        "published": soup.date.get("when") or "",
+        "abstract": soup.abstract.getText(separator=" ", strip=True),
+        "authors": authors,
+        "text": "\n\n".join(
+            div.getText(separator=": ", strip=True).replace("\n", "")
+            for div in soup.body.find_all("div")
+            if not div.get("type")
+        ),
+        "sections": sections,
+    }
+
+
+@pytest.mark.parametrize("from_bytes", [False, True])
+def test_tei_file_matches_the_soup_baseline(from_bytes):
+    source = open(TEI_PATH, "rb").read() if from_bytes else TEI_PATH
+    tei = TEIFile(source)
+    expected = _soup_fields(source)
+
+    assert {field: getattr(tei, field) for field in expected} == expected
+    assert tei.title == "Attention Is All You Need"
+    assert tei.authors == ["Ashish Vaswani", "Noam M Shazeer", "Niki Parmar"]
+    assert [heading for heading, _ in tei.sections] == [
+        "1 Introduction",
+        "2 Background",
+        "3.2.1 Scaled Dot-Product Attention",
+        "",
+        "4 Why Self-Attention",
+        TEIFile.FIGURES_SECTION,
+    ]
+    assert tei.sections[2][1][-1].startswith("Figure 2 :: (left) Scaled Dot-Product Attention.")
+    assert [caption.split(":")[0] for caption in tei.sections[-1][1]] == ["Figure 1 ", "Table 1 "]
+    assert "Acknowledgements" not in tei.text and "Long short-term memory" not in tei.text
+
+
+def test_tei_metadata():
+    with open(TEI_PATH, "rb") as file:
+        metadata = tei_metadata("1706.03762", file.read())
+    assert metadata["title"] == "Attention Is All You Need"
+    assert metadata["authors"] == "Ashish Vaswani, Noam M Shazeer, Niki Parmar"
+    assert metadata["date"] == "2017-06-12"
+    assert metadata["abstract"].startswith("The dominant sequence transduction models")
+    assert tei_metadata("1706.03762", b"<TEI") == {
+        "paper_id": "1706.03762",
+        "title": "1706.03762",
+        "authors": "",
+        "date": "",
+        "abstract": "",
+    }
@@ -0,0 +1,25 @@
+from arxiv_bot.vectorstores import mmr_select
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("fetch_k", [1, 5, 20, 100])
+@pytest.mark.parametrize("lambda_mult", [0.0, 0.5, 1.0])
+def test_mmr_select_matches_langchain(fetch_k, lambda_mult):
+    rng = np.random.default_rng(fetch_k)
+    for _ in range(10):
+        query = rng.normal(size=64).astype(np.float32)
+        candidates = rng.normal(size=(fetch_k, 64)).astype(np.float32)
+        expected = maximal_marginal_relevance(query, candidates, lambda_mult=lambda_mult, k=4)
+        assert mmr_select(query, candidates, k=4, lambda_mult=lambda_mult) == expected
+
+
+def test_mmr_select_skips_duplicates():
+    query = [1.0, 0.0]
+    candidates = [[1.0, 0.0], [1.0, 0.0], [0.7, 0.7]]
+    assert mmr_select(query, candidates, k=2, lambda_mult=0.25) == [0, 2]
+
+
+def test_mmr_select_empty():
+    assert mmr_select([1.0, 0.0], np.zeros((0, 2)), k=3) == []